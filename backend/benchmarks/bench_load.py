@@ -0,0 +1,389 @@
+"""
+Load test: drives the whole FastAPI app in-process against a fake Firestore and a fake
+market data source, and measures latency (p50/p95/p99) and throughput of the hot paths
+at increasing concurrency.
+
+Run from the backend folder:
+    python -m benchmarks.bench_load
+    python -m benchmarks.bench_load --concurrency 1,16,64 --requests 500 --output before.json
+    python -m benchmarks.bench_load --output after.json --compare before.json
+
+Scenarios (pick some with --scenarios):
+    quote          GET  /api/stocks/stocks?stock_symbols=AAPL
+    quote-batch    GET  /api/stocks/stocks with a 20 symbol watchlist
+    search         GET  /api/stocks/search-stock
+    price-history  GET  /api/stocks/stocks/{symbol} (10 years of daily bars from the history store)
+    buy-sell       POST /api/trades/buy and /api/trades/sell (market orders), one user per client
+    trade-history  GET  /api/trades/history
+    fan-out        /ws/stock-updates: one quote broadcast to every connected websocket; concurrency
+                   is the number of sockets and latency is broadcast -> delivered to the socket
+
+Results are written as JSON (see --output). --compare prints the change against an earlier
+results file and exits with status 1 if p95 latency or throughput got worse than --max-regression.
+
+Nothing leaves the process: Firestore and Yahoo are replaced by benchmarks/fakes.py
+(use --db-latency / --market-latency to give them a realistic round trip time), ID tokens
+are pre-verified bench tokens, and the price history store lives in a temporary folder.
+"""
+import os
+import tempfile
+
+# Settings are read when config.settings is first imported, so these have to be set before
+# anything from the app is imported
+os.environ.setdefault("HISTORY_DIR", tempfile.mkdtemp(prefix="bench-history-"))
+os.environ.setdefault("SYMBOL_UNIVERSE_DOWNLOAD", "false")
+os.environ.setdefault("FIREBASE_PROJECT_ID", "bench-project")
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+import argparse
+import asyncio
+import json
+import platform
+import subprocess
+import sys
+import time
+from collections import Counter
+from datetime import datetime, timezone
+import httpx
+import numpy as np
+from benchmarks import fakes
+
+SCENARIOS = ["quote", "quote-batch", "search", "price-history", "buy-sell", "trade-history", "fan-out"]
+
+SYMBOLS = ["AAPL", "MSFT", "NVDA", "AMZN", "GOOGL", "META", "TSLA", "JPM", "V", "XOM",
+           "JNJ", "WMT", "PG", "MA", "HD", "KO", "PEP", "COST", "NFLX", "DIS"]
+
+# What people type into the search box, keystroke by keystroke
+SEARCH_QUERIES = ["a", "ap", "app", "appl", "m", "mi", "micro", "nv", "nvda", "tes", "tesla",
+                  "goog", "alphabet", "jp", "bank", "coca", "mircosoft", "amzon"]
+
+STARTING_BALANCE = 500000.0
+
+# Trades in each user's ledger before the trade-history scenario runs (if buy-sell hasn't added any)
+SEEDED_TRADES = 200
+
+
+def bench_token(user: int):
+    return f"bench-token-{user}"
+
+
+def bench_uid(user: int):
+    return f"bench-user-{user}"
+
+
+def seed_users(db, users: int):
+    """Create user documents and mark their bench tokens as verified"""
+    from services.token_service import token_verifier, _token_hash
+
+    now = time.time()
+    for user in range(users):
+        uid = bench_uid(user)
+        db.collection("users").document(uid).set({
+            "id": uid,
+            "email": f"{uid}@bench.local",
+            "initial_balance": STARTING_BALANCE,
+            "starting_balance": STARTING_BALANCE,
+            "portfolio": {},
+            "ledger_seq": 0
+        })
+        # Same entry TokenVerifier.verify() leaves behind: (claims, exp, last revocation check)
+        token_verifier.cache[_token_hash(bench_token(user))] = ({"uid": uid}, now + 24 * 3600, now)
+
+
+def seed_ledgers(users: int, trades: int):
+    from services.stock_service import execute_orders
+
+    for user in range(users):
+        symbol = SYMBOLS[user % len(SYMBOLS)]
+        orders = []
+        for i in range(trades):
+            side = "BUY" if i % 2 == 0 else "SELL"
+            orders.append({"side": side, "symbol": symbol, "quantity": 1, "price": 100.0 + i % 7})
+        # Commits are kept well under Firestore's 500 writes
+        for start in range(0, len(orders), 100):
+            execute_orders(bench_uid(user), orders[start:start + 100])
+
+
+class AsgiWebSocket:
+    """
+    Minimal in-process websocket client: runs the app's websocket handler as a task on this
+    event loop and hands every message the server sends to on_message.
+    """
+
+    def __init__(self, app, path: str, on_message):
+        self.app = app
+        self.path = path
+        self.on_message = on_message
+        self.incoming = asyncio.Queue()
+        self.accepted = asyncio.Event()
+        self.task = None
+
+    async def connect(self):
+        scope = {
+            "type": "websocket", "asgi": {"version": "3.0"}, "scheme": "ws", "http_version": "1.1",
+            "path": self.path, "raw_path": self.path.encode(), "root_path": "", "query_string": b"",
+            "headers": [(b"host", b"bench")], "client": ("127.0.0.1", 0), "server": ("bench", 80),
+            "subprotocols": [], "state": {}
+        }
+        await self.incoming.put({"type": "websocket.connect"})
+        self.task = asyncio.create_task(self.app(scope, self.incoming.get, self._send))
+        await self.accepted.wait()
+
+    async def _send(self, message):
+        if message["type"] == "websocket.send":
+            self.on_message(json.loads(message.get("text") or message.get("bytes")))
+        elif message["type"] in ("websocket.accept", "websocket.close"):
+            self.accepted.set()
+
+    async def close(self):
+        await self.incoming.put({"type": "websocket.disconnect", "code": 1000})
+        await asyncio.wait_for(self.task, 5)
+
+
+def summarize(latencies: list, errors: Counter, elapsed: float, concurrency: int, operations: int = None):
+    latencies_ms = np.array(latencies) * 1000 if latencies else np.array([np.nan])
+    operations = len(latencies) if operations is None else operations
+    p50, p95, p99 = np.percentile(latencies_ms, [50, 95, 99])
+    return {
+        "concurrency": concurrency,
+        "operations": operations,
+        "errors": sum(errors.values()),
+        "error_kinds": dict(errors),
+        "seconds": round(elapsed, 4),
+        "throughput_per_s": round(operations / elapsed, 2) if elapsed else None,
+        "latency_ms": {
+            "mean": round(float(np.mean(latencies_ms)), 3),
+            "p50": round(float(p50), 3),
+            "p95": round(float(p95), 3),
+            "p99": round(float(p99), 3),
+            "max": round(float(np.max(latencies_ms)), 3)
+        }
+    }
+
+
+async def run_closed_loop(call, concurrency: int, operations: int):
+    """
+    `concurrency` clients each send their next request as soon as the previous one answers,
+    until `operations` requests have been made. call(client, step) returns an HTTP status.
+    """
+    latencies = []
+    errors = Counter()
+    remaining = iter(range(operations))
+
+    async def client(number):
+        step = 0
+        for _ in remaining:
+            started = time.perf_counter()
+            try:
+                status = await call(number, step)
+            except Exception as e:
+                status = type(e).__name__
+            latencies.append(time.perf_counter() - started)
+            if status not in (200, 201):
+                errors[str(status)] += 1
+            step += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(client(number) for number in range(concurrency)))
+    return summarize(latencies, errors, time.perf_counter() - started, concurrency)
+
+
+def make_http_scenarios(http: httpx.AsyncClient):
+    async def get(url, user=None, **params):
+        headers = {"Authorization": bench_token(user)} if user is not None else None
+        return (await http.get(url, params=params, headers=headers)).status_code
+
+    async def quote(client, step):
+        return await get("/api/stocks/stocks", stock_symbols=SYMBOLS[(client + step) % len(SYMBOLS)])
+
+    async def quote_batch(client, step):
+        return await get("/api/stocks/stocks", stock_symbols=",".join(SYMBOLS))
+
+    async def search(client, step):
+        return await get("/api/stocks/search-stock", symbol=SEARCH_QUERIES[(client + step) % len(SEARCH_QUERIES)])
+
+    async def price_history(client, step):
+        symbol = SYMBOLS[(client + step) % len(SYMBOLS)]
+        return await get(f"/api/stocks/stocks/{symbol}", start="2015-01-01", end="2025-01-01")
+
+    async def buy_sell(client, step):
+        # Every client trades as its own user, buying one share and then selling it again
+        side = "buy" if step % 2 == 0 else "sell"
+        response = await http.post(f"/api/trades/{side}", headers={"Authorization": bench_token(client)},
+                                   json={"symbol": SYMBOLS[client % len(SYMBOLS)], "quantity": 1})
+        return response.status_code
+
+    async def trade_history(client, step):
+        return await get("/api/trades/history", user=client, limit=50)
+
+    return {
+        "quote": quote,
+        "quote-batch": quote_batch,
+        "search": search,
+        "price-history": price_history,
+        "buy-sell": buy_sell,
+        "trade-history": trade_history
+    }
+
+
+async def run_fan_out(app, hub, clients: int, messages: int, timeout: float = 10.0):
+    """Connect `clients` sockets to one symbol and time each broadcast until every socket has it"""
+    symbol = "AAPL"
+    latencies = []
+    errors = Counter()
+    received = {"count": 0}
+    all_received = asyncio.Event()
+
+    def on_message(message):
+        sent = message.get("bench_sent")
+        if sent is None:
+            # A regular poll from the hub, not one of ours
+            return
+        latencies.append(time.perf_counter() - sent)
+        received["count"] += 1
+        if received["count"] == clients:
+            all_received.set()
+
+    sockets = [AsgiWebSocket(app, f"/ws/stock-updates/{symbol}", on_message) for _ in range(clients)]
+    await asyncio.gather(*(socket.connect() for socket in sockets))
+
+    started = time.perf_counter()
+    for seq in range(messages):
+        received["count"] = 0
+        all_received.clear()
+        hub.broadcast(symbol, {"symbol": symbol, "price": 100.0 + seq % 10, "bench_seq": seq,
+                               "bench_sent": time.perf_counter()})
+        try:
+            await asyncio.wait_for(all_received.wait(), timeout)
+        except asyncio.TimeoutError:
+            errors["undelivered"] += clients - received["count"]
+    elapsed = time.perf_counter() - started
+
+    dropped = sum(subscriber.dropped for subscriber in hub.registry.subscribers_for(symbol))
+    await asyncio.gather(*(socket.close() for socket in sockets))
+    if dropped:
+        errors["dropped"] += dropped
+    # Throughput is messages delivered to sockets per second
+    return summarize(latencies, errors, elapsed, clients, operations=len(latencies))
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except Exception:
+        return None
+
+
+async def run(args, db, provider):
+    from main import app
+    from services.quote_cache import quote_cache
+    from services.quote_hub import quote_hub
+    from services.upstream import market_data, database
+
+    results = {}
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as http:
+        scenarios = make_http_scenarios(http)
+        for name in args.scenarios:
+            if name == "trade-history" and "buy-sell" not in args.scenarios:
+                # Nothing has traded yet, give every user a ledger to page through
+                seed_ledgers(max(args.concurrency), SEEDED_TRADES)
+
+            levels = []
+            for concurrency in args.concurrency:
+                if name == "fan-out":
+                    level = await run_fan_out(app, quote_hub, concurrency, args.messages)
+                else:
+                    # Warm up (fills the caches and the history store), then measure
+                    await run_closed_loop(scenarios[name], min(concurrency, 4), args.warmup)
+                    level = await run_closed_loop(scenarios[name], concurrency, args.requests)
+                levels.append(level)
+                print(f"{name:>14} c={concurrency:<4} {level['throughput_per_s']:>10.1f}/s  "
+                      f"p50={level['latency_ms']['p50']:.2f}ms  p95={level['latency_ms']['p95']:.2f}ms  "
+                      f"p99={level['latency_ms']['p99']:.2f}ms  errors={level['errors']}", file=sys.stderr)
+            results[name] = levels
+
+    return {
+        "meta": {
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "settings": {
+                "concurrency": args.concurrency, "requests": args.requests, "warmup": args.warmup,
+                "messages": args.messages, "db_latency_ms": args.db_latency, "market_latency_ms": args.market_latency
+            }
+        },
+        "results": results,
+        "counters": {
+            "quote_cache": quote_cache.stats(),
+            "upstream": {"market_data": market_data.stats(), "database": database.stats()},
+            "firestore": {"calls": db.calls, "commits": db.commits, "retries": db.retries},
+            "market_data": {"info_calls": provider.info_calls, "history_calls": provider.history_calls}
+        }
+    }
+
+
+def compare(current: dict, baseline: dict, max_regression: float):
+    """Print the change per scenario and concurrency. Returns the number of regressions."""
+    regressions = 0
+    print(f"{'scenario':>14} {'conc':>5} {'p95 ms':>18} {'change':>8} {'per second':>22} {'change':>8}")
+    for name, levels in current["results"].items():
+        before = {level["concurrency"]: level for level in baseline.get("results", {}).get(name, [])}
+        for level in levels:
+            old = before.get(level["concurrency"])
+            if old is None:
+                continue
+            p95, old_p95 = level["latency_ms"]["p95"], old["latency_ms"]["p95"]
+            rate, old_rate = level["throughput_per_s"] or 0, old["throughput_per_s"] or 0
+            p95_change = (p95 - old_p95) / old_p95 * 100 if old_p95 else 0.0
+            rate_change = (rate - old_rate) / old_rate * 100 if old_rate else 0.0
+            worse = p95_change > max_regression or rate_change < -max_regression
+            regressions += worse
+            print(f"{name:>14} {level['concurrency']:>5} {old_p95:>8.2f} -> {p95:<7.2f} {p95_change:>+7.1f}% "
+                  f"{old_rate:>10.1f} -> {rate:<9.1f} {rate_change:>+7.1f}%{'  REGRESSION' if worse else ''}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS),
+                        help=f"comma separated, any of {','.join(SCENARIOS)}")
+    parser.add_argument("--concurrency", default="1,4,16,64", help="comma separated client counts")
+    parser.add_argument("--requests", type=int, default=400, help="requests per scenario and concurrency level")
+    parser.add_argument("--warmup", type=int, default=20, help="unmeasured requests before each level")
+    parser.add_argument("--messages", type=int, default=50, help="broadcasts per fan-out level")
+    parser.add_argument("--db-latency", type=float, default=0.0, help="added to every fake Firestore call (ms)")
+    parser.add_argument("--market-latency", type=float, default=0.0, help="added to every fake market data call (ms)")
+    parser.add_argument("--output", help="write the results here as JSON (default: print them)")
+    parser.add_argument("--compare", help="results JSON from an earlier run to compare against")
+    parser.add_argument("--max-regression", type=float, default=10.0,
+                        help="percent p95/throughput change counted as a regression by --compare")
+    args = parser.parse_args()
+    args.scenarios = [name.strip() for name in args.scenarios.split(",") if name.strip()]
+    args.concurrency = [int(value) for value in args.concurrency.split(",")]
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+
+    db, provider = fakes.install(db_latency=args.db_latency / 1000, market_latency=args.market_latency / 1000)
+    seed_users(db, max(args.concurrency))
+    results = asyncio.run(run(args, db, provider))
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    else:
+        print(json.dumps(results, indent=2))
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if compare(results, baseline, args.max_regression):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+"""
+Micro-benchmark: cost of verifying a Firebase ID token on a protected request,
+with full verification on every request (before) vs the cached TokenVerifier (after).
+
+Run from the backend folder:
+    python -m benchmarks.bench_token_verify
+
+Uses a locally generated RSA key and certificate, so no network or Firebase project is needed.
+"""
+import argparse
+import datetime
+import json
+import time
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from cryptography.x509.oid import NameOID
+from fastapi import FastAPI, Depends, Header, HTTPException
+from fastapi.testclient import TestClient
+from google.auth import crypt, jwt
+from services.token_service import TokenVerifier, ISSUER_PREFIX
+
+PROJECT_ID = "bench-project"
+KEY_ID = "bench-key"
+
+
+def make_key_and_certificate():
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, "bench")])
+    now = datetime.datetime.now(datetime.timezone.utc)
+    certificate = (x509.CertificateBuilder()
+                   .subject_name(name).issuer_name(name)
+                   .public_key(key.public_key())
+                   .serial_number(x509.random_serial_number())
+                   .not_valid_before(now).not_valid_after(now + datetime.timedelta(days=1))
+                   .sign(key, hashes.SHA256()))
+    private_pem = key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8,
+                                    serialization.NoEncryption())
+    return private_pem, certificate.public_bytes(serialization.Encoding.PEM).decode()
+
+
+def make_token(private_pem, uid="bench-user"):
+    now = int(time.time())
+    signer = crypt.RSASigner.from_string(private_pem, key_id=KEY_ID)
+    payload = {
+        "iss": ISSUER_PREFIX + PROJECT_ID, "aud": PROJECT_ID, "sub": uid,
+        "iat": now, "exp": now + 3600, "auth_time": now
+    }
+    return jwt.encode(signer, payload).decode()
+
+
+def make_verifier(certificate, cached: bool):
+    verifier = TokenVerifier(project_id=PROJECT_ID, max_entries=10000 if cached else 0, check_revoked=False)
+    verifier.keys = {KEY_ID: certificate}
+    # Keys are preloaded, don't start the refresh thread during the benchmark
+    verifier.refresher = True
+    return verifier
+
+
+def time_calls(function, iterations):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        function()
+    return (time.perf_counter() - start) / iterations * 1e6  # microseconds per call
+
+
+def make_app(verifier):
+    # Same shape as routes.auth.verify_token + a protected route
+    app = FastAPI()
+
+    async def verify_token(authorization: str = Header(...)):
+        try:
+            return verifier.verify(authorization)["uid"]
+        except Exception:
+            raise HTTPException(status_code=401, detail="Invalid token")
+
+    @app.get("/protected-route")
+    async def protected_route(uid: str = Depends(verify_token)):
+        return {"uid": uid}
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--iterations", type=int, default=2000)
+    args = parser.parse_args()
+
+    private_pem, certificate = make_key_and_certificate()
+    token = make_token(private_pem)
+    results = {}
+
+    for label, cached in (("before_full_verify", False), ("after_cached", True)):
+        verifier = make_verifier(certificate, cached)
+        verifier.verify(token)  # warm up
+        verify_us = time_calls(lambda: verifier.verify(token), args.iterations)
+
+        client = TestClient(make_app(verifier))
+        headers = {"Authorization": token}
+        assert client.get("/protected-route", headers=headers).status_code == 200
+        request_us = time_calls(lambda: client.get("/protected-route", headers=headers), args.iterations // 4)
+
+        results[label] = {"verify_us": round(verify_us, 2), "request_us": round(request_us, 2)}
+
+    results["verify_speedup"] = round(results["before_full_verify"]["verify_us"] / results["after_cached"]["verify_us"], 1)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,339 @@
+"""
+In-process stand-ins for the services the backend talks to, used by the benchmarks:
+  - FakeFirestore:          the small part of the Firestore client API the backend uses, kept in memory
+  - FakeMarketDataProvider: deterministic synthetic quotes and price bars, no network
+
+Both can add an artificial delay per call so a run can look more like the real thing
+(Firestore and Yahoo are tens of milliseconds away, a dict lookup is not).
+
+install() swaps them into the app. Call it before the app makes its first database or market data
+call (the lifespan startup does both): Firebase is only set up on first use, so install() can give it
+an app without credentials, and get_db() and the trade code look up the Firestore client and
+transaction helpers it replaces when they run.
+"""
+import copy
+import threading
+import time
+import zlib
+from datetime import date, datetime, timezone
+import numpy as np
+import firebase_admin
+from firebase_admin import firestore
+from google.api_core.exceptions import AlreadyExists, Aborted, NotFound
+from services.market_provider import MarketDataProvider, BAR_COLUMNS, set_provider
+
+PROJECT_ID = "bench-project"
+
+
+# ---- Firestore ----
+
+class FakeSnapshot:
+    def __init__(self, doc_id: str, data):
+        self.id = doc_id
+        self._data = data
+
+    @property
+    def exists(self):
+        return self._data is not None
+
+    def to_dict(self):
+        return copy.deepcopy(self._data) if self._data is not None else None
+
+
+class FakeQuery:
+    """order_by / where / limit / stream over one collection"""
+
+    def __init__(self, db, path: str, filters=(), orders=(), count=None):
+        self.db = db
+        self.path = path
+        self.filters = list(filters)
+        self.orders = list(orders)
+        self.count = count
+
+    def _copy(self, **changes):
+        fields = {"filters": self.filters, "orders": self.orders, "count": self.count, **changes}
+        return FakeQuery(self.db, self.path, **fields)
+
+    def where(self, field: str, op: str, value):
+        return self._copy(filters=self.filters + [(field, op, value)])
+
+    def order_by(self, field: str, direction=firestore.Query.ASCENDING):
+        return self._copy(orders=self.orders + [(field, direction)])
+
+    def limit(self, count: int):
+        return self._copy(count=count)
+
+    def stream(self, transaction=None):
+        self.db.pause()
+        with self.db.lock:
+            docs = list(self.db.collections.get(self.path, {}).items())
+        for field, op, value in self.filters:
+            docs = [(doc_id, data) for doc_id, data in docs if field in data and _OPERATORS[op](data[field], value)]
+        # Sort by the last order first so earlier orders win (stable sort)
+        for field, direction in reversed(self.orders):
+            docs.sort(key=lambda item: item[1].get(field), reverse=direction == firestore.Query.DESCENDING)
+        if self.count is not None:
+            docs = docs[:self.count]
+        return iter([FakeSnapshot(doc_id, data) for doc_id, data in docs])
+
+
+_OPERATORS = {
+    "==": lambda a, b: a == b,
+    "<": lambda a, b: a < b,
+    "<=": lambda a, b: a <= b,
+    ">": lambda a, b: a > b,
+    ">=": lambda a, b: a >= b,
+}
+
+
+class FakeCollection(FakeQuery):
+    def __init__(self, db, path: str):
+        super().__init__(db, path)
+
+    def document(self, doc_id: str):
+        return FakeDocument(self.db, self.path, doc_id)
+
+
+class FakeDocument:
+    def __init__(self, db, collection_path: str, doc_id: str):
+        self.db = db
+        self.collection_path = collection_path
+        self.id = doc_id
+
+    def collection(self, name: str):
+        return FakeCollection(self.db, f"{self.collection_path}/{self.id}/{name}")
+
+    @property
+    def key(self):
+        return self.collection_path, self.id
+
+    def get(self, transaction=None):
+        self.db.pause()
+        with self.db.lock:
+            if transaction is not None:
+                # Remember what version we saw so the commit can detect a conflicting write
+                transaction.reads[self.key] = self.db.versions.get(self.key, 0)
+            return FakeSnapshot(self.id, self.db.collections.get(self.collection_path, {}).get(self.id))
+
+    def set(self, data: dict):
+        self.db.pause()
+        self.db.write([("set", self, data)])
+
+    def update(self, data: dict):
+        self.db.pause()
+        self.db.write([("update", self, data)])
+
+    def create(self, data: dict):
+        self.db.pause()
+        self.db.write([("create", self, data)])
+
+
+class FakeTransaction:
+    """Buffers writes and applies them all at once when the transactional function returns"""
+
+    def __init__(self, db):
+        self.db = db
+        self.reads = {}   # (collection path, id) -> version read
+        self.writes = []
+
+    def set(self, ref: FakeDocument, data: dict):
+        self.writes.append(("set", ref, data))
+
+    def update(self, ref: FakeDocument, data: dict):
+        self.writes.append(("update", ref, data))
+
+    def create(self, ref: FakeDocument, data: dict):
+        self.writes.append(("create", ref, data))
+
+
+class FakeFirestore:
+    """
+    Documents are kept as {collection path: {document id: data}}, e.g. "users/u1/ledger".
+    Like Firestore, transactions are optimistic: a commit fails if a document the transaction
+    read has been written since, and fake_transactional() runs the function again.
+    latency is added to every read and commit, in seconds.
+    """
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.collections = {}
+        self.versions = {}  # (collection path, id) -> number of writes so far
+        self.lock = threading.Lock()
+        self.stats_lock = threading.Lock()
+        self.calls = 0
+        self.commits = 0
+        self.retries = 0
+
+    def pause(self):
+        with self.stats_lock:
+            self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def collection(self, name: str):
+        return FakeCollection(self, name)
+
+    def transaction(self):
+        return FakeTransaction(self)
+
+    def get_all(self, references, transaction=None):
+        # One round trip for every document, like the real batch get
+        self.pause()
+        snapshots = []
+        with self.lock:
+            for ref in references:
+                if transaction is not None:
+                    transaction.reads[ref.key] = self.versions.get(ref.key, 0)
+                snapshots.append(FakeSnapshot(ref.id, self.collections.get(ref.collection_path, {}).get(ref.id)))
+        return iter(snapshots)
+
+    def write(self, writes, reads=None):
+        # Validate everything first so a failed create() leaves nothing half written
+        with self.lock:
+            for key, version in (reads or {}).items():
+                if self.versions.get(key, 0) != version:
+                    raise Aborted(f"Document {key[0]}/{key[1]} changed during the transaction")
+            for kind, ref, _ in writes:
+                exists = ref.id in self.collections.get(ref.collection_path, {})
+                if kind == "create" and exists:
+                    raise AlreadyExists(f"Document {ref.collection_path}/{ref.id} already exists")
+                if kind == "update" and not exists:
+                    raise NotFound(f"No document to update: {ref.collection_path}/{ref.id}")
+            # Stored documents are replaced, never changed in place, so snapshots stay as they were read
+            for kind, ref, data in writes:
+                documents = self.collections.setdefault(ref.collection_path, {})
+                if kind == "update":
+                    documents[ref.id] = {**documents[ref.id], **copy.deepcopy(data)}
+                else:
+                    documents[ref.id] = copy.deepcopy(data)
+                self.versions[ref.key] = self.versions.get(ref.key, 0) + 1
+            self.commits += 1
+
+
+# Same default as the Firestore client
+MAX_TRANSACTION_ATTEMPTS = 5
+
+
+def fake_transactional(function):
+    """Drop-in for firestore.transactional that works with FakeTransaction"""
+
+    def run(transaction: FakeTransaction):
+        db = transaction.db
+        for attempt in range(MAX_TRANSACTION_ATTEMPTS):
+            transaction.reads, transaction.writes = {}, []
+            result = function(transaction)
+            db.pause()  # the commit round trip
+            try:
+                db.write(transaction.writes, transaction.reads)
+                return result
+            except Aborted:
+                with db.stats_lock:
+                    db.retries += 1
+                if attempt == MAX_TRANSACTION_ATTEMPTS - 1:
+                    raise
+
+    return run
+
+
+# ---- Market data ----
+
+# Seconds per bar, used to lay out synthetic bars
+INTERVAL_SECONDS = {
+    "1m": 60, "2m": 120, "5m": 300, "15m": 900, "30m": 1800, "60m": 3600, "90m": 5400, "1h": 3600,
+    "1d": 86400, "5d": 5 * 86400, "1wk": 7 * 86400, "1mo": 30 * 86400, "3mo": 91 * 86400
+}
+
+
+def _base_price(symbol: str):
+    # Stable per symbol, between 20 and 520
+    return 20.0 + zlib.crc32(symbol.encode()) % 500
+
+
+def _price_at(symbol: str, seconds):
+    # Smooth, deterministic price path: the same timestamp always gets the same price,
+    # so gap-filled history lines up with what was stored before
+    phase = zlib.crc32(symbol.encode()) % 1000
+    t = np.asarray(seconds, dtype=np.float64)
+    return _base_price(symbol) * (1 + 0.2 * np.sin(t / (86400 * 40) + phase) + 0.02 * np.sin(t / 3600 + phase))
+
+
+class FakeMarketDataProvider(MarketDataProvider):
+    """Synthetic quotes and bars. latency is added to every call, in seconds."""
+    name = "fake"
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.info_calls = 0
+        self.history_calls = 0
+        self.lock = threading.Lock()
+
+    def get_info(self, symbol: str):
+        with self.lock:
+            self.info_calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+        symbol = symbol.upper()
+        now = time.time()
+        price = round(float(_price_at(symbol, now)), 2)
+        previous_close = round(float(_price_at(symbol, now - 86400)), 2)
+        return {
+            "symbol": symbol,
+            "shortName": f"{symbol} Inc.",
+            "sector": "Technology",
+            "industry": "Software",
+            "currentPrice": price,
+            "regularMarketPrice": price,
+            "regularMarketOpen": previous_close,
+            "dayHigh": max(price, previous_close),
+            "dayLow": min(price, previous_close),
+            "regularMarketDayHigh": max(price, previous_close),
+            "regularMarketDayLow": min(price, previous_close),
+            "regularMarketVolume": 1_000_000 + zlib.crc32(symbol.encode()) % 1_000_000,
+            "marketCap": price * 1e9,
+            "previousClose": previous_close,
+            "regularMarketChange": round(price - previous_close, 2),
+            "regularMarketChangePercent": round((price - previous_close) / previous_close * 100, 4)
+        }
+
+    def get_history(self, symbol: str, start: date, end: date, interval: str):
+        with self.lock:
+            self.history_calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+        symbol = symbol.upper()
+        step = INTERVAL_SECONDS[interval]
+        start_epoch = int(datetime(start.year, start.month, start.day, tzinfo=timezone.utc).timestamp())
+        end_epoch = min(int(datetime(end.year, end.month, end.day, tzinfo=timezone.utc).timestamp()), int(time.time()))
+        first = -(-start_epoch // step) * step  # first bar boundary at or after start
+        dates = np.arange(first, end_epoch, step, dtype=np.int64)
+        close = _price_at(symbol, dates)
+        previous = _price_at(symbol, dates - step)
+        bars = {
+            "date": dates,
+            "open": previous,
+            "high": np.maximum(previous, close) * 1.005,
+            "low": np.minimum(previous, close) * 0.995,
+            "close": close,
+            "volume": np.full(len(dates), 1_000_000.0)
+        }
+        return {column: bars[column] for column in ["date"] + BAR_COLUMNS}
+
+
+# ---- Wiring ----
+
+def install(db_latency: float = 0.0, market_latency: float = 0.0):
+    """
+    Point the app at a FakeFirestore and a FakeMarketDataProvider. Returns (db, provider).
+    Must run before the app starts talking to Firestore or the market data provider.
+    """
+    if not firebase_admin._apps:
+        # No service account needed: nothing ever talks to the real Firebase
+        firebase_admin.initialize_app(options={"projectId": PROJECT_ID})
+    db = FakeFirestore(latency=db_latency)
+    # services/firebase_service.get_db() calls firestore.client() every time,
+    # and stock_service looks up firestore.transactional when a trade runs
+    firestore.client = lambda *args, **kwargs: db
+    firestore.transactional = fake_transactional
+    provider = FakeMarketDataProvider(latency=market_latency)
+    set_provider(provider)
+    return db, provider
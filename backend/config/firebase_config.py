@@ -1,7 +1,4 @@
-from firebase_admin import credentials, initialize_app
-
-# Initialize Firebase with the service account key file
-cred = credentials.Certificate("../firebase/serviceAccountKey.json")
-
-# Initialize Firebase with the credentials
-initialize_app(cred) 
\ No newline at end of file
+# Firebase used to be initialized here as well, with a path relative to the working directory.
+# There is now one place that does it, on first use: services/firebase_service.py.
+# Importing this module has no side effects; the names are kept for old imports.
+from services.firebase_service import init_firebase, get_db
@@ -0,0 +1,43 @@
+import json
+import logging
+import sys
+from datetime import datetime, timezone
+from config.settings import LOG_LEVEL, LOG_FORMAT
+
+# Logging setup for the backend.
+#
+# Modules log through logging.getLogger(__name__) with %-style arguments, e.g.
+#     logger.warning("Error polling %s: %s", symbol, e)
+# so the message is only formatted if the record is actually written (a DEBUG line
+# costs almost nothing when the level is INFO). Anything passed in extra={...} becomes
+# its own field in the JSON output.
+
+# Attributes every LogRecord has; anything else on a record came from extra={...}
+_STANDARD_ATTRIBUTES = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord):
+        entry = {
+            "time": datetime.fromtimestamp(record.created, tz=timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage()
+        }
+        for key, value in vars(record).items():
+            if key not in _STANDARD_ATTRIBUTES and not key.startswith("_"):
+                entry[key] = value
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+def setup_logging(level: str = LOG_LEVEL, fmt: str = LOG_FORMAT):
+    handler = logging.StreamHandler(sys.stdout)
+    if fmt == "json":
+        handler.setFormatter(JsonFormatter())
+    else:
+        handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+    root = logging.getLogger()
+    root.handlers = [handler]
+    root.setLevel(level)
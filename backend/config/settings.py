@@ -0,0 +1,178 @@
+import os
+from dotenv import load_dotenv
+
+# Load variables from a .env file (if there is one) before reading any settings.
+# Every tunable in the backend is read from here so there is one place to look.
+load_dotenv()
+
+# ---- Quote cache ----
+# How long (in seconds) cached prices stay fresh. Prices move constantly so keep this short.
+QUOTE_PRICE_TTL = float(os.getenv("QUOTE_PRICE_TTL", "5"))
+# How long (in seconds) company profile fields (name, sector, industry...) stay fresh
+QUOTE_PROFILE_TTL = float(os.getenv("QUOTE_PROFILE_TTL", str(6 * 60 * 60)))
+# Maximum number of symbols kept in the cache before the least recently used is evicted
+QUOTE_CACHE_MAX_ENTRIES = int(os.getenv("QUOTE_CACHE_MAX_ENTRIES", "2000"))
+
+# ---- Price history store ----
+# Folder where downloaded OHLCV history is kept on disk (one folder per interval/symbol)
+HISTORY_DIR = os.getenv("HISTORY_DIR", os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "history"))
+# Today's bar keeps changing during the session; re-download it at most this often (seconds)
+HISTORY_TAIL_REFRESH = float(os.getenv("HISTORY_TAIL_REFRESH", "900"))
+
+# ---- Market data provider ----
+# Where quotes and price history come from:
+#   "yfinance" -> Yahoo Finance (live)
+#   "replay"   -> files recorded earlier in REPLAY_DIR, no network at all (load tests, replaying a trading day)
+MARKET_DATA_PROVIDER = os.getenv("MARKET_DATA_PROVIDER", "yfinance").lower()
+# When set, every quote and history answer from the live provider is also saved here, in the replay format
+MARKET_DATA_RECORD_DIR = os.getenv("MARKET_DATA_RECORD_DIR")
+# Folder with the recorded quotes and bars the replay provider serves
+REPLAY_DIR = os.getenv("REPLAY_DIR", os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "replay"))
+# Replay clock speed: 1 = real time, 60 = one recorded minute per second, 0 = clock frozen at the start
+REPLAY_SPEED = float(os.getenv("REPLAY_SPEED", "1"))
+# Recorded time the replay starts at (ISO format, e.g. 2024-03-15T09:30:00-04:00); defaults to the earliest recording
+REPLAY_START = os.getenv("REPLAY_START")
+# Replayed bars must not end up in the real history store, so replay uses its own store by default
+if MARKET_DATA_PROVIDER == "replay" and not os.getenv("HISTORY_DIR"):
+    HISTORY_DIR = os.path.join(REPLAY_DIR, "store")
+
+# ---- Technical indicators ----
+# Max number of (symbol, interval) series kept in memory with their indicators (least recently used go first)
+INDICATOR_CACHE_SIZE = int(os.getenv("INDICATOR_CACHE_SIZE", "500"))
+
+# ---- Predictions ----
+# Folder where trained models are saved (one subfolder per model, one per version)
+MODEL_DIR = os.getenv("MODEL_DIR", os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "models"))
+# Trained models kept in memory (least recently used go first; they stay on disk)
+MODEL_CACHE_SIZE = int(os.getenv("MODEL_CACHE_SIZE", "8"))
+# Versions of each model kept on disk
+MODEL_KEEP_VERSIONS = int(os.getenv("MODEL_KEEP_VERSIONS", "5"))
+# Retrain a model in the background once its newest version is this many seconds old
+MODEL_RETRAIN_AFTER = float(os.getenv("MODEL_RETRAIN_AFTER", str(24 * 60 * 60)))
+# Look on disk for a newer version of a model at most this often (seconds), to pick up
+# versions trained by other workers
+MODEL_DISK_RECHECK = float(os.getenv("MODEL_DISK_RECHECK", "60"))
+# Worker processes that train models
+PREDICTION_WORKERS = int(os.getenv("PREDICTION_WORKERS", "2"))
+# Symbols whose pooled history models are trained on (comma separated)
+PREDICTION_TRAINING_SYMBOLS = [symbol.strip().upper() for symbol in os.getenv(
+    "PREDICTION_TRAINING_SYMBOLS", "AAPL,MSFT,AMZN,GOOGL,META,NVDA,JPM,JNJ,XOM,PG,KO,WMT,DIS,INTC,CSCO,PFE"
+).split(",") if symbol.strip()]
+# Days of daily history turned into features per symbol (the training window)
+FEATURE_HISTORY_DAYS = int(os.getenv("FEATURE_HISTORY_DAYS", str(5 * 365)))
+# Symbols whose feature matrices are kept in memory
+FEATURE_CACHE_SIZE = int(os.getenv("FEATURE_CACHE_SIZE", "1000"))
+
+# ---- Monte Carlo simulations ----
+# Worker processes used to generate price paths (defaults to one per CPU)
+MONTE_CARLO_WORKERS = int(os.getenv("MONTE_CARLO_WORKERS", str(os.cpu_count() or 1)))
+# How many finished simulation results are kept in memory for repeat views
+MONTE_CARLO_CACHE_SIZE = int(os.getenv("MONTE_CARLO_CACHE_SIZE", "128"))
+
+# ---- Strategy parameter sweeps ----
+# Worker processes that evaluate sweep cells (defaults to one per CPU)
+SWEEP_WORKERS = int(os.getenv("SWEEP_WORKERS", str(os.cpu_count() or 1)))
+# Largest grid (number of cells) a single sweep may have
+SWEEP_MAX_CELLS = int(os.getenv("SWEEP_MAX_CELLS", "20000"))
+
+# ---- ID token verification ----
+# Max number of verified tokens remembered (each one is cached until it expires)
+TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", "10000"))
+# Also check that tokens haven't been revoked / users haven't been disabled (costs a Firebase lookup)
+TOKEN_CHECK_REVOKED = os.getenv("TOKEN_CHECK_REVOKED", "false").lower() in ("1", "true", "yes")
+# With revocation checks on, re-check a cached token at most this often (seconds)
+TOKEN_REVOCATION_RECHECK = float(os.getenv("TOKEN_REVOCATION_RECHECK", "300"))
+# Fallback refresh period (seconds) for Google's token signing keys if the response has no max-age
+TOKEN_KEY_REFRESH = float(os.getenv("TOKEN_KEY_REFRESH", "3600"))
+# A token signed with a key we don't have makes us download the keys again right away, but at most
+# this often (seconds); in between such tokens are rejected without touching the network
+TOKEN_KEY_MIN_REFETCH = float(os.getenv("TOKEN_KEY_MIN_REFETCH", "60"))
+# Firebase project id; read from the initialized Firebase app when not set
+FIREBASE_PROJECT_ID = os.getenv("FIREBASE_PROJECT_ID")
+# Service account key used to connect to Firebase. When the file doesn't exist,
+# Google Application Default Credentials are used instead.
+FIREBASE_CREDENTIALS = os.getenv("FIREBASE_CREDENTIALS", os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "firebase", "serviceAccountKey.json"))
+
+# ---- Portfolio valuation ----
+# Reload a user's positions from Firestore after this many seconds (catches trades made on other workers)
+VALUATION_RELOAD = float(os.getenv("VALUATION_RELOAD", "300"))
+# Forget users nobody has asked about for this many seconds (and stop watching their symbols)
+VALUATION_IDLE = float(os.getenv("VALUATION_IDLE", "900"))
+
+# ---- Risk analytics ----
+# Index betas are measured against
+RISK_BENCHMARK = os.getenv("RISK_BENCHMARK", "^GSPC").upper()
+# Annual risk-free rate used by the Sharpe ratio (0.04 = 4%)
+RISK_FREE_RATE = float(os.getenv("RISK_FREE_RATE", "0.0"))
+# Default number of daily returns the statistics are computed over (252 = about a year)
+RISK_WINDOW = int(os.getenv("RISK_WINDOW", "252"))
+# Returns/covariance matrices kept in memory, one per (symbols, window) (least recently used go first)
+RISK_CACHE_SIZE = int(os.getenv("RISK_CACHE_SIZE", "256"))
+
+# ---- Leaderboard ----
+# Re-read every user from Firestore after this many seconds (catches trades made on other workers and new signups)
+LEADERBOARD_RELOAD = float(os.getenv("LEADERBOARD_RELOAD", "600"))
+
+# ---- Orders (limit / stop) ----
+# Most triggered orders of one user filled in one Firestore transaction
+ORDER_FILL_BATCH = int(os.getenv("ORDER_FILL_BATCH", "100"))
+# Fill transactions running at the same time (leaves database threads for the requests)
+ORDER_FILL_CONCURRENCY = int(os.getenv("ORDER_FILL_CONCURRENCY", "8"))
+# Re-read every open order from Firestore after this many seconds (catches orders placed or
+# cancelled on other workers); 0 = only at startup
+ORDER_RELOAD = float(os.getenv("ORDER_RELOAD", "0"))
+# Most open orders one user may have at a time
+ORDER_MAX_OPEN_PER_USER = int(os.getenv("ORDER_MAX_OPEN_PER_USER", "100"))
+# Times a triggered order is retried after a transient error (Firestore busy or timing out)
+# before it is cancelled
+ORDER_MAX_FILL_ATTEMPTS = int(os.getenv("ORDER_MAX_FILL_ATTEMPTS", "5"))
+
+# ---- Upstream calls (Yahoo Finance, Firestore) ----
+# Blocking client calls run on dedicated thread pools, one for market data and one for the database.
+# Calls running at the same time per pool
+MARKET_DATA_CONCURRENCY = int(os.getenv("MARKET_DATA_CONCURRENCY", "16"))
+DATABASE_CONCURRENCY = int(os.getenv("DATABASE_CONCURRENCY", "32"))
+# Extra calls allowed to wait for a free thread; past that, requests get a 503 straight away
+MARKET_DATA_QUEUE = int(os.getenv("MARKET_DATA_QUEUE", "200"))
+DATABASE_QUEUE = int(os.getenv("DATABASE_QUEUE", "400"))
+# Seconds a single call may take before the request gets a 504
+MARKET_DATA_TIMEOUT = float(os.getenv("MARKET_DATA_TIMEOUT", "15"))
+DATABASE_TIMEOUT = float(os.getenv("DATABASE_TIMEOUT", "10"))
+
+# ---- Quote polling ----
+# Most quote requests per second the quote hub sends upstream, across every symbol it polls
+QUOTE_POLL_BUDGET = float(os.getenv("QUOTE_POLL_BUDGET", "10"))
+# Fastest a single symbol is polled while its market is open (heavily watched, volatile symbols)
+QUOTE_POLL_MIN_INTERVAL = float(os.getenv("QUOTE_POLL_MIN_INTERVAL", "2"))
+# How often a symbol is polled while its market is closed (prices can't change, this only catches corrections)
+QUOTE_POLL_CLOSED_INTERVAL = float(os.getenv("QUOTE_POLL_CLOSED_INTERVAL", "1800"))
+
+# ---- Stock update websockets ----
+# Most symbols one /ws/stock-updates connection may be subscribed to at a time
+WS_MAX_SYMBOLS = int(os.getenv("WS_MAX_SYMBOLS", "50"))
+
+# ---- Symbol search ----
+# CSV of the ticker universe used for search (symbol,shortName,sector,industry)
+SYMBOL_UNIVERSE_PATH = os.getenv("SYMBOL_UNIVERSE_PATH", os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "tickers.csv"))
+# Also download the full list of US listed symbols (names only) from NASDAQ Trader
+SYMBOL_UNIVERSE_DOWNLOAD = os.getenv("SYMBOL_UNIVERSE_DOWNLOAD", "true").lower() in ("1", "true", "yes")
+# How often (seconds) the search index is rebuilt in the background
+SYMBOL_INDEX_REFRESH = float(os.getenv("SYMBOL_INDEX_REFRESH", str(24 * 60 * 60)))
+
+# ---- Logging ----
+# Lowest level written out: DEBUG, INFO, WARNING, ERROR
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+# "json" -> one JSON object per line (for log collectors), "text" -> plain lines for reading in a terminal
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text").lower()
+
+# ---- Startup ----
+# Symbols whose quotes and price history are loaded before the worker reports ready (comma separated)
+WARMUP_SYMBOLS = [symbol.strip().upper() for symbol in os.getenv("WARMUP_SYMBOLS", "").split(",") if symbol.strip()]
+# Days of daily history preloaded for each warm-up symbol
+WARMUP_HISTORY_DAYS = int(os.getenv("WARMUP_HISTORY_DAYS", "365"))
+# Report ready after this many seconds even if the warm-up hasn't finished (a slow Yahoo shouldn't keep a worker out)
+WARMUP_TIMEOUT = float(os.getenv("WARMUP_TIMEOUT", "20"))
+# Seconds before the first retry of a failed Firebase connection at startup (doubles each time)
+STARTUP_RETRY_DELAY = float(os.getenv("STARTUP_RETRY_DELAY", "1"))
+# Longest wait between Firebase connection retries at startup
+STARTUP_RETRY_MAX_DELAY = float(os.getenv("STARTUP_RETRY_MAX_DELAY", "60"))
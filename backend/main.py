@@ -1,16 +1,38 @@
-from fastapi import FastAPI, Depends, HTTPException, Header, WebSocket
-from routes import auth, stocks
+import logging
+from config.logging_config import setup_logging
+# Set up logging before the app modules are imported, so messages logged while they
+# start up (connecting to Firebase...) already use the configured level and format
+setup_logging()
+from fastapi import FastAPI, Depends, HTTPException, Header, WebSocket, WebSocketDisconnect
+from routes import auth, stocks, simulations, trades, portfolio, predictions, leaderboard, orders, metrics, health
 from dotenv import load_dotenv
 from fastapi.responses import JSONResponse
-from firebase_admin import auth as firebase_auth
+from contextlib import asynccontextmanager
 import asyncio
-import yfinance as yf
-from datetime import datetime
 from routes.auth import verify_token
+from services.quote_hub import quote_hub, Subscriber
+from services.valuation_service import position_index
+from services.indicator_service import indicator_engine
+from services.quote_stream import QuoteStream, HEARTBEAT_INTERVAL
+from services.history_store import SYMBOL_PATTERN
+from services.metrics import RequestMetricsMiddleware
+from services.startup_service import startup
 from fastapi.middleware.cors import CORSMiddleware
+from config.settings import WS_MAX_SYMBOLS
+
+logger = logging.getLogger(__name__)
 
 load_dotenv()
-app = FastAPI()
+
+# Firebase, the search index and the warm-up are started here (in the background) rather than
+# when modules are imported, so the worker comes up right away and reports ready at /health/ready
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    startup.start()
+    yield
+    await startup.stop()
+
+app = FastAPI(lifespan=lifespan)
 
 # Root route
 @app.get("/")
@@ -24,61 +46,202 @@ app.add_middleware(
     allow_methods=["*"],  # Allows all methods
     allow_headers=["*"],  # Allows all headers
 )
+# Latency of every request, per route (read it at /api/metrics)
+app.add_middleware(RequestMetricsMiddleware)
 
 # Include the routers
 app.include_router(auth.router, prefix="/api/auth", tags=["auth"])
 app.include_router(stocks.router, prefix="/api/stocks", tags=["stocks"])
+app.include_router(simulations.router, prefix="/api/simulations", tags=["simulations"])
+app.include_router(trades.router, prefix="/api/trades", tags=["trades"])
+app.include_router(portfolio.router, prefix="/api/portfolio", tags=["portfolio"])
+app.include_router(predictions.router, prefix="/api/predictions", tags=["predictions"])
+app.include_router(leaderboard.router, prefix="/api/leaderboard", tags=["leaderboard"])
+app.include_router(orders.router, prefix="/api/orders", tags=["orders"])
+app.include_router(metrics.router, prefix="/api/metrics", tags=["metrics"])
+app.include_router(health.router, prefix="/health", tags=["health"])
 
 # WebSocket is a protocol that provides full-duplex communication between client and server
 # Unlike HTTP, which is request-response based, WebSocket maintains an open connection
 # This allows us to send real-time updates from server to client without the client having to request it
 # used for REAL TIME DATA and STOCK UPDATES
 
-# Store all active WebSocket connections in a list
-# This helps us manage multiple clients connected at the same time
-active_connections = []
+# All active WebSocket connections live in a registry owned by the quote hub.
+# The registry knows which symbols each connection is subscribed to, so one
+# poller per symbol can broadcast to every client watching it.
+active_connections = quote_hub.registry
 
-@app.websocket("/ws/stock-updates/{symbol}")
-async def stock_updates(websocket: WebSocket, symbol: str):
+async def send_updates(subscriber):
+    # Drain this connection's queue and push each update to the client.
+    # Each connection has its own sender so a slow client only slows itself down.
+    websocket = subscriber.websocket
+    while True:
+        # With the compact protocol, also wake up when held back updates come due or a heartbeat is needed
+        timeout = subscriber.stream.timeout() if subscriber.stream is not None else None
+        try:
+            message = await asyncio.wait_for(subscriber.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            message = None
+        # Read it again: the client may have switched protocols while we waited
+        stream = subscriber.stream
+        if stream is None:
+            if message is not None:
+                # websocket.send_json automatically converts Python dict to JSON
+                await websocket.send_json(message)
+            continue
+        if message is not None:
+            stream.add(message)
+        while not subscriber.queue.empty():
+            stream.add(subscriber.queue.get_nowait())
+        for frame in stream.flush():
+            if isinstance(frame, bytes):
+                await websocket.send_bytes(frame)
+            else:
+                await websocket.send_text(frame)
+
+def check_symbols(symbols, subscribed=(), adding: bool = True):
+    """
+    Validate the "symbols" of a websocket command: a list of ticker strings, and (when adding)
+    no more than WS_MAX_SYMBOLS on the connection in total. Returns them upper-cased.
+    """
+    if not isinstance(symbols, list) or not all(isinstance(symbol, str) for symbol in symbols):
+        raise ValueError("symbols must be a list of strings")
+    symbols = [symbol.strip().upper() for symbol in symbols]
+    invalid = [symbol for symbol in symbols if not SYMBOL_PATTERN.match(symbol)]
+    if invalid:
+        raise ValueError(f"Invalid symbols: {invalid[:10]}")
+    if adding and len(set(subscribed) | set(symbols)) > WS_MAX_SYMBOLS:
+        raise ValueError(f"A connection can be subscribed to at most {WS_MAX_SYMBOLS} symbols")
+    return symbols
+
+async def handle_subscriptions(websocket: WebSocket, symbols: list[str]):
     # Accept the WebSocket connection from the client
     await websocket.accept()
-    # Add this connection to our list of active connections
-    active_connections.append(websocket)
-    
     try:
-        # Infinite loop to keep sending updates
-        # This runs continuously until the client disconnects
+        symbols = check_symbols(symbols)
+    except ValueError as e:
+        await websocket.send_json({"error": str(e)})
+        await websocket.close(code=1008)
+        return
+    # Register this connection so the hub knows where to send updates
+    subscriber = quote_hub.connect(websocket)
+    quote_hub.subscribe(subscriber, symbols)
+    sender = asyncio.create_task(send_updates(subscriber))
+
+    try:
+        # Listen for messages from the client so a single socket can watch many symbols:
+        # {"action": "subscribe", "symbols": ["AAPL", "MSFT"]}
+        # {"action": "unsubscribe", "symbols": ["AAPL"]}
+        # Adding "indicators" (and optionally "interval") to a subscribe also streams their latest
+        # values after every quote, as {"type": "indicators", ...} messages:
+        # {"action": "subscribe", "symbols": ["AAPL"], "indicators": ["sma:20", "rsi:14"], "interval": "1d"}
+        # Clients can switch to compact updates (only changed fields, optional binary encoding, their
+        # own update rate and fields, heartbeats when nothing changes; see services/quote_stream.py):
+        # {"action": "configure", "delta": true, "encoding": "msgpack", "interval": 5, "fields": ["price"]}
         while True:
-            # Get real-time stock data using yfinance
-            # yfinance makes an API call to Yahoo Finance
-            stock = yf.Ticker(symbol)
-            stock_info = stock.info
-            
-            # Send a JSON message to the connected client
-            # websocket.send_json automatically converts Python dict to JSON
-            await websocket.send_json({
-                "symbol": symbol,                                  # Stock symbol (e.g., AAPL)
-                "price": stock_info.get("currentPrice"),          # Current stock price
-                "timestamp": datetime.now().isoformat(),          # When this update was sent
-                "volume": stock_info.get("regularMarketVolume"),  # Trading volume
-                "dayHigh": stock_info.get("dayHigh"),            # Highest price today
-                "dayLow": stock_info.get("dayLow")               # Lowest price today
-            })
-            
-            # Pause for 6 seconds before sending next update
-            # This prevents overwhelming the Yahoo Finance API
-            # and reduces unnecessary updates
-            await asyncio.sleep(6)
-            
+            try:
+                command = await websocket.receive_json()
+                if not isinstance(command, dict):
+                    raise ValueError("Commands must be JSON objects")
+                action = command.get("action")
+                requested = []
+                if action in ("subscribe", "unsubscribe"):
+                    requested = check_symbols(command.get("symbols", []), subscriber.symbols, action == "subscribe")
+            except ValueError as e:
+                # Not JSON, not an object, or bad symbols: say so and keep the connection
+                await websocket.send_json({"error": str(e)})
+                continue
+            if action == "subscribe":
+                quote_hub.subscribe(subscriber, requested)
+                if command.get("indicators"):
+                    try:
+                        await indicator_engine.subscribe(subscriber, requested, command["indicators"],
+                                                         command.get("interval", "1d"))
+                    except Exception as e:
+                        # Bad indicator spec or symbol, or no history available right now
+                        await websocket.send_json({"error": str(e)})
+            elif action == "unsubscribe":
+                quote_hub.unsubscribe(subscriber, requested)
+                indicator_engine.unsubscribe(subscriber, requested)
+                if subscriber.stream is not None:
+                    subscriber.stream.forget(requested)
+            elif action == "configure":
+                try:
+                    if command.get("delta", True):
+                        subscriber.stream = QuoteStream(command.get("fields"), command.get("interval", 0.0),
+                                                        command.get("encoding", "json"),
+                                                        command.get("heartbeat", HEARTBEAT_INTERVAL))
+                    else:
+                        subscriber.stream = None
+                except (TypeError, ValueError) as e:
+                    await websocket.send_json({"error": str(e)})
+                    continue
+                # Start the new stream with the latest quote of every subscribed symbol
+                for symbol in subscriber.symbols:
+                    if symbol in quote_hub.latest:
+                        subscriber.offer(quote_hub.latest[symbol])
+                await websocket.send_json({"configured": subscriber.stream.options() if subscriber.stream else {"delta": False}})
+                continue
+            else:
+                await websocket.send_json({"error": f"Unknown action: {action}"})
+                continue
+            await websocket.send_json({"subscribed": sorted(subscriber.symbols)})
+
+    except WebSocketDisconnect:
+        pass
     except Exception as e:
         # Handle any errors that occur during the WebSocket connection
-        print(f"Error in WebSocket: {str(e)}")
+        logger.exception("Error in WebSocket: %s", e)
     finally:
         # When connection closes (either due to client disconnecting or error):
-        # 1. Remove this connection from our active connections list
-        # 2. Close the WebSocket connection properly
-        active_connections.remove(websocket)
-        await websocket.close()
+        # 1. Stop sending updates to this client
+        # 2. Remove it from the registry (pollers with no subscribers left are stopped)
+        sender.cancel()
+        quote_hub.disconnect(subscriber)
+        indicator_engine.unsubscribe(subscriber)
+
+# One socket, many symbols. Subscribe/unsubscribe with messages after connecting.
+@app.websocket("/ws/stock-updates")
+async def stock_updates_multi(websocket: WebSocket):
+    await handle_subscriptions(websocket, [])
+
+# Original single-symbol endpoint, kept so existing clients keep working.
+# It starts subscribed to {symbol} and also accepts subscribe/unsubscribe messages.
+@app.websocket("/ws/stock-updates/{symbol}")
+async def stock_updates(websocket: WebSocket, symbol: str):
+    await handle_subscriptions(websocket, [symbol])
+
+# Live value of the signed-in user's portfolio: /ws/portfolio?token=<Firebase ID token>
+# (browsers can't set headers on websockets, so the token comes in the query string).
+# A tick is pushed whenever a quote for one of the user's symbols changes or they trade.
+@app.websocket("/ws/portfolio")
+async def portfolio_updates(websocket: WebSocket, token: str):
+    try:
+        uid = await verify_token(token)
+    except HTTPException as e:
+        # 1013 = try again later (we're overloaded), 1008 = policy violation (bad token)
+        await websocket.close(code=1013 if e.status_code >= 500 else 1008)
+        return
+    await websocket.accept()
+
+    # Same bounded, drop-oldest queue and sender as the stock update sockets
+    subscriber = Subscriber(websocket)
+    sender = asyncio.create_task(send_updates(subscriber))
+    user = None
+    try:
+        user = await position_index.get(uid)
+        position_index.add_subscriber(user, subscriber)
+        # Nothing to receive, just wait for the client to go away
+        while True:
+            await websocket.receive_text()
+    except WebSocketDisconnect:
+        pass
+    except Exception as e:
+        logger.exception("Error in portfolio WebSocket: %s", e)
+    finally:
+        sender.cancel()
+        if user is not None:
+            position_index.remove_subscriber(user, subscriber)
 
     # example of how to use the verify_token function in a protected route
 @app.get("/protected-route")
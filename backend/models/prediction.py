@@ -0,0 +1,15 @@
+from pydantic import BaseModel
+from typing import List, Literal, Optional
+
+# Which model: "ridge" (linear), "forest" (random forest) or "gbm" (gradient boosting)
+ModelKind = Literal["ridge", "forest", "gbm"]
+
+class PredictionRequest(BaseModel):
+    symbols: List[str]
+    model: ModelKind = "ridge"
+    horizon: Literal[1, 5, 21] = 5   # Trading days ahead
+
+class TrainRequest(BaseModel):
+    model: ModelKind = "ridge"
+    horizon: Literal[1, 5, 21] = 5
+    symbols: Optional[List[str]] = None  # Symbols to train on, defaults to PREDICTION_TRAINING_SYMBOLS
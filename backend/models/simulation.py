@@ -0,0 +1,42 @@
+from pydantic import BaseModel, Field
+from typing import Annotated, Any, Dict, List, Literal, Optional
+
+# How often a strategy rebalances or adds money
+Frequency = Literal["daily", "weekly", "monthly", "quarterly", "yearly"]
+
+class StrategyConfig(BaseModel):
+    type: Literal["buy_and_hold", "rebalance", "dca"]
+    name: Optional[str] = None                  # Label shown in the results, defaults to the type
+    weights: Optional[Dict[str, float]] = None  # Target weight per symbol, defaults to equal weight
+    frequency: Frequency = "monthly"            # Rebalance frequency ("rebalance") or contribution frequency ("dca")
+    contribution: float = 0.0                   # Amount invested every period ("dca" only)
+
+class BacktestRequest(BaseModel):
+    symbols: List[str]
+    start: Optional[str] = None   # YYYY-MM-DD, defaults to one year before end
+    end: Optional[str] = None     # YYYY-MM-DD (exclusive), defaults to today
+    interval: Literal["1d", "1wk", "1mo"] = "1d"
+    initial_capital: float = Field(10000.0, gt=0)
+    risk_free_rate: float = 0.0   # Annual rate used for the Sharpe ratio
+    strategies: List[StrategyConfig]
+
+class MonteCarloRequest(BaseModel):
+    model: Literal["gbm", "bootstrap"] = "gbm"          # Geometric Brownian motion or historical bootstrap
+    n_paths: int = Field(10000, ge=100, le=5_000_000)    # Number of simulated price paths
+    horizon_days: int = Field(252, ge=1, le=2520)        # How many trading days to project forward
+    lookback_days: int = Field(756, ge=20, le=5040)      # Trading days of history used to fit the model
+    seed: Optional[int] = None                           # Fix the random seed for reproducible results
+    # Percentile bands to return, each between 0 and 100
+    percentiles: List[Annotated[float, Field(ge=0, le=100)]] = Field([5, 25, 50, 75, 95], min_length=1)
+
+class SweepRequest(BaseModel):
+    symbols: List[str]
+    start: Optional[str] = None
+    end: Optional[str] = None
+    interval: Literal["1d", "1wk", "1mo"] = "1d"
+    initial_capital: float = Field(10000.0, gt=0)
+    risk_free_rate: float = 0.0
+    base: StrategyConfig = StrategyConfig(type="rebalance")  # Settings shared by every cell
+    # Parameter name -> values to try. Every combination becomes one cell, e.g.
+    # {"frequency": ["monthly", "quarterly"], "weights": [{"AAPL": 1, "MSFT": 1}, {"AAPL": 3, "MSFT": 1}]}
+    grid: Dict[str, List[Any]]
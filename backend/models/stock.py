@@ -0,0 +1,11 @@
+from pydantic import BaseModel
+from typing import List, Literal, Optional
+
+class IndicatorRequest(BaseModel):
+    symbols: List[str]
+    # "name:param:param", e.g. ["sma:20", "ema:50", "rsi:14", "macd:12:26:9", "bbands:20:2"]
+    # Parameters can be left out to use the defaults ("macd" is "macd:12:26:9")
+    indicators: List[str]
+    start: Optional[str] = None   # YYYY-MM-DD, defaults to one year before end
+    end: Optional[str] = None     # YYYY-MM-DD (exclusive), defaults to today
+    interval: Literal["1d", "1wk", "1mo"] = "1d"
@@ -0,0 +1,20 @@
+from pydantic import BaseModel, Field
+from typing import List, Literal, Optional
+
+class TradeRequest(BaseModel):
+    symbol: str
+    quantity: int = Field(..., gt=0)  # Filled at the current market price (use /api/orders for a price limit)
+
+class BasketOrder(TradeRequest):
+    side: Literal["BUY", "SELL"]
+
+class BasketRequest(BaseModel):
+    orders: List[BasketOrder]  # Filled together in one atomic commit, in this order
+
+class OrderRequest(BaseModel):
+    symbol: str
+    side: Literal["BUY", "SELL"]
+    type: Literal["limit", "stop", "stop_limit"]
+    quantity: int = Field(..., gt=0)
+    limit_price: Optional[float] = Field(None, gt=0)  # Needed by limit and stop_limit orders
+    stop_price: Optional[float] = Field(None, gt=0)   # Needed by stop and stop_limit orders
@@ -19,7 +19,7 @@ class User(BaseModel):
     is_active: bool = True
     is_verified: bool = False
     portfolio: Dict = {}  # Empty portfolio
-    transactions: List = []  # Empty transaction history
+    ledger_seq: int = 0  # Number of trades; the trades themselves live in the users/{id}/ledger subcollection
     created_at: datetime = datetime.now()
     last_login: datetime = None  # New field
 
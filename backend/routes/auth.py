@@ -1,12 +1,14 @@
 # Import necessary FastAPI components for routing and error handling
+import logging
 from fastapi import APIRouter, HTTPException, Depends, Header
 # Import Firebase Admin SDK for authentication
 from firebase_admin import auth as firebase_auth
-from firebase_admin import firestore
 # Import our custom user models from the models directory
 from models.user import UserCreate, User
 
 from services.firebase_service import get_db, init_firebase
+from services.token_service import token_verifier
+from services.upstream import database
 # Import typing for type hints
 from typing import Dict
 # Import datetime for timestamp creation
@@ -17,15 +19,24 @@ from fastapi.responses import JSONResponse
 # Create a router instance to group all authentication-related endpoints. it's a fastapi component that allows us to group related routes together
 router = APIRouter()
 
+logger = logging.getLogger(__name__)
+
 
 async def verify_token(authorization: str = Header(...)):
     try:
-        #firebase verifies the token and returns the decoded data
-        # this will fail is the token is invalid or expired
-        decoded_token = auth.verify_id_token(authorization)
+        # the token verifier returns the decoded data. A token is fully verified the first time
+        # we see it and then served from a cache until it expires (see services/token_service.py)
+        decoded_token = token_verifier.cached(authorization)
+        if decoded_token is None:
+            # Full check, which may download Google's keys, so it runs on the database pool
+            # this will fail is the token is invalid or expired
+            decoded_token = await database.run(token_verifier.verify, authorization)
 
         # if the token is valid, return the user's UID
         return decoded_token['uid']
+    except HTTPException as http_error:
+        # Busy (503) or timed out (504), not an invalid token
+        raise http_error
     except Exception as e:
         raise HTTPException(status_code=401, detail="Invalid token")
 
@@ -36,31 +47,36 @@ async def verify_token(authorization: str = Header(...)):
 @router.post("/signup")
 async def signup(user: UserCreate):
     try:
-        # Create user with firebase_auth
-        user_record = firebase_auth.create_user(
+        # Get Firestore database (this also connects to Firebase the first time, so off the event loop)
+        db = await database.run(get_db)
+
+        # Create user with firebase_auth (blocking network call, so it runs on the database pool)
+        user_record = await database.run(
+            firebase_auth.create_user,
             email=user.email,
             password=user.password
         )
 
-        # Get Firestore database
-        db = get_db()
-        
         # Create user document
         user_data = {
             "id": user_record.uid,
             "email": user.email,
             "initial_balance": user.initial_balance,
+            "starting_balance": user.initial_balance,  # Never changes, used to rebuild holdings from the ledger
             "portfolio": {},
-            "transactions": []
+            # Trades are stored in the users/{uid}/ledger subcollection, not on this document
+            "ledger_seq": 0
         }
         
         # Save to Firestore
-        db.collection("users").document(user_record.uid).set(user_data)
+        await database.run(db.collection("users").document(user_record.uid).set, user_data)
         
         return {"message": "User created successfully", "uid": user_record.uid}
     
+    except HTTPException as http_error:
+        raise http_error
     except Exception as e:
-        print(f"Signup error: {str(e)}")  # Debug print
+        logger.warning("Signup error: %s", e)
         raise HTTPException(status_code=400, detail=str(e))
 # Define the signin endpoint
 # POST /api/auth/signin
@@ -113,7 +129,7 @@ async def login_user(
     try:
         # If we have a token, verify it
         if authorization:
-            decoded_token = auth.verify_id_token(authorization)
+            decoded_token = token_verifier.cached(authorization) or await database.run(token_verifier.verify, authorization)
             return JSONResponse({
                 "message": "Login successful",
                 "uid": decoded_token['uid']
@@ -0,0 +1,20 @@
+from fastapi import APIRouter
+from fastapi.responses import JSONResponse
+from services.startup_service import startup
+
+router = APIRouter()
+
+# GET /health/live
+# Liveness: the process is up and the event loop answers. Never touches Firebase or Yahoo,
+# so a slow upstream can't get a healthy worker restarted.
+@router.get("/live")
+async def live():
+    return {"status": "alive"}
+
+# GET /health/ready
+# Readiness: 200 once Firebase is connected, the search index is built and the warm-up
+# is done (see services/startup_service.py), 503 with the state of every step before that.
+@router.get("/ready")
+async def ready():
+    status = startup.status()
+    return JSONResponse(status, status_code=200 if status["ready"] else 503)
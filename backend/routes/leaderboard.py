@@ -0,0 +1,36 @@
+import logging
+from fastapi import APIRouter, HTTPException, Depends, Query
+from routes.auth import verify_token
+from services.leaderboard_service import leaderboard, MAX_PAGE_SIZE
+
+router = APIRouter()
+
+logger = logging.getLogger(__name__)
+
+# GET /api/leaderboard?offset=0&limit=50
+# Users ranked by simulated return (best first), one page at a time.
+# Served from memory; see services/leaderboard_service.py for how it is kept up to date.
+@router.get("")
+async def get_leaderboard(offset: int = Query(0, ge=0), limit: int = Query(50, ge=1, le=MAX_PAGE_SIZE)):
+    try:
+        return await leaderboard.page(offset, limit)
+    except HTTPException as http_error:
+        raise http_error
+    except Exception as e:
+        logger.exception("Error reading the leaderboard: %s", e)
+        raise HTTPException(status_code=500, detail=str(e))
+
+# GET /api/leaderboard/me
+# The signed-in user's rank and return
+@router.get("/me")
+async def my_standing(uid: str = Depends(verify_token)):
+    try:
+        standing = await leaderboard.standing(uid)
+    except HTTPException as http_error:
+        raise http_error
+    except Exception as e:
+        logger.exception("Error reading the leaderboard: %s", e)
+        raise HTTPException(status_code=500, detail=str(e))
+    if standing is None:
+        raise HTTPException(status_code=404, detail="Not on the leaderboard yet")
+    return standing
@@ -0,0 +1,17 @@
+from fastapi import APIRouter, HTTPException
+from fastapi.responses import PlainTextResponse
+from services.metrics import metrics
+
+router = APIRouter()
+
+# GET /api/metrics                     -> JSON
+# GET /api/metrics?format=prometheus   -> Prometheus text format, for scraping
+# Per-route request latency histograms, upstream call latencies per pool and market data
+# provider, cache hit ratios, and gauges for websocket connections and subscribed symbols.
+@router.get("")
+async def get_metrics(format: str = "json"):
+    if format == "prometheus":
+        return PlainTextResponse(metrics.prometheus(), media_type="text/plain; version=0.0.4")
+    if format != "json":
+        raise HTTPException(status_code=400, detail="Unknown format. Use json or prometheus")
+    return metrics.snapshot()
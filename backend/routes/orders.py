@@ -0,0 +1,57 @@
+import logging
+from typing import Literal, Optional
+from fastapi import APIRouter, HTTPException, Depends
+from models.trade import OrderRequest
+from routes.auth import verify_token
+from services.order_service import order_engine
+
+router = APIRouter()
+
+logger = logging.getLogger(__name__)
+
+# POST /api/orders
+# {"symbol": "AAPL", "side": "BUY", "type": "limit", "quantity": 10, "limit_price": 180}
+# Places a resting order. It fills at the first quote that reaches its price:
+#   limit       BUY at or below limit_price, SELL at or above it
+#   stop        BUY once the price rises to stop_price, SELL once it falls to it
+#   stop_limit  becomes a limit order at limit_price once stop_price is reached
+# Cash and shares are checked when the order fills, not when it is placed; an order that
+# can't be filled then is marked "rejected" with the reason. A user may have at most
+# ORDER_MAX_OPEN_PER_USER open orders (400 beyond that).
+@router.post("", status_code=201)
+async def place_order(request: OrderRequest, uid: str = Depends(verify_token)):
+    try:
+        return await order_engine.place(uid, request.symbol, request.side, request.type, request.quantity,
+                                        request.limit_price, request.stop_price)
+    except HTTPException as http_error:
+        raise http_error
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.exception("Error placing order: %s", e)
+        raise HTTPException(status_code=500, detail=str(e))
+
+# GET /api/orders?status=open
+# The signed-in user's orders, newest first
+@router.get("")
+async def list_orders(status: Optional[Literal["open", "filled", "cancelled", "rejected"]] = None,
+                      uid: str = Depends(verify_token)):
+    try:
+        return {"orders": await order_engine.list(uid, status)}
+    except HTTPException as http_error:
+        raise http_error
+    except Exception as e:
+        logger.exception("Error reading orders: %s", e)
+        raise HTTPException(status_code=500, detail=str(e))
+
+# DELETE /api/orders/{order_id}
+# Cancels an open order (409 if it has already filled)
+@router.delete("/{order_id}")
+async def cancel_order(order_id: str, uid: str = Depends(verify_token)):
+    try:
+        return await order_engine.cancel(uid, order_id)
+    except HTTPException as http_error:
+        raise http_error
+    except Exception as e:
+        logger.exception("Error cancelling order %s: %s", order_id, e)
+        raise HTTPException(status_code=500, detail=str(e))
@@ -0,0 +1,41 @@
+import logging
+from fastapi import APIRouter, HTTPException, Depends, Query
+from config.settings import RISK_WINDOW
+from routes.auth import verify_token
+from services.valuation_service import position_index
+from services.risk_service import risk_model, MIN_WINDOW, MAX_WINDOW
+
+router = APIRouter()
+
+logger = logging.getLogger(__name__)
+
+# GET /api/portfolio/value
+# Market value and unrealized P&L of the signed-in user's portfolio, valued at the latest
+# streamed quotes. Served from the in-memory position index (see services/valuation_service.py).
+@router.get("/value")
+async def portfolio_value(uid: str = Depends(verify_token)):
+    try:
+        return await position_index.valuation(uid)
+    except HTTPException as http_error:
+        raise http_error
+    except Exception as e:
+        logger.exception("Error valuing portfolio: %s", e)
+        raise HTTPException(status_code=500, detail=str(e))
+
+# GET /api/portfolio/risk?window=252&correlation=false
+# Volatility, Sharpe ratio, beta against the benchmark (RISK_BENCHMARK, ^GSPC by default), max drawdown
+# and one-day value at risk (historical and parametric, 95% and 99%) of the signed-in user's holdings
+# over the last `window` daily returns, plus each position's weight, volatility, beta and share of the risk.
+# Covariance matrices are cached and rolled forward bar by bar (see services/risk_service.py).
+@router.get("/risk")
+async def portfolio_risk(window: int = Query(RISK_WINDOW, ge=MIN_WINDOW, le=MAX_WINDOW), correlation: bool = False,
+                         uid: str = Depends(verify_token)):
+    try:
+        return await risk_model.portfolio_risk(uid, window, correlation)
+    except HTTPException as http_error:
+        raise http_error
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.exception("Error computing portfolio risk: %s", e)
+        raise HTTPException(status_code=500, detail=str(e))
@@ -0,0 +1,49 @@
+import logging
+from fastapi import APIRouter, HTTPException
+from models.prediction import PredictionRequest, TrainRequest
+from services.prediction_service import model_registry, ModelNotReady
+from services.stock_service import MAX_BATCH_SIZE
+
+router = APIRouter()
+
+logger = logging.getLogger(__name__)
+
+# POST /api/predictions
+# {"symbols": ["AAPL", "MSFT"], "model": "ridge", "horizon": 5}
+# Expected return over the next `horizon` trading days for every symbol, scored in one batch
+# by the newest trained version of the model. Never waits for training: if the model has never
+# been trained, training starts in the background and the answer is a 503 until it's done.
+@router.post("")
+async def predict(request: PredictionRequest):
+    if len(request.symbols) > MAX_BATCH_SIZE:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_BATCH_SIZE} symbols per request")
+    try:
+        return await model_registry.predict(request.symbols, request.model, request.horizon)
+    except HTTPException as http_error:
+        raise http_error
+    except ModelNotReady as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "30"})
+    except ImportError:
+        raise HTTPException(status_code=503, detail="Predictions need scikit-learn, which is not installed")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.exception("Error predicting: %s", e)
+        raise HTTPException(status_code=500, detail=str(e))
+
+# POST /api/predictions/train
+# Starts training a new version of a model in the background (or joins the run in progress).
+# Poll GET /api/predictions/models to see when it is done.
+@router.post("/train", status_code=202)
+async def train(request: TrainRequest):
+    try:
+        model_registry.train(request.model, request.horizon, request.symbols)
+        return {"message": "Training started", "models": model_registry.status()}
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+# GET /api/predictions/models
+# Every model with its loaded version, validation scores, versions on disk and training state
+@router.get("/models")
+async def models():
+    return model_registry.status()
@@ -0,0 +1,156 @@
+import logging
+from fastapi import APIRouter, HTTPException, Depends
+from fastapi.responses import StreamingResponse
+from models.simulation import BacktestRequest, MonteCarloRequest, SweepRequest
+from routes.auth import verify_token
+from services.backtest_service import backtest
+from services.monte_carlo_service import run_monte_carlo
+from services.sweep_service import start_sweep, cancel_sweep
+from services.export_service import (
+    FORMATS, SWEEP_COLUMNS, check_format, stream_rows, stream_rows_async,
+    backtest_rows, monte_carlo_rows, sweep_rows
+)
+from services.stock_service import get_user_portfolio
+from services.upstream import database
+import asyncio
+
+router = APIRouter()
+
+logger = logging.getLogger(__name__)
+
+# POST /api/simulations/backtest
+# Runs every strategy in the request against the same price history in one pass
+# and returns an equity curve plus summary stats for each of them.
+@router.post("/backtest")
+async def run_backtest(request: BacktestRequest):
+    try:
+        strategies = [strategy.model_dump() for strategy in request.strategies]
+        # Loading history and crunching numbers is CPU/disk work, keep it off the event loop
+        return await asyncio.to_thread(
+            backtest,
+            request.symbols,
+            strategies,
+            request.start,
+            request.end,
+            request.interval,
+            request.initial_capital,
+            request.risk_free_rate
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.exception("Error running backtest: %s", e)
+        raise HTTPException(status_code=500, detail=str(e))
+
+# POST /api/simulations/monte-carlo  (requires an Authorization header with a Firebase ID token)
+# Projects the signed-in user's current portfolio forward with simulated price paths.
+# Returns percentile bands over time and the distribution of the final portfolio value.
+@router.post("/monte-carlo")
+async def monte_carlo(request: MonteCarloRequest, uid: str = Depends(verify_token)):
+    try:
+        portfolio, balance = await database.run(get_user_portfolio, uid)
+        return await asyncio.to_thread(
+            run_monte_carlo,
+            portfolio,
+            balance,
+            request.model,
+            request.n_paths,
+            request.horizon_days,
+            request.lookback_days,
+            request.seed,
+            request.percentiles
+        )
+    except HTTPException as http_error:
+        raise http_error
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.exception("Error running Monte Carlo simulation: %s", e)
+        raise HTTPException(status_code=500, detail=str(e))
+
+# POST /api/simulations/sweeps
+# Runs the base strategy once for every combination of values in "grid" and streams the
+# results back as newline-delimited JSON while cells finish:
+#   {"sweep_id": "...", "cells": 20}
+#   {"cell": 3, "params": {...}, "stats": {...}}
+#   ...
+#   {"done": true, "completed": 20, "cancelled": false}
+# Disconnecting or calling DELETE /api/simulations/sweeps/{sweep_id} cancels the sweep.
+@router.post("/sweeps")
+async def run_sweep(request: SweepRequest):
+    try:
+        sweep = await asyncio.to_thread(
+            start_sweep,
+            request.symbols,
+            request.base.model_dump(),
+            request.grid,
+            request.start,
+            request.end,
+            request.interval,
+            request.initial_capital,
+            request.risk_free_rate
+        )
+        return StreamingResponse(sweep.stream(), media_type="application/x-ndjson")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.exception("Error starting sweep: %s", e)
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.delete("/sweeps/{sweep_id}")
+async def stop_sweep(sweep_id: str):
+    if not cancel_sweep(sweep_id):
+        raise HTTPException(status_code=404, detail="Sweep not found")
+    return {"message": "Sweep cancelled", "sweep_id": sweep_id}
+
+# ---- Exports ----
+# Same requests as above, returned as a downloadable CSV or Arrow stream (?format=csv|arrow).
+# Rows are generated and encoded a batch at a time, so memory stays flat for big results.
+
+def _export_response(format: str, body, name: str):
+    return StreamingResponse(
+        body,
+        media_type=FORMATS[format],
+        headers={"Content-Disposition": f'attachment; filename="{name}.{format}"'}
+    )
+
+def _check_export_format(format: str):
+    try:
+        check_format(format)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@router.post("/backtest/export")
+async def export_backtest(request: BacktestRequest, format: str = "csv"):
+    _check_export_format(format)
+    result = await run_backtest(request)
+    columns, rows = backtest_rows(result)
+    return _export_response(format, stream_rows(format, columns, rows), "backtest")
+
+@router.post("/monte-carlo/export")
+async def export_monte_carlo(request: MonteCarloRequest, format: str = "csv", uid: str = Depends(verify_token)):
+    _check_export_format(format)
+    result = await monte_carlo(request, uid)
+    columns, rows = monte_carlo_rows(result)
+    return _export_response(format, stream_rows(format, columns, rows), "monte_carlo")
+
+@router.post("/sweeps/export")
+async def export_sweep(request: SweepRequest, format: str = "csv"):
+    # Cells are written out as they finish, so the download starts before the sweep is done
+    _check_export_format(format)
+    try:
+        sweep = await asyncio.to_thread(
+            start_sweep,
+            request.symbols,
+            request.base.model_dump(),
+            request.grid,
+            request.start,
+            request.end,
+            request.interval,
+            request.initial_capital,
+            request.risk_free_rate
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    body = stream_rows_async(format, SWEEP_COLUMNS, sweep_rows(sweep.results()))
+    return _export_response(format, body, f"sweep_{sweep.id}")
@@ -1,45 +1,115 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Depends
-from services.stock_service import get_multiple_stocks_data, get_stocks_data
+import logging
+from fastapi import FastAPI, APIRouter, HTTPException, Depends, Query
+from models.stock import IndicatorRequest
+from services.stock_service import get_multiple_stocks_data, get_stocks_data, MAX_BATCH_SIZE
+from services.indicator_service import indicator_engine
+from services.quote_cache import get_info, quote_cache
+from services.symbol_index import symbol_search
+from services.upstream import market_data, database
 from typing import Dict
-import yfinance as yf
+import asyncio
 
 router = APIRouter()
 
+logger = logging.getLogger(__name__)
+
+# GET /api/stocks/stocks?stock_symbols=AAPL&stock_symbols=MSFT
+# or  /api/stocks/stocks?stock_symbols=AAPL,MSFT,NVDA
+# Returns every quote in one round trip, with per-symbol errors instead of failing the whole request
 @router.get("/stocks", response_model=Dict)
-async def get_stocks(stock_symbols: list[str]):
+async def get_stocks(stock_symbols: list[str] = Query(...)):
     try:
-        stock_data = get_stocks_data(stock_symbols)
+        # Allow comma separated lists as well as repeated query params
+        symbols = [symbol for value in stock_symbols for symbol in value.split(",")]
+        stock_data = await get_stocks_data(symbols)
         return stock_data
+    except HTTPException as http_error:
+        raise http_error
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
     
+# GET /api/stocks/stocks/AAPL?start=2015-01-01&end=2025-01-01&interval=1d
+# start/end are YYYY-MM-DD (end is exclusive). Defaults to the last year of daily bars.
 @router.get("/stocks/{symbol}", response_model=Dict)
-async def get_stocks_data(symbol: str):
+async def get_stock_history(symbol: str, start: str = None, end: str = None, interval: str = "1d"):
     try:    
-        stock_data = get_multiple_stocks_data(symbol)
+        # Reading/filling the history store touches disk and maybe Yahoo, so keep it off the event loop
+        stock_data = await market_data.run(get_multiple_stocks_data, symbol, start, end, interval)
         return stock_data
+    except HTTPException as http_error:
+        raise http_error
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+# POST /api/stocks/indicators
+# {"symbols": ["AAPL", "MSFT"], "indicators": ["sma:20", "rsi:14", "macd"], "start": "2024-01-01"}
+# Every indicator for every symbol in one call, aligned with the returned dates:
+#   {"results": {"AAPL": {"date": [...], "close": [...], "indicators": {"sma:20": {"value": [...]}, ...}}},
+#    "errors": {"BAD": "..."}}
+# Series are kept in memory and updated bar by bar, so repeat requests don't recompute anything.
+@router.post("/indicators")
+async def get_indicators(request: IndicatorRequest):
+    if len(request.symbols) > MAX_BATCH_SIZE:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_BATCH_SIZE} symbols per request")
+    try:
+        return await indicator_engine.compute(
+            request.symbols, request.indicators, request.start, request.end, request.interval
+        )
+    except HTTPException as http_error:
+        raise http_error
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.exception("Error computing indicators: %s", e)
+        raise HTTPException(status_code=500, detail=str(e))
+
+# GET /api/stocks/search-stock?symbol=app&limit=10&quotes=3
+# Search-as-you-type: matches partial symbols and company names (with some typo tolerance)
+# from the local symbol index, best match first. Live price fields are only looked up for
+# the first `quotes` results so a keystroke costs at most a few (cached) quote lookups.
 @router.get("/search-stock")
-async def search(symbol: str):
-   try:
-       stock = yf.Ticker(symbol)
-       stock_info = stock.info
-       print(f"Debug - Retrieved stock info for {symbol}")  # Debug print
-       
-       return {
-            "symbol": stock_info.get("symbol"),          # e.g., "AAPL"
-            "name": stock_info.get("shortName"),         # e.g., "Apple Inc."
-            "currentPrice": stock_info.get("currentPrice"),  # e.g., 188.38
-            "marketCap": stock_info.get("marketCap"),    # Company's market value
-            "volume": stock_info.get("regularMarketVolume"),  # Trading volume
-            "sector": stock_info.get("sector"),          # e.g., "Technology"
-            "industry": stock_info.get("industry"),      # e.g., "Consumer Electronics"
-            "dayHigh": stock_info.get("dayHigh"),        # Today's high
-            "dayLow": stock_info.get("dayLow"),          # Today's low
-            "previousClose": stock_info.get("previousClose")  # Previous day's close
-       }
-   except Exception as e:
-       print(f"Error fetching stock data: {str(e)}")  # Debug print
-       raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
+async def search(symbol: str, limit: int = Query(10, ge=1, le=50), quotes: int = Query(3, ge=0, le=10)):
+    try:
+        matches = symbol_search.search(symbol, limit)
+
+        async def live_fields(match):
+            try:
+                return await market_data.run(get_info, match["symbol"], ("price",))
+            except Exception as e:
+                # A missing quote shouldn't fail the search, the result just has no price
+                logger.warning("Error fetching quote for %s: %s", match["symbol"], e)
+                return {}
+
+        live = await asyncio.gather(*(live_fields(match) for match in matches[:quotes]))
+
+        results = []
+        for i, match in enumerate(matches):
+            stock_info = live[i] if i < len(live) else {}
+            results.append({
+                "symbol": match["symbol"],                           # e.g., "AAPL"
+                "name": match["shortName"],                          # e.g., "Apple Inc."
+                "sector": match["sector"],                           # e.g., "Technology"
+                "industry": match["industry"],                       # e.g., "Consumer Electronics"
+                "currentPrice": stock_info.get("currentPrice"),      # e.g., 188.38
+                "marketCap": stock_info.get("marketCap"),            # Company's market value
+                "volume": stock_info.get("regularMarketVolume"),     # Trading volume
+                "dayHigh": stock_info.get("dayHigh"),                # Today's high
+                "dayLow": stock_info.get("dayLow"),                  # Today's low
+                "previousClose": stock_info.get("previousClose")     # Previous day's close
+            })
+        return {"query": symbol, "results": results}
+    except Exception as e:
+        logger.exception("Error searching stocks: %s", e)
+        raise HTTPException(status_code=500, detail=str(e))
+
+# Hit/miss/coalesce counters for the shared quote cache, useful for tuning the TTLs
+@router.get("/cache-stats")
+async def cache_stats():
+    return {**quote_cache.stats(), "symbol_index": symbol_search.stats()}
+
+# How busy the upstream pools are (in flight, rejected with 503, timed out...)
+@router.get("/upstream-stats")
+async def upstream_stats():
+    return {"market_data": market_data.stats(), "database": database.stats()}
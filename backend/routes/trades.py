@@ -0,0 +1,97 @@
+import logging
+from fastapi import APIRouter, HTTPException, Depends
+from models.trade import TradeRequest, BasketRequest
+from routes.auth import verify_token
+from services.firebase_service import get_db
+from services.stock_service import buy_stock, sell_stock, place_orders
+from services.upstream import database
+from services import ledger_service
+from services.export_service import FORMATS, TRANSACTION_COLUMNS, check_format, iter_transactions, stream_rows
+from fastapi.responses import StreamingResponse
+
+router = APIRouter()
+
+logger = logging.getLogger(__name__)
+
+# POST /api/trades/buy and /api/trades/sell
+# Each trade is one Firestore transaction: read the user once, commit balance + portfolio + ledger once.
+# After a trade commits, the in-memory position index and leaderboard are updated right away
+# (they listen for trades in services/stock_service.py), without re-reading Firestore.
+@router.post("/buy")
+async def buy(trade: TradeRequest, uid: str = Depends(verify_token)):
+    return await buy_stock(uid, trade.symbol, trade.quantity)
+
+@router.post("/sell")
+async def sell(trade: TradeRequest, uid: str = Depends(verify_token)):
+    return await sell_stock(uid, trade.symbol, trade.quantity)
+
+# POST /api/trades/basket
+# Many buys and sells filled as ONE atomic commit (e.g. rebalancing a whole portfolio).
+# If any order can't be filled, none of them are.
+@router.post("/basket")
+async def basket(request: BasketRequest, uid: str = Depends(verify_token)):
+    transactions, new_balance = await place_orders(uid, [order.model_dump() for order in request.orders])
+    return {
+        "status": "success",
+        "message": f"Successfully filled {len(transactions)} orders",
+        "transactions": transactions,
+        "new_balance": new_balance
+    }
+
+# GET /api/trades/history?limit=50&cursor=123
+# The signed-in user's trades, newest first, one page at a time.
+# Pass the returned next_cursor as ?cursor= to get the next page.
+@router.get("/history")
+async def trade_history(cursor: int = None, limit: int = ledger_service.DEFAULT_PAGE_SIZE,
+                        uid: str = Depends(verify_token)):
+    try:
+        db = await database.run(get_db)
+        if cursor is None:
+            # Users from before the ledger get their old trades copied in on the first page
+            await database.run(ledger_service.ensure_migrated, db, uid)
+        return await database.run(ledger_service.get_history, db, uid, cursor, limit)
+    except HTTPException as http_error:
+        raise http_error
+    except Exception as e:
+        logger.exception("Error reading trade history: %s", e)
+        raise HTTPException(status_code=500, detail=str(e))
+
+# GET /api/trades/history/export?format=csv   (or format=arrow)
+# The user's whole trade history as a download. Rows are read from the ledger a page
+# at a time and streamed out as they are encoded, so memory use doesn't grow with history length.
+@router.get("/history/export")
+async def export_trade_history(format: str = "csv", uid: str = Depends(verify_token)):
+    try:
+        check_format(format)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    try:
+        db = await database.run(get_db)
+        await database.run(ledger_service.ensure_migrated, db, uid)
+    except Exception as e:
+        logger.exception("Error migrating legacy trades: %s", e)
+        raise HTTPException(status_code=500, detail=str(e))
+    return StreamingResponse(
+        stream_rows(format, TRANSACTION_COLUMNS, iter_transactions(db, uid)),
+        media_type=FORMATS[format],
+        headers={"Content-Disposition": f'attachment; filename="transactions.{format}"'}
+    )
+
+# GET /api/trades/holdings
+# Holdings and balance rebuilt from the ledger (latest snapshot + the trades after it)
+@router.get("/holdings")
+async def ledger_holdings(uid: str = Depends(verify_token)):
+    try:
+        db = await database.run(get_db)
+        user_doc = await database.run(db.collection("users").document(uid).get)
+        if not user_doc.exists:
+            raise HTTPException(status_code=404, detail="User not found")
+        user_data = user_doc.to_dict()
+        await database.run(ledger_service.ensure_migrated, db, uid, user_data)
+        starting_balance = user_data.get("starting_balance", 500000.0)
+        return await database.run(ledger_service.rebuild_holdings, db, uid, starting_balance)
+    except HTTPException as http_error:
+        raise http_error
+    except Exception as e:
+        logger.exception("Error rebuilding holdings: %s", e)
+        raise HTTPException(status_code=500, detail=str(e))
@@ -0,0 +1,224 @@
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from services.history_store import get_history
+
+# Vectorized portfolio backtests.
+#
+# Prices for all symbols are loaded into one aligned matrix (dates x symbols) and every
+# strategy is evaluated with array operations instead of looping over days in Python.
+# Strategies of the same kind are stacked as columns of a weight matrix (symbols x configs)
+# so many configs are evaluated against the same prices with a single matrix product.
+
+PERIODS_PER_YEAR = {"1d": 252, "1wk": 52, "1mo": 12}
+
+# How many symbols' history we load from the store at the same time
+LOAD_WORKERS = 8
+
+
+def load_price_matrix(symbols, start=None, end=None, interval="1d"):
+    """
+    Load closing prices for many symbols into one aligned matrix.
+    Returns (dates, prices) where dates is a datetime64[D] array of length T
+    and prices has shape (T, number of symbols).
+    Gaps (e.g. a holiday on one exchange only) are forward-filled and the matrix starts
+    at the first date where every symbol has a price.
+    """
+    with ThreadPoolExecutor(max_workers=LOAD_WORKERS) as pool:
+        histories = list(pool.map(lambda symbol: get_history(symbol, start, end, interval), symbols))
+
+    for symbol, bars in zip(symbols, histories):
+        if len(bars["date"]) == 0:
+            raise ValueError(f"No price history for {symbol}")
+
+    # Every date any symbol traded on
+    days = [bars["date"].astype("datetime64[s]").astype("datetime64[D]") for bars in histories]
+    dates = np.unique(np.concatenate(days))
+
+    prices = np.full((len(dates), len(symbols)), np.nan)
+    for column, (symbol_days, bars) in enumerate(zip(days, histories)):
+        prices[np.searchsorted(dates, symbol_days), column] = bars["close"]
+
+    # Forward fill: for every cell, take the row index of the last valid price at or above it
+    valid = ~np.isnan(prices)
+    last_valid = np.where(valid, np.arange(len(dates))[:, None], 0)
+    np.maximum.accumulate(last_valid, axis=0, out=last_valid)
+    prices = prices[last_valid, np.arange(len(symbols))]
+
+    # Drop the leading rows where some symbol hasn't started trading yet
+    complete = ~np.isnan(prices).any(axis=1)
+    if not complete.any():
+        raise ValueError("The symbols have no overlapping price history")
+    first = np.argmax(complete)
+    return dates[first:], prices[first:]
+
+
+def schedule_mask(dates, frequency: str):
+    """True on the first trading day of every period (and always on the first day)"""
+    if frequency == "daily":
+        return np.ones(len(dates), dtype=bool)
+    if frequency == "weekly":
+        # Days since the Monday before the epoch, integer-divided into weeks
+        key = (dates.astype("int64") + 3) // 7
+    elif frequency == "monthly":
+        key = dates.astype("datetime64[M]").astype("int64")
+    elif frequency == "quarterly":
+        key = dates.astype("datetime64[M]").astype("int64") // 3
+    elif frequency == "yearly":
+        key = dates.astype("datetime64[Y]").astype("int64")
+    else:
+        raise ValueError(f"Unknown frequency {frequency}")
+    mask = np.empty(len(dates), dtype=bool)
+    mask[0] = True
+    mask[1:] = key[1:] != key[:-1]
+    return mask
+
+
+def weight_matrix(symbols, strategies):
+    """Stack each strategy's target weights into a (symbols x strategies) matrix, normalized to sum to 1"""
+    index = {symbol: i for i, symbol in enumerate(symbols)}
+    weights = np.zeros((len(symbols), len(strategies)))
+    for k, strategy in enumerate(strategies):
+        target = strategy.get("weights")
+        if not target:
+            weights[:, k] = 1.0
+            continue
+        for symbol, weight in target.items():
+            symbol = symbol.upper()
+            if symbol not in index:
+                raise ValueError(f"Weight given for {symbol}, which is not in symbols")
+            if weight < 0:
+                raise ValueError(f"Negative weight for {symbol}")
+            weights[index[symbol], k] = weight
+    totals = weights.sum(axis=0)
+    if (totals <= 0).any():
+        raise ValueError("Every strategy needs at least one positive weight")
+    return weights / totals
+
+
+def _buy_and_hold(prices, weights, capital):
+    # Buy once on the first day and never trade again
+    return capital * (prices / prices[0]) @ weights
+
+
+def _rebalance(prices, weights, capital, mask):
+    # Between two rebalance dates the share counts stay fixed, so inside each segment
+    # value = value at segment start * (prices / prices at segment start) @ weights.
+    starts = np.flatnonzero(mask)
+    segment = np.cumsum(mask) - 1
+    growth_within = (prices / prices[starts][segment]) @ weights
+    # How much each segment grew by the time the next one starts
+    segment_growth = np.ones((len(starts), weights.shape[1]))
+    segment_growth[1:] = (prices[starts[1:]] / prices[starts[:-1]]) @ weights
+    value_at_start = capital * np.cumprod(segment_growth, axis=0)
+    return value_at_start[segment] * growth_within
+
+
+def _dca(prices, weights, capital, contributions, mask):
+    # Initial capital is invested on day one; each contribution buys weights[i] * amount / price
+    # worth of every symbol on its schedule date. Shares bought per unit of money are
+    # cumsum(1 / price) over the schedule dates, which doesn't depend on the weights,
+    # so all configs sharing a schedule reuse it.
+    buys = np.where(mask[:, None], 1.0 / prices, 0.0)
+    buys[0] = 0.0
+    shares_per_dollar = np.cumsum(buys, axis=0)
+    equity = capital * (prices / prices[0]) @ weights + ((prices * shares_per_dollar) @ weights) * contributions
+    invested_flow = np.where(mask[:, None], contributions, 0.0)
+    invested_flow[0] = 0.0
+    return equity, invested_flow
+
+
+def run_backtest(dates, prices, symbols, strategies, initial_capital: float):
+    """
+    Evaluate every strategy against the same price matrix.
+    strategies is a list of dicts with "type", "weights", "frequency" and "contribution".
+    Returns (equity, flows): two (T x strategies) arrays holding each strategy's portfolio
+    value and the new money added on each day.
+    """
+    weights = weight_matrix(symbols, strategies)
+    equity = np.empty((len(dates), len(strategies)))
+    flows = np.zeros((len(dates), len(strategies)))
+
+    # Group strategies that can share the same computation
+    groups = {}
+    for k, strategy in enumerate(strategies):
+        key = strategy["type"] if strategy["type"] == "buy_and_hold" else (strategy["type"], strategy.get("frequency", "monthly"))
+        groups.setdefault(key, []).append(k)
+
+    for key, columns in groups.items():
+        group_weights = weights[:, columns]
+        if key == "buy_and_hold":
+            equity[:, columns] = _buy_and_hold(prices, group_weights, initial_capital)
+            continue
+        strategy_type, frequency = key
+        mask = schedule_mask(dates, frequency)
+        if strategy_type == "rebalance":
+            equity[:, columns] = _rebalance(prices, group_weights, initial_capital, mask)
+        elif strategy_type == "dca":
+            contributions = np.array([strategies[k].get("contribution", 0.0) for k in columns])
+            equity[:, columns], flows[:, columns] = _dca(prices, group_weights, initial_capital, contributions, mask)
+        else:
+            raise ValueError(f"Unknown strategy type {strategy_type}")
+
+    return equity, flows
+
+
+def summarize(dates, equity, flows, initial_capital: float, periods_per_year: int, risk_free_rate: float = 0.0):
+    """
+    Summary statistics for every strategy column at once.
+    Returns are time-weighted (new contributions are not counted as gains).
+    """
+    # Per-period return with that day's contribution taken out
+    returns = (equity[1:] - flows[1:]) / equity[:-1] - 1.0
+    growth = np.vstack([np.ones((1, equity.shape[1])), np.cumprod(1.0 + returns, axis=0)])
+    drawdown = growth / np.maximum.accumulate(growth, axis=0) - 1.0
+
+    years = max((dates[-1] - dates[0]).astype(int) / 365.25, 1e-9)
+    total_return = growth[-1] - 1.0
+    volatility = returns.std(axis=0) * np.sqrt(periods_per_year) if len(returns) > 1 else np.zeros(equity.shape[1])
+    mean_return = returns.mean(axis=0) * periods_per_year if len(returns) else np.zeros(equity.shape[1])
+    with np.errstate(divide="ignore", invalid="ignore"):
+        sharpe = np.where(volatility > 0, (mean_return - risk_free_rate) / volatility, np.nan)
+
+    invested = initial_capital + flows.sum(axis=0)
+    return [
+        {
+            "final_value": float(equity[-1, k]),
+            "total_invested": float(invested[k]),
+            "total_return": float(total_return[k]),
+            "cagr": float((1.0 + total_return[k]) ** (1.0 / years) - 1.0),
+            "volatility": float(volatility[k]),
+            "sharpe": None if np.isnan(sharpe[k]) else float(sharpe[k]),
+            "max_drawdown": float(drawdown[:, k].min())
+        }
+        for k in range(equity.shape[1])
+    ]
+
+
+def backtest(symbols, strategies, start=None, end=None, interval="1d", initial_capital=10000.0, risk_free_rate=0.0):
+    """
+    Load prices for symbols and run every strategy against them.
+    Returns the dates plus an equity curve and summary stats per strategy.
+    """
+    symbols = list(dict.fromkeys(symbol.upper() for symbol in symbols))
+    if not symbols:
+        raise ValueError("No symbols provided")
+    if not strategies:
+        raise ValueError("No strategies provided")
+
+    dates, prices = load_price_matrix(symbols, start, end, interval)
+    equity, flows = run_backtest(dates, prices, symbols, strategies, initial_capital)
+    stats = summarize(dates, equity, flows, initial_capital, PERIODS_PER_YEAR[interval], risk_free_rate)
+
+    return {
+        "symbols": symbols,
+        "dates": [str(day) for day in dates],
+        "results": [
+            {
+                "name": strategy.get("name") or strategy["type"],
+                "config": strategy,
+                "equity": equity[:, k].round(2).tolist(),
+                "stats": stats[k]
+            }
+            for k, strategy in enumerate(strategies)
+        ]
+    }
@@ -0,0 +1,190 @@
+import csv
+import io
+import json
+from services.ledger_service import ledger_ref
+
+# pyarrow is optional: only needed for the binary (Arrow) export format
+try:
+    import pyarrow as pa
+except ImportError:
+    pa = None
+
+# Streaming exports.
+#
+# Rows are produced by a generator and encoded a batch at a time, so an export never holds
+# more than one batch in memory no matter how many rows it has. Two formats:
+#   - "csv":   plain CSV text
+#   - "arrow": Apache Arrow IPC stream (binary and columnar, loads straight into pandas/polars)
+#
+# Columns are described as (name, kind) pairs where kind is "int", "float" or "str".
+
+FORMATS = {
+    "csv": "text/csv",
+    "arrow": "application/vnd.apache.arrow.stream"
+}
+
+# Rows encoded together
+BATCH_SIZE = 1000
+
+TRANSACTION_COLUMNS = [
+    ("seq", "int"), ("timestamp", "str"), ("type", "str"), ("symbol", "str"),
+    ("quantity", "float"), ("price", "float"), ("total_cost", "float"), ("total_sale_amount", "float"),
+    ("profit_loss", "float"), ("profit_loss_percentage", "float")
+]
+
+
+def check_format(fmt: str):
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown export format {fmt}. Use one of {sorted(FORMATS)}")
+    if fmt == "arrow" and pa is None:
+        raise ValueError("Arrow export needs the pyarrow package installed")
+
+
+class _CsvEncoder:
+    def __init__(self, columns):
+        self.names = [name for name, _ in columns]
+
+    def _write(self, rows):
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerows(rows)
+        return buffer.getvalue().encode()
+
+    def header(self):
+        return self._write([self.names])
+
+    def encode(self, batch):
+        return self._write([[row.get(name) for name in self.names] for row in batch])
+
+    def footer(self):
+        return b""
+
+
+class _ChunkSink:
+    """File-like object that collects what Arrow writes so we can hand it out chunk by chunk"""
+
+    def __init__(self):
+        self.chunks = []
+        self.closed = False
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self):
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
+
+
+class _ArrowEncoder:
+    TYPES = {"int": "int64", "float": "float64", "str": "string"}
+
+    def __init__(self, columns):
+        self.schema = pa.schema([(name, getattr(pa, self.TYPES[kind])()) for name, kind in columns])
+        self.sink = _ChunkSink()
+        self.writer = pa.ipc.new_stream(pa.PythonFile(self.sink, mode="w"), self.schema)
+
+    def header(self):
+        return self.sink.drain()
+
+    def encode(self, batch):
+        self.writer.write_batch(pa.RecordBatch.from_pylist(batch, schema=self.schema))
+        return self.sink.drain()
+
+    def footer(self):
+        self.writer.close()
+        return self.sink.drain()
+
+
+def _encoder(fmt: str, columns):
+    check_format(fmt)
+    return _CsvEncoder(columns) if fmt == "csv" else _ArrowEncoder(columns)
+
+
+def stream_rows(fmt: str, columns, rows):
+    """Encode an iterable of row dicts as CSV or Arrow, yielding bytes one batch at a time"""
+    encoder = _encoder(fmt, columns)
+    yield encoder.header()
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= BATCH_SIZE:
+            yield encoder.encode(batch)
+            batch = []
+    if batch:
+        yield encoder.encode(batch)
+    yield encoder.footer()
+
+
+async def stream_rows_async(fmt: str, columns, rows):
+    """Same as stream_rows, for rows that arrive from an async generator"""
+    encoder = _encoder(fmt, columns)
+    yield encoder.header()
+    batch = []
+    async for row in rows:
+        batch.append(row)
+        if len(batch) >= BATCH_SIZE:
+            yield encoder.encode(batch)
+            batch = []
+    if batch:
+        yield encoder.encode(batch)
+    yield encoder.footer()
+
+
+def iter_transactions(db, user_id: str, page_size: int = BATCH_SIZE):
+    """Every trade in a user's ledger, oldest first, read one page at a time"""
+    last_seq = 0
+    while True:
+        docs = list(ledger_ref(db, user_id).where("seq", ">", last_seq).order_by("seq").limit(page_size).stream())
+        for doc in docs:
+            yield doc.to_dict()
+        if len(docs) < page_size:
+            return
+        last_seq = docs[-1].to_dict()["seq"]
+
+
+def backtest_rows(result: dict):
+    """Columns and rows (one per date, one column per strategy) for a backtest result"""
+    names = [f"{i}_{strategy['name']}" for i, strategy in enumerate(result["results"])]
+    columns = [("date", "str")] + [(name, "float") for name in names]
+
+    def rows():
+        curves = [strategy["equity"] for strategy in result["results"]]
+        for i, day in enumerate(result["dates"]):
+            yield {"date": day, **{name: curve[i] for name, curve in zip(names, curves)}}
+
+    return columns, rows()
+
+
+def monte_carlo_rows(result: dict):
+    """Columns and rows (one per projected day, one column per percentile band) for a Monte Carlo result"""
+    bands = list(result["bands"])
+    columns = [("day", "int")] + [(f"p{band}", "float") for band in bands]
+
+    def rows():
+        for i, day in enumerate(result["days"]):
+            yield {"day": day, **{f"p{band}": result["bands"][band][i] for band in bands}}
+
+    return columns, rows()
+
+
+SWEEP_STAT_COLUMNS = ["final_value", "total_invested", "total_return", "cagr", "volatility", "sharpe", "max_drawdown"]
+SWEEP_COLUMNS = [("cell", "int"), ("params", "str"), ("error", "str")] + [(name, "float") for name in SWEEP_STAT_COLUMNS]
+
+
+async def sweep_rows(results):
+    """Flatten sweep results (as they finish) into export rows; params are kept as a JSON string"""
+    async for result in results:
+        yield {
+            "cell": result.get("cell"),
+            "params": json.dumps(result.get("params"), sort_keys=True),
+            "error": result.get("error"),
+            **result.get("stats", {})
+        }
@@ -0,0 +1,162 @@
+import threading
+import time
+from collections import OrderedDict
+from datetime import date, timedelta
+import numpy as np
+from config.settings import FEATURE_CACHE_SIZE, FEATURE_HISTORY_DAYS, HISTORY_TAIL_REFRESH
+from services.history_store import get_history
+from services.indicator_service import SMA, RSI, MACD, BollingerBands
+
+# Feature engineering for the prediction models.
+#
+# Every symbol's daily bars are turned into one feature matrix (one row per trading day,
+# one column per feature in FEATURES), computed with array operations over the whole history.
+# Matrices are cached per symbol, so training several models on the same symbols and
+# scoring a watchlist right after both reuse the same features instead of recomputing them.
+# A cached matrix is rebuilt once it is older than HISTORY_TAIL_REFRESH (the history store
+# refreshes the latest bar at the same rate).
+#
+# Every value in a row only uses bars up to and including that day, so a row can be
+# scored as soon as its bar exists, and training never sees the future.
+
+FEATURES = [
+    "return_1d",        # log return over the last day
+    "return_5d",        # ... last week
+    "return_21d",       # ... last month
+    "volatility_10d",   # standard deviation of daily log returns over the last 10 days
+    "volatility_21d",
+    "close_to_sma_10",  # close / 10 day average - 1
+    "close_to_sma_50",
+    "rsi_14",           # RSI rescaled to [-0.5, 0.5]
+    "macd_histogram",   # MACD histogram as a fraction of the close
+    "bollinger_b",      # position inside the Bollinger bands, 0 = middle
+    "volume_z_21",      # volume z-score against the last 21 days
+    "range_1d",         # (high - low) / close
+]
+
+# Bumped whenever FEATURES or how they are computed changes; models trained on another
+# version are not used (their columns wouldn't mean the same thing)
+FEATURE_VERSION = 1
+
+# Days of history needed before the first complete row (the longest window is 50 days)
+WARMUP_DAYS = 80
+
+
+def _shift(values, periods: int):
+    # values[t - periods] at position t, NaN where there is nothing that far back
+    out = np.full(len(values), np.nan)
+    if periods < len(values):
+        out[periods:] = values[:len(values) - periods]
+    return out
+
+
+def _rolling(values, window: int, reduce):
+    out = np.full(len(values), np.nan)
+    if len(values) >= window:
+        out[window - 1:] = reduce(np.lib.stride_tricks.sliding_window_view(values, window), axis=1)
+    return out
+
+
+def compute_features(bars: dict):
+    """
+    Feature matrix for one symbol's bars (as returned by the history store).
+    Returns (dates, closes, features) where features has shape (days, len(FEATURES));
+    rows without enough history before them contain NaN.
+    """
+    valid = ~np.isnan(bars["close"])
+    dates = bars["date"][valid]
+    close = bars["close"][valid]
+    high, low = bars["high"][valid], bars["low"][valid]
+    volume = np.nan_to_num(bars["volume"][valid])
+
+    log_close = np.log(close)
+    daily = log_close - _shift(log_close, 1)
+    sma_10 = SMA(10).compute(close)["value"]
+    sma_50 = SMA(50).compute(close)["value"]
+    rsi = RSI(14).compute(close)["value"]
+    macd = MACD(12, 26, 9).compute(close)
+    bands = BollingerBands(20, 2.0).compute(close)
+    volume_mean = _rolling(volume, 21, np.mean)
+    volume_std = _rolling(volume, 21, np.std)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        columns = [
+            daily,
+            log_close - _shift(log_close, 5),
+            log_close - _shift(log_close, 21),
+            _rolling(daily, 10, np.std),
+            _rolling(daily, 21, np.std),
+            close / sma_10 - 1,
+            close / sma_50 - 1,
+            rsi / 100 - 0.5,
+            macd["histogram"] / close,
+            (close - bands["middle"]) / (bands["upper"] - bands["lower"]),
+            np.where(volume_std > 0, (volume - volume_mean) / volume_std, 0.0),
+            (high - low) / close,
+        ]
+    features = np.column_stack(columns) if len(close) else np.empty((0, len(FEATURES)))
+    # Flat prices give 0 / 0 in a few columns; those are "no signal", not missing
+    features[np.isinf(features)] = np.nan
+    return dates, close, features
+
+
+def forward_returns(closes, horizon: int):
+    """Training target: log return over the next `horizon` bars (NaN where the future isn't known yet)"""
+    log_close = np.log(closes)
+    out = np.full(len(closes), np.nan)
+    if horizon < len(closes):
+        out[:-horizon] = log_close[horizon:] - log_close[:-horizon]
+    return out
+
+
+class FeatureStore:
+    def __init__(self, max_entries: int = FEATURE_CACHE_SIZE, history_days: int = FEATURE_HISTORY_DAYS):
+        self.max_entries = max_entries
+        self.history_days = history_days
+        self.entries = OrderedDict()  # symbol -> (computed_at, dates, closes, features)
+        self.lock = threading.Lock()
+        self.locks = {}               # symbol -> lock held while its features are computed
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, symbol: str):
+        """
+        (dates, closes, features) for symbol over the last history_days days.
+        Blocking (reads the history store), so call it from a worker thread.
+        """
+        symbol = symbol.upper()
+        with self.lock:
+            symbol_lock = self.locks.setdefault(symbol, threading.Lock())
+        # Several requests for the same symbol compute its features once
+        with symbol_lock:
+            with self.lock:
+                entry = self.entries.get(symbol)
+                if entry is not None and time.monotonic() - entry[0] < HISTORY_TAIL_REFRESH:
+                    self.entries.move_to_end(symbol)
+                    self.hits += 1
+                    return entry[1:]
+                self.misses += 1
+
+            start = date.today() - timedelta(days=self.history_days + WARMUP_DAYS)
+            dates, closes, features = compute_features(get_history(symbol, start, None, "1d"))
+            with self.lock:
+                self.entries[symbol] = (time.monotonic(), dates, closes, features)
+                self.entries.move_to_end(symbol)
+                while len(self.entries) > self.max_entries:
+                    evicted, _ = self.entries.popitem(last=False)
+                    self.locks.pop(evicted, None)
+            return dates, closes, features
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "symbols": len(self.entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else None
+            }
+
+
+# One feature cache shared by the whole app
+feature_store = FeatureStore()
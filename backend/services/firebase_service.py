@@ -1,45 +1,53 @@
+import logging
+import threading
 import firebase_admin
-from firebase_admin import credentials, firestore
+from firebase_admin import credentials
 import os
-from pathlib import Path
+from config.settings import FIREBASE_CREDENTIALS
 
-# We need to find where our serviceAccountKey.json is located
-# __file__ is this file's location
-# .resolve() gets the absolute path
-# .parent.parent goes up two directories (from services/ to backend/)
-BASE_DIR = Path(__file__).resolve().parent.parent
+logger = logging.getLogger(__name__)
 
-# Join the paths to get the full path to our service account key
-# This will create: backend/firebase/serviceAccountKey.json
-SERVICE_ACCOUNT_PATH = os.path.join(BASE_DIR, "firebase", "serviceAccountKey.json")
+# Firebase is set up the first time something needs it (a database call, a token check),
+# not when this module is imported. Importing the app stays fast, and a worker without
+# credentials still starts: it reports not ready (see /health/ready) instead of crashing.
+#
+# Credentials come from the service account key at FIREBASE_CREDENTIALS
+# (backend/firebase/serviceAccountKey.json by default). If there is no key file there,
+# Google Application Default Credentials are used (e.g. the service account of a Cloud Run worker).
+SERVICE_ACCOUNT_PATH = FIREBASE_CREDENTIALS
 
-# Function to set up Firebase when our app starts
-def init_firebase():
-    try:
-        # Firebase can only be initialized once
-        # _apps is a list of initialized Firebase apps
-        if not firebase_admin._apps:
-            # Create credentials using our service account key
-            cred = credentials.Certificate(SERVICE_ACCOUNT_PATH)
-            # Initialize Firebase with these credentials
-            firebase_admin.initialize_app(cred)
-            print(f"Firebase connected successfully using {SERVICE_ACCOUNT_PATH}")
-        else:
-            # If Firebase is already running, just let us know
-            print("Firebase already initialized")
+# Two requests arriving together must not both try to initialize the app
+_init_lock = threading.Lock()
 
-    except Exception as e:
-        print(f"Error initializing Firebase: {e}")
-        raise e
+# Function to set up Firebase, called on first use
+def init_firebase():
+    # Firebase can only be initialized once
+    # _apps is a list of initialized Firebase apps
+    if firebase_admin._apps:
+        return firebase_admin.get_app()
+    with _init_lock:
+        if firebase_admin._apps:
+            return firebase_admin.get_app()
+        try:
+            if os.path.exists(SERVICE_ACCOUNT_PATH):
+                # Create credentials using our service account key
+                app = firebase_admin.initialize_app(credentials.Certificate(SERVICE_ACCOUNT_PATH))
+                logger.info("Firebase connected successfully using %s", SERVICE_ACCOUNT_PATH)
+            else:
+                app = firebase_admin.initialize_app()
+                logger.info("No service account key at %s, Firebase uses application default credentials",
+                            SERVICE_ACCOUNT_PATH)
+            return app
+        except Exception as e:
+            logger.error("Error initializing Firebase: %s", e)
+            raise e
 
 # Function to get the Firestore database client
 def get_db():
+    # Imported here: the Firestore client library (gRPC) is slow to import and
+    # only needed once the first database call is made
+    from firebase_admin import firestore
     # Make sure Firebase is initialized before getting the database
-    if not firebase_admin._apps:
-        init_firebase()
-    # Return the database client for Firestore operations
+    init_firebase()
+    # Return the database client for Firestore operations (created once and reused by firebase_admin)
     return firestore.client()
-
-# When this file is imported, initialize Firebase right away
-
-init_firebase()
@@ -0,0 +1,224 @@
+import json
+import os
+import re
+import shutil
+import threading
+import time
+import uuid
+from datetime import date, datetime, timedelta, timezone
+import numpy as np
+from config.settings import HISTORY_DIR, HISTORY_TAIL_REFRESH
+from services.market_provider import get_provider
+from services.metrics import metrics
+
+# Local, persistent store for OHLCV price history.
+#
+# Every (interval, symbol) pair gets its own folder on disk:
+#   data/history/1d/AAPL/meta.json          <- which date range we have and which version holds it
+#   data/history/1d/AAPL/v000003/date.npy   <- bar timestamps (seconds since epoch, UTC)
+#   data/history/1d/AAPL/v000003/open.npy   <- one NumPy file per column ("columnar")
+#   ...
+# An update writes every column into a new version folder and then replaces meta.json, so
+# readers (and a crash halfway through) see either the old version or the new one, never a mix.
+# Workers share the folders: each writer creates its own version folder and its own temporary
+# meta file, so two workers updating the same symbol never write into each other's files.
+# Stores written before versions existed keep their columns next to meta.json; their columns
+# are checked for equal lengths on read and downloaded again if they don't match.
+#
+# Reads are memory-mapped, so asking for a slice of 10+ years of data only touches
+# the part of the file we need. When a request asks for dates we don't have yet,
+# only the missing ranges are downloaded (from Yahoo, through services/market_provider.py)
+# and merged into the files.
+
+COLUMNS = ["open", "high", "low", "close", "volume"]
+
+# Intervals yfinance understands
+INTERVALS = {"1m", "2m", "5m", "15m", "30m", "60m", "90m", "1h", "1d", "5d", "1wk", "1mo", "3mo"}
+
+# Default window when no start is given. Yahoo only serves the last 7 days of 1 minute bars
+# and the last 60 days of the other intraday intervals
+DEFAULT_WINDOW_DAYS = {"1m": 7, "2m": 60, "5m": 60, "15m": 60, "30m": 60, "60m": 60, "90m": 60, "1h": 60}
+DEFAULT_WINDOW = 365
+
+# Symbols become folder names, so only allow characters tickers actually use (AAPL, BRK-B, ^GSPC, EURUSD=X)
+SYMBOL_PATTERN = re.compile(r"^[A-Z0-9.\-^=]{1,15}$")
+
+# Version folders inside a symbol's folder
+VERSION_PATTERN = re.compile(r"^v\d{6}$")
+
+# One lock per (interval, symbol) so two requests don't download/write the same files at once
+_locks = {}
+_locks_lock = threading.Lock()
+
+
+def _lock_for(symbol: str, interval: str):
+    with _locks_lock:
+        return _locks.setdefault((interval, symbol), threading.Lock())
+
+
+def _folder(symbol: str, interval: str):
+    return os.path.join(HISTORY_DIR, interval, symbol)
+
+
+def _to_epoch(day: date):
+    return int(datetime(day.year, day.month, day.day, tzinfo=timezone.utc).timestamp())
+
+
+def _parse_day(value):
+    if value is None or isinstance(value, date):
+        return value
+    return date.fromisoformat(value)
+
+
+def _read_meta(folder: str):
+    """(start, end, updated_at, folder holding the columns) of what is stored, or None"""
+    try:
+        with open(os.path.join(folder, "meta.json")) as f:
+            meta = json.load(f)
+        columns_folder = os.path.join(folder, meta["version"]) if meta.get("version") else folder
+        return date.fromisoformat(meta["start"]), date.fromisoformat(meta["end"]), meta.get("updated_at", 0), columns_folder
+    except FileNotFoundError:
+        return None
+    except (ValueError, KeyError, TypeError, AttributeError):
+        # Unreadable or incomplete: treat it as nothing stored, so the next request rewrites it
+        return None
+
+
+def _read_columns(folder: str):
+    # Memory-mapped read: nothing is loaded until a slice is actually used.
+    # None if a column is missing or the columns don't all have the same length.
+    try:
+        columns = {
+            column: np.load(os.path.join(folder, f"{column}.npy"), mmap_mode="r")
+            for column in ["date"] + COLUMNS
+        }
+    except (FileNotFoundError, ValueError):
+        return None
+    if len({len(values) for values in columns.values()}) != 1:
+        return None
+    return columns
+
+
+def _write(folder: str, columns: dict, start: date, end: date):
+    # Write every column into a fresh version folder, then point meta.json at it with one
+    # atomic replace. Returns that folder. Versions that were already replaced when this write
+    # started (and columns from before versions existed) are removed after; newer ones may still
+    # be being written by another worker, so they're left to the write that replaces them.
+    os.makedirs(folder, exist_ok=True)
+    current = _read_meta(folder)
+    current_version = os.path.basename(current[3]) if current is not None and current[3] != folder else None
+    existing = sorted(entry for entry in os.listdir(folder) if VERSION_PATTERN.match(entry))
+    number = int(existing[-1][1:]) + 1 if existing else 1
+    while True:
+        # mkdir fails if another worker (or a crashed write) already has this version: take the next one
+        version = f"v{number:06d}"
+        version_folder = os.path.join(folder, version)
+        try:
+            os.mkdir(version_folder)
+            break
+        except FileExistsError:
+            number += 1
+    for column, values in columns.items():
+        np.save(os.path.join(version_folder, f"{column}.npy"), values)
+    tmp_path = os.path.join(folder, f"meta.json.{os.getpid()}.{uuid.uuid4().hex}.tmp")
+    with open(tmp_path, "w") as f:
+        json.dump({"start": start.isoformat(), "end": end.isoformat(), "updated_at": time.time(),
+                   "version": version}, f)
+    os.replace(tmp_path, os.path.join(folder, "meta.json"))
+
+    # Readers that already memory-mapped an old version keep it until they're done (POSIX)
+    for old in existing:
+        if current_version is not None and old <= current_version:
+            shutil.rmtree(os.path.join(folder, old), ignore_errors=True)
+    for column in ["date"] + COLUMNS:
+        try:
+            os.remove(os.path.join(folder, f"{column}.npy"))
+        except FileNotFoundError:
+            pass
+    return version_folder
+
+
+def _download(symbol: str, start: date, end: date, interval: str):
+    """Fetch bars in [start, end) from the market data provider as a dict of NumPy columns"""
+    provider = get_provider()
+    with metrics.timer("market_data_call_ms", provider=provider.name, call="history"):
+        return provider.get_history(symbol, start, end, interval)
+
+
+def _merge(existing: dict, new_parts: list):
+    # Combine the stored columns with newly downloaded ones, sorted by date.
+    # If a bar shows up twice (e.g. today's bar that was still changing) the newest copy wins.
+    parts = ([existing] if existing is not None else []) + new_parts
+    dates = np.concatenate([part["date"] for part in parts])
+    # Later parts come last, so reversing before np.unique keeps the newest copy of each date
+    reversed_dates = dates[::-1]
+    unique_dates, first_index = np.unique(reversed_dates, return_index=True)
+    keep = len(dates) - 1 - first_index
+    merged = {"date": unique_dates}
+    for column in COLUMNS:
+        merged[column] = np.concatenate([np.asarray(part[column]) for part in parts])[keep]
+    return merged
+
+
+def get_history(symbol: str, start=None, end=None, interval: str = "1d"):
+    """
+    Return OHLCV bars for symbol in [start, end) as a dict of NumPy arrays
+    ("date" in epoch seconds plus one array per column).
+    Missing date ranges are downloaded and stored first; everything else is a local read.
+    """
+    symbol = symbol.upper()
+    if not SYMBOL_PATTERN.match(symbol):
+        raise ValueError(f"Invalid symbol {symbol}")
+    if interval not in INTERVALS:
+        raise ValueError(f"Invalid interval {interval}. Use one of {sorted(INTERVALS)}")
+
+    today = date.today()
+    end = _parse_day(end) or today + timedelta(days=1)
+    start = _parse_day(start) or end - timedelta(days=DEFAULT_WINDOW_DAYS.get(interval, DEFAULT_WINDOW))
+    if start >= end:
+        raise ValueError("start must be before end")
+
+    folder = _folder(symbol, interval)
+    with _lock_for(symbol, interval):
+        covered = _read_meta(folder)
+        existing = _read_columns(covered[3]) if covered is not None else None
+        if existing is None:
+            # Nothing stored, or columns that don't match up: start over
+            covered = None
+        # Today's bar keeps changing until the market closes, so we never mark today as covered
+        fetch_end = min(end, today)
+
+        missing = []
+        if covered is None:
+            missing.append((start, end))
+            new_start, new_end = start, fetch_end
+        else:
+            covered_start, covered_end, updated_at, _ = covered
+            if start < covered_start:
+                missing.append((start, covered_start))
+            # If the only thing missing is today's (still changing) bar and we refreshed it
+            # recently, serve what we have instead of calling Yahoo again
+            recently_refreshed = covered_end >= today and time.time() - updated_at < HISTORY_TAIL_REFRESH
+            if end > covered_end and not recently_refreshed:
+                # Starts at covered_end (not at start) so the stored range stays one contiguous block
+                missing.append((covered_end, end))
+            new_start, new_end = min(start, covered_start), max(fetch_end, covered_end)
+
+        if missing:
+            new_parts = [_download(symbol, gap_start, gap_end, interval) for gap_start, gap_end in missing]
+            merged = _merge(existing, new_parts)
+            # Read back our own version: meta.json may already point at another worker's
+            columns = _read_columns(_write(folder, merged, new_start, max(new_end, new_start)))
+            if columns is None:
+                # Removed by a newer write in the meantime
+                columns = merged
+        else:
+            columns = existing
+
+    if columns is None:
+        return {"date": np.array([], dtype=np.int64), **{column: np.array([]) for column in COLUMNS}}
+
+    # Binary search for the requested window; only this slice is read from disk
+    lo = np.searchsorted(columns["date"], _to_epoch(start), side="left")
+    hi = np.searchsorted(columns["date"], _to_epoch(end), side="left")
+    return {column: np.array(values[lo:hi]) for column, values in columns.items()}
@@ -0,0 +1,636 @@
+import abc
+import asyncio
+import logging
+import math
+import time
+from bisect import bisect_left
+from collections import OrderedDict, deque
+from datetime import date, datetime, timedelta, timezone
+import numpy as np
+from config.settings import INDICATOR_CACHE_SIZE, HISTORY_TAIL_REFRESH
+from services.history_store import get_history
+from services.quote_hub import quote_hub
+from services.upstream import market_data
+from services.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Technical indicators (SMA, EMA, RSI, MACD, Bollinger bands) over closing prices.
+#
+# The first time a (symbol, interval) is asked for, its closes are loaded from the history store
+# and every indicator is computed for the whole series at once with array operations.
+# After that the series stays in memory together with each indicator's running state
+# (window sums, last EMA values, average gains/losses...), so:
+#   - a streamed quote only changes the last (still forming) bar: each indicator recomputes
+#     its last value from the state of the bar before, in constant time
+#   - a new bar is appended with a constant-time update of that state, never a rescan
+# Requests slice the values they need out of the cached series.
+#
+# Indicators are written as "name:param:param", e.g. "sma:20", "macd:12:26:9", "bbands:20:2".
+
+# Intervals we compute indicators for (intraday bars are too short-lived to be worth caching)
+INTERVALS = ("1d", "1wk", "1mo")
+
+# Approximate calendar days per bar, used to load enough history before the requested start
+DAYS_PER_BAR = {"1d": 1.5, "1wk": 7, "1mo": 31}
+
+# Longest period accepted for any indicator
+MAX_PERIOD = 500
+
+# Most indicators one request may ask for
+MAX_INDICATORS = 20
+
+# EMAs are evaluated in blocks of this many values (see _ewm)
+EWM_BLOCK = 128
+
+
+def _ewm(values, alpha: float, initial: float):
+    """
+    Exponential moving average of values, continuing from initial:
+        out[i] = out[i - 1] + alpha * (values[i] - out[i - 1])
+    Unrolled, inside a block that is out[k] = beta^k * (initial + sum(alpha * values[i] / beta^i)),
+    which is a cumulative sum. Blocks stay short so beta^-k can't overflow.
+    """
+    beta = 1.0 - alpha
+    if beta == 0:
+        # A period of 1 (alpha = 1) forgets everything before the current value
+        return np.array(values, dtype=np.float64)
+    out = np.empty(len(values))
+    previous = initial
+    for start in range(0, len(values), EWM_BLOCK):
+        block = values[start:start + EWM_BLOCK]
+        decay = beta ** np.arange(1, len(block) + 1)
+        out[start:start + len(block)] = decay * (previous + np.cumsum(alpha * block / decay))
+        previous = out[start + len(block) - 1]
+    return out
+
+
+class _Ema:
+    """EMA seeded with the simple average of the first `period` values (the usual convention)"""
+
+    def __init__(self, period: int, alpha: float = None):
+        self.period = period
+        self.alpha = alpha if alpha is not None else 2.0 / (period + 1)
+        self.count = 0           # values seen until the seed is complete
+        self.seed_total = 0.0
+        self.value = None
+
+    def compute(self, values):
+        out = np.full(len(values), np.nan)
+        if len(values) < self.period:
+            self.count, self.seed_total, self.value = len(values), float(np.sum(values)), None
+            return out
+        out[self.period - 1] = np.mean(values[:self.period])
+        out[self.period:] = _ewm(values[self.period:], self.alpha, out[self.period - 1])
+        self.count, self.value = len(values), float(out[-1])
+        return out
+
+    def peek(self, value: float):
+        if self.value is not None:
+            return self.value + self.alpha * (value - self.value)
+        if self.count + 1 >= self.period:
+            return (self.seed_total + value) / self.period
+        return None
+
+    def commit(self, value: float):
+        new = self.peek(value)
+        if self.value is None:
+            self.count += 1
+            self.seed_total += value
+        self.value = new
+        return new
+
+
+class Indicator(abc.ABC):
+    """
+    compute(closes) returns every output for the whole series as arrays and leaves the running
+    state as of the last close. peek(close) gives the outputs if the next bar closed at close,
+    commit(close) moves the state on by one bar. Both are constant time.
+    """
+    outputs = ("value",)
+
+    @abc.abstractmethod
+    def compute(self, closes):
+        ...
+
+    @abc.abstractmethod
+    def peek(self, close: float):
+        ...
+
+    @abc.abstractmethod
+    def commit(self, close: float):
+        ...
+
+
+class SMA(Indicator):
+    def __init__(self, period: int = 20):
+        self.period = period
+        self.window = deque(maxlen=period)
+        self.total = 0.0
+
+    def compute(self, closes):
+        out = np.full(len(closes), np.nan)
+        if len(closes) >= self.period:
+            sums = np.cumsum(closes)
+            sums[self.period:] = sums[self.period:] - sums[:-self.period]
+            out[self.period - 1:] = sums[self.period - 1:] / self.period
+        self.window = deque(closes[-self.period:].tolist(), maxlen=self.period)
+        self.total = sum(self.window)
+        return {"value": out}
+
+    def _total_with(self, close: float):
+        if len(self.window) + 1 < self.period:
+            return None
+        return self.total + close - (self.window[0] if len(self.window) == self.period else 0.0)
+
+    def peek(self, close: float):
+        total = self._total_with(close)
+        return {"value": total / self.period if total is not None else None}
+
+    def commit(self, close: float):
+        if len(self.window) == self.period:
+            self.total -= self.window[0]
+        self.window.append(close)
+        self.total += close
+
+
+class EMA(Indicator):
+    def __init__(self, period: int = 20):
+        self.ema = _Ema(period)
+
+    def compute(self, closes):
+        return {"value": self.ema.compute(closes)}
+
+    def peek(self, close: float):
+        return {"value": self.ema.peek(close)}
+
+    def commit(self, close: float):
+        self.ema.commit(close)
+
+
+class RSI(Indicator):
+    """Wilder's RSI: average gains and losses smoothed with alpha = 1 / period"""
+
+    def __init__(self, period: int = 14):
+        self.gains = _Ema(period, 1.0 / period)
+        self.losses = _Ema(period, 1.0 / period)
+        self.last_close = None
+
+    @staticmethod
+    def _rsi(gain, loss):
+        # No losses at all -> 100 (or 50 if the price didn't move either)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            rsi = 100.0 - 100.0 / (1.0 + gain / loss)
+        return np.where(loss == 0, np.where(gain == 0, 50.0, 100.0), rsi)
+
+    def compute(self, closes):
+        out = np.full(len(closes), np.nan)
+        deltas = np.diff(closes)
+        gain = self.gains.compute(np.maximum(deltas, 0.0))
+        loss = self.losses.compute(np.maximum(-deltas, 0.0))
+        out[1:] = self._rsi(gain, loss)
+        self.last_close = float(closes[-1]) if len(closes) else None
+        return {"value": out}
+
+    def peek(self, close: float):
+        if self.last_close is None:
+            return {"value": None}
+        delta = close - self.last_close
+        gain, loss = self.gains.peek(max(delta, 0.0)), self.losses.peek(max(-delta, 0.0))
+        if gain is None:
+            return {"value": None}
+        return {"value": float(self._rsi(np.float64(gain), np.float64(loss)))}
+
+    def commit(self, close: float):
+        if self.last_close is not None:
+            delta = close - self.last_close
+            self.gains.commit(max(delta, 0.0))
+            self.losses.commit(max(-delta, 0.0))
+        self.last_close = close
+
+
+class MACD(Indicator):
+    outputs = ("macd", "signal", "histogram")
+
+    def __init__(self, fast: int = 12, slow: int = 26, signal: int = 9):
+        if fast >= slow:
+            raise ValueError("macd: the fast period must be shorter than the slow one")
+        self.fast = _Ema(fast)
+        self.slow = _Ema(slow)
+        self.signal = _Ema(signal)
+
+    def compute(self, closes):
+        macd = self.fast.compute(closes) - self.slow.compute(closes)
+        # The signal line is an EMA of the MACD line, starting where the MACD line does
+        first = self.slow.period - 1
+        signal = np.full(len(closes), np.nan)
+        signal[first:] = self.signal.compute(macd[first:])
+        return {"macd": macd, "signal": signal, "histogram": macd - signal}
+
+    def peek(self, close: float):
+        fast, slow = self.fast.peek(close), self.slow.peek(close)
+        if slow is None:
+            return {"macd": None, "signal": None, "histogram": None}
+        macd = fast - slow
+        signal = self.signal.peek(macd)
+        return {"macd": macd, "signal": signal, "histogram": macd - signal if signal is not None else None}
+
+    def commit(self, close: float):
+        fast, slow = self.fast.commit(close), self.slow.commit(close)
+        if slow is not None:
+            self.signal.commit(fast - slow)
+
+
+class BollingerBands(Indicator):
+    outputs = ("middle", "upper", "lower")
+
+    def __init__(self, period: int = 20, width: float = 2.0):
+        self.sma = SMA(period)
+        self.width = width
+        self.squares = 0.0  # sum of the squared closes in the SMA's window
+
+    def _bands(self, mean, variance):
+        std = np.sqrt(np.maximum(variance, 0.0))
+        return mean, mean + self.width * std, mean - self.width * std
+
+    def compute(self, closes):
+        period = self.sma.period
+        mean = self.sma.compute(closes)["value"]
+        std = np.full(len(closes), np.nan)
+        if len(closes) >= period:
+            std[period - 1:] = np.lib.stride_tricks.sliding_window_view(closes, period).std(axis=1)
+        self.squares = sum(close * close for close in self.sma.window)
+        return {"middle": mean, "upper": mean + self.width * std, "lower": mean - self.width * std}
+
+    def peek(self, close: float):
+        period = self.sma.period
+        total = self.sma._total_with(close)
+        if total is None:
+            return {"middle": None, "upper": None, "lower": None}
+        oldest = self.sma.window[0] if len(self.sma.window) == period else 0.0
+        squares = self.squares + close * close - oldest * oldest
+        mean = total / period
+        middle, upper, lower = self._bands(mean, squares / period - mean * mean)
+        return {"middle": middle, "upper": float(upper), "lower": float(lower)}
+
+    def commit(self, close: float):
+        if len(self.sma.window) == self.sma.period:
+            self.squares -= self.sma.window[0] ** 2
+        self.squares += close * close
+        self.sma.commit(close)
+
+
+# name -> (class, default parameters)
+INDICATORS = {
+    "sma": (SMA, (20,)),
+    "ema": (EMA, (20,)),
+    "rsi": (RSI, (14,)),
+    "macd": (MACD, (12, 26, 9)),
+    "bbands": (BollingerBands, (20, 2.0)),
+}
+
+
+def parse_spec(spec: str):
+    """
+    "macd:12:26" -> ("macd:12:26:9", "macd", (12, 26, 9)). Missing parameters take their defaults,
+    and the returned key spells all of them out so equivalent specs share one cached indicator.
+    """
+    name, *given = spec.strip().lower().split(":")
+    if name not in INDICATORS:
+        raise ValueError(f"Unknown indicator {name}. Use one of {sorted(INDICATORS)}")
+    defaults = INDICATORS[name][1]
+    if len(given) > len(defaults):
+        raise ValueError(f"{name} takes at most {len(defaults)} parameters")
+    params = []
+    for i, default in enumerate(defaults):
+        if i >= len(given):
+            params.append(default)
+            continue
+        try:
+            value = type(default)(given[i])
+        except ValueError:
+            raise ValueError(f"Invalid parameter {given[i]!r} for {name}")
+        if not 0 < value <= MAX_PERIOD:
+            raise ValueError(f"{name} parameters must be between 0 and {MAX_PERIOD}")
+        params.append(value)
+    key = ":".join([name] + [f"{param:g}" for param in params])
+    return key, name, tuple(params)
+
+
+def _warmup_bars(name: str, params):
+    # EMAs need a few periods to forget their seed, so load three times the period
+    # (for MACD the signal line only starts once the slow EMA has)
+    return 3 * int(params[1] + params[2] if name == "macd" else params[0])
+
+
+def _check_interval(interval: str):
+    if interval not in INTERVALS:
+        raise ValueError(f"Invalid interval {interval}. Use one of {list(INTERVALS)}")
+
+
+def _bar_start_after(epoch: int, interval: str):
+    """When the bar after the one starting at epoch starts"""
+    if interval == "1mo":
+        day = datetime.fromtimestamp(epoch, tz=timezone.utc)
+        following = day.replace(year=day.year + day.month // 12, month=day.month % 12 + 1)
+        return following.timestamp()
+    return epoch + (7 if interval == "1wk" else 1) * 86400
+
+
+def _to_list(values):
+    # NaN isn't valid JSON, so missing values become None
+    return [None if math.isnan(value) else value for value in values.tolist()]
+
+
+class Series:
+    """
+    The closes of one (symbol, interval) and every indicator computed on them.
+    The last bar may still be forming: streamed quotes replace its close.
+    """
+
+    def __init__(self, symbol: str, interval: str, start: date, bars: dict):
+        self.symbol = symbol
+        self.interval = interval
+        self.start = start                # the series holds every bar from here on
+        valid = ~np.isnan(bars["close"])  # a bar without a close can't be used
+        self.dates = bars["date"][valid].tolist()
+        self.closes = bars["close"][valid].tolist()
+        self.indicators = {}              # key -> Indicator
+        self.values = {}                  # key -> {output: list aligned with dates}
+        self.checked_at = time.monotonic()
+        self.rolling = None               # task looking for new bars, if one is running
+        self.subscribers = {}             # websocket Subscriber -> set of indicator keys it streams
+
+    def add(self, key: str, name: str, params):
+        if key in self.indicators:
+            return
+        indicator = INDICATORS[name][0](*params)
+        # Everything but the forming bar is committed; its value is a peek
+        outputs = indicator.compute(np.asarray(self.closes[:-1], dtype=np.float64))
+        self.values[key] = {output: _to_list(values) for output, values in outputs.items()}
+        if self.closes:
+            for output, value in indicator.peek(self.closes[-1]).items():
+                self.values[key][output].append(value)
+        self.indicators[key] = indicator
+
+    def set_last_close(self, close: float):
+        if not self.closes or close == self.closes[-1]:
+            return False
+        self.closes[-1] = close
+        for key, indicator in self.indicators.items():
+            for output, value in indicator.peek(close).items():
+                self.values[key][output][-1] = value
+        return True
+
+    def append(self, epoch: int, close: float):
+        if self.closes:
+            for indicator in self.indicators.values():
+                indicator.commit(self.closes[-1])
+        self.dates.append(epoch)
+        self.closes.append(close)
+        for key, indicator in self.indicators.items():
+            for output, value in indicator.peek(close).items():
+                self.values[key][output].append(value)
+
+    def next_bar_due(self):
+        # True once the forming bar's period is over, so the store may have a new bar for us
+        return bool(self.dates) and time.time() >= _bar_start_after(self.dates[-1], self.interval)
+
+    def latest(self, keys):
+        if not self.dates:
+            return None
+        return {
+            "type": "indicators",
+            "symbol": self.symbol,
+            "interval": self.interval,
+            "date": datetime.fromtimestamp(self.dates[-1], tz=timezone.utc).isoformat(),
+            "close": self.closes[-1],
+            "values": {key: {output: values[-1] for output, values in self.values[key].items()} for key in keys}
+        }
+
+    def window(self, keys, start_epoch: float, end_epoch: float):
+        lo, hi = bisect_left(self.dates, start_epoch), bisect_left(self.dates, end_epoch)
+        return {
+            "symbol": self.symbol,
+            "interval": self.interval,
+            "date": [datetime.fromtimestamp(epoch, tz=timezone.utc).isoformat() for epoch in self.dates[lo:hi]],
+            "close": self.closes[lo:hi],
+            "indicators": {key: {output: values[lo:hi] for output, values in self.values[key].items()} for key in keys}
+        }
+
+
+def _load_bars(symbol: str, start: date, interval: str):
+    # Blocking: reads (and maybe fills) the history store
+    return get_history(symbol, start, None, interval)
+
+
+def _parse_day(value, default: date):
+    if value is None:
+        return default
+    return datetime.strptime(value, "%Y-%m-%d").date()
+
+
+class IndicatorEngine:
+    """
+    Cache of Series (least recently used evicted past max_series, unless somebody streams them).
+    Everything here runs on the event loop; only history reads go to the market data pool.
+    """
+
+    def __init__(self, hub=quote_hub, max_series: int = INDICATOR_CACHE_SIZE):
+        self.hub = hub
+        self.max_series = max_series
+        self.series = OrderedDict()  # (symbol, interval) -> Series
+        self.loading = {}            # (symbol, interval) -> asyncio.Task loading it
+        self.symbol_series = {}      # symbol -> set of intervals with a cached Series
+        self.computed = 0            # indicators computed from scratch
+        self.updates = 0             # constant-time updates (quotes and new bars)
+        hub.add_listener(self.on_quote)
+
+    async def get(self, symbol: str, interval: str, start: date):
+        """The cached series for symbol, (re)loaded if it doesn't go back to start yet"""
+        _check_interval(interval)
+        symbol = symbol.upper()
+        key = (symbol, interval)
+        series = self.series.get(key)
+        if series is None or series.start > start:
+            task = self.loading.get(key)
+            if task is None:
+                task = asyncio.ensure_future(self._load(symbol, interval, start))
+                self.loading[key] = task
+                task.add_done_callback(lambda _: self.loading.pop(key, None))
+            series = await task
+            # Somebody else may have loaded a shorter range at the same time
+            if series.start > start:
+                return await self.get(symbol, interval, start)
+        elif series.rolling is not None or self._roll_due(series):
+            await self._start_roll(series)
+        self.series.move_to_end(key)
+        return series
+
+    async def compute(self, symbols, specs, start=None, end=None, interval: str = "1d"):
+        """
+        Batch request: every indicator in specs for every symbol, between start and end (YYYY-MM-DD,
+        end exclusive, defaults to the last year). Returns {"results": {...}, "errors": {...}}
+        with per-symbol errors, like the batch quote endpoint.
+        """
+        _check_interval(interval)
+        if len(specs) > MAX_INDICATORS:
+            raise ValueError(f"At most {MAX_INDICATORS} indicators per request")
+        parsed = {}
+        for spec in specs:
+            key, name, params = parse_spec(spec)
+            parsed[key] = (name, params)
+        if not parsed:
+            raise ValueError("No indicators requested")
+
+        end_day = _parse_day(end, date.today() + timedelta(days=1))
+        start_day = _parse_day(start, end_day - timedelta(days=365))
+        if start_day >= end_day:
+            raise ValueError("start must be before end")
+        longest = max(_warmup_bars(name, params) for name, params in parsed.values())
+        load_from = start_day - timedelta(days=math.ceil(longest * DAYS_PER_BAR[interval]))
+        start_epoch = datetime(start_day.year, start_day.month, start_day.day, tzinfo=timezone.utc).timestamp()
+        end_epoch = datetime(end_day.year, end_day.month, end_day.day, tzinfo=timezone.utc).timestamp()
+
+        async def one(symbol):
+            series = await self.get(symbol, interval, load_from)
+            for key, (name, params) in parsed.items():
+                if key not in series.indicators:
+                    series.add(key, name, params)
+                    self.computed += 1
+            return series.window(list(parsed), start_epoch, end_epoch)
+
+        symbols = list(dict.fromkeys(symbol.strip().upper() for symbol in symbols if symbol.strip()))
+        results = await asyncio.gather(*(one(symbol) for symbol in symbols), return_exceptions=True)
+        response = {"results": {}, "errors": {}}
+        for symbol, result in zip(symbols, results):
+            if isinstance(result, Exception):
+                response["errors"][symbol] = str(result)
+            else:
+                response["results"][symbol] = result
+        return response
+
+    async def subscribe(self, subscriber, symbols, specs, interval: str = "1d"):
+        """Stream the latest value of specs for symbols to a websocket subscriber after every quote"""
+        _check_interval(interval)
+        parsed = [parse_spec(spec) for spec in specs]
+        if len(parsed) > MAX_INDICATORS:
+            raise ValueError(f"At most {MAX_INDICATORS} indicators per subscription")
+        longest = max((_warmup_bars(name, params) for _, name, params in parsed), default=0)
+        load_from = date.today() - timedelta(days=math.ceil(longest * DAYS_PER_BAR[interval]) + 7)
+        for symbol in symbols:
+            series = await self.get(symbol, interval, load_from)
+            for key, name, params in parsed:
+                series.add(key, name, params)
+            if not series.subscribers:
+                self.hub.watch([series.symbol])
+            keys = series.subscribers.setdefault(subscriber, set())
+            keys.update(key for key, _, _ in parsed)
+            message = series.latest(sorted(keys))
+            if message is not None:
+                subscriber.offer(message)
+
+    def unsubscribe(self, subscriber, symbols=None):
+        """Stop streaming symbols (every symbol when None) to subscriber"""
+        wanted = {symbol.upper() for symbol in symbols} if symbols is not None else None
+        for series in self.series.values():
+            if subscriber not in series.subscribers or (wanted is not None and series.symbol not in wanted):
+                continue
+            del series.subscribers[subscriber]
+            if not series.subscribers:
+                self.hub.unwatch([series.symbol])
+
+    def on_quote(self, symbol: str, message: dict):
+        # Called by the quote hub for every update: move the forming bar of each cached series
+        price = message.get("price")
+        if price is None:
+            return
+        for interval in self.symbol_series.get(symbol, ()):
+            series = self.series[(symbol, interval)]
+            if series.next_bar_due():
+                # The quote belongs to a bar we don't have yet, fetch it instead of
+                # overwriting the close of a finished bar
+                if series.rolling is None and self._roll_due(series):
+                    self._start_roll(series)
+                continue
+            if series.set_last_close(price):
+                self.updates += 1
+                self._publish(series)
+
+    def stats(self):
+        return {
+            "series": len(self.series),
+            "indicators": sum(len(series.indicators) for series in self.series.values()),
+            "streams": sum(len(series.subscribers) for series in self.series.values()),
+            "computed": self.computed,
+            "updates": self.updates
+        }
+
+    async def _load(self, symbol: str, interval: str, start: date):
+        bars = await market_data.run(_load_bars, symbol, start, interval)
+        series = Series(symbol, interval, start, bars)
+        key = (symbol, interval)
+        old = self.series.get(key)
+        if old is not None:
+            # Loading further back: recompute what the old series had and keep its streams
+            for old_key in old.indicators:
+                series.add(*parse_spec(old_key))
+            series.subscribers = old.subscribers
+            self.computed += len(old.indicators)
+        self.series[key] = series
+        self.symbol_series.setdefault(symbol, set()).add(interval)
+        self._evict()
+        return series
+
+    def _roll_due(self, series: Series):
+        # The store refreshes the latest bar at most every HISTORY_TAIL_REFRESH, no point asking sooner
+        return series.next_bar_due() and time.monotonic() - series.checked_at > HISTORY_TAIL_REFRESH
+
+    def _start_roll(self, series: Series):
+        if series.rolling is None:
+            series.rolling = asyncio.ensure_future(self._roll(series))
+        return series.rolling
+
+    async def _roll(self, series: Series):
+        # Read the bars from the forming one onwards and apply them one at a time
+        try:
+            since = datetime.fromtimestamp(series.dates[-1], tz=timezone.utc).date()
+            bars = await market_data.run(_load_bars, series.symbol, since, series.interval)
+            series.checked_at = time.monotonic()
+            for epoch, close in zip(bars["date"].tolist(), bars["close"].tolist()):
+                if math.isnan(close) or epoch < series.dates[-1]:
+                    continue
+                if epoch == series.dates[-1]:
+                    # The final close of the bar that was forming
+                    series.set_last_close(close)
+                else:
+                    series.append(epoch, close)
+                self.updates += 1
+            self._publish(series)
+        except Exception as e:
+            logger.warning("Error loading new %s bars for %s: %s", series.interval, series.symbol, e)
+        finally:
+            series.rolling = None
+
+    def _evict(self):
+        for key in list(self.series):
+            if len(self.series) <= self.max_series:
+                return
+            if self.series[key].subscribers:
+                continue
+            del self.series[key]
+            intervals = self.symbol_series[key[0]]
+            intervals.discard(key[1])
+            if not intervals:
+                del self.symbol_series[key[0]]
+
+    def _publish(self, series: Series):
+        for subscriber, keys in list(series.subscribers.items()):
+            message = series.latest(sorted(keys))
+            if message is not None:
+                subscriber.offer(message)
+
+
+# One engine shared by the whole app
+indicator_engine = IndicatorEngine()
+metrics.add_collector("indicators", indicator_engine.stats)
@@ -0,0 +1,346 @@
+import asyncio
+import logging
+import time
+from bisect import bisect_left, insort
+from datetime import datetime
+from config.settings import LEADERBOARD_RELOAD
+from services.firebase_service import get_db
+from services.ledger_service import apply_entry
+from services.quote_hub import quote_hub
+from services.stock_service import get_stocks_data, add_trade_listener, MAX_BATCH_SIZE
+from services.upstream import database
+from services.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Leaderboard of simulated returns across all users.
+#
+# Every user's cash, share counts and market value are read from Firestore ONCE (one scan of the
+# users collection) and then kept up to date in memory:
+#   - a quote for a symbol only touches the users holding it (reverse index symbol -> users),
+#     each with a constant-time delta: market value += quantity * (new price - old price)
+#   - a committed trade replays its transactions on that user (same math as the ledger)
+#   - a symbol's price (its mark) only changes for all of its holders at once, so everyone holding
+#     it is always valued at the same price
+# Users are kept ordered by return in a RankIndex, so the top K is a slice and a user's rank is a
+# binary search, and a change only moves that one user.
+# Trades made on other workers and new signups show up at the next full reload (LEADERBOARD_RELOAD).
+# Trades committed while a reload is reading the users are kept and replayed on the new board;
+# each user remembers the ledger seq their document was read at, so a trade the document
+# already included isn't counted twice.
+#
+#   return = (cash + market value - starting balance) / starting balance
+
+# Starting balance of users created before it was stored on the user document (the signup default)
+DEFAULT_STARTING_BALANCE = 500000.0
+
+# Most entries one page may have
+MAX_PAGE_SIZE = 100
+
+
+class RankIndex:
+    """
+    Sorted collection of keys, split into buckets of at most 2 * load keys.
+    Adding or removing a key is a binary search plus an insert into one short list,
+    instead of shifting a list of every user.
+    """
+
+    def __init__(self, load: int = 512):
+        self.load = load
+        self.buckets = []  # sorted lists, every key in bucket i is below every key in bucket i + 1
+        self.maxes = []    # last key of every bucket
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def add(self, key):
+        self.size += 1
+        if not self.buckets:
+            self.buckets.append([key])
+            self.maxes.append(key)
+            return
+        i = min(bisect_left(self.maxes, key), len(self.buckets) - 1)
+        bucket = self.buckets[i]
+        insort(bucket, key)
+        self.maxes[i] = bucket[-1]
+        if len(bucket) > 2 * self.load:
+            self.buckets[i:i + 1] = [bucket[:self.load], bucket[self.load:]]
+            self.maxes[i:i + 1] = [bucket[self.load - 1], bucket[-1]]
+
+    def remove(self, key):
+        i = bisect_left(self.maxes, key)
+        bucket = self.buckets[i]
+        del bucket[bisect_left(bucket, key)]
+        self.size -= 1
+        if bucket:
+            self.maxes[i] = bucket[-1]
+        else:
+            del self.buckets[i], self.maxes[i]
+
+    def index(self, key):
+        """0-based position of key"""
+        i = bisect_left(self.maxes, key)
+        return sum(len(bucket) for bucket in self.buckets[:i]) + bisect_left(self.buckets[i], key)
+
+    def slice(self, offset: int, limit: int):
+        result = []
+        for bucket in self.buckets:
+            if offset >= len(bucket):
+                offset -= len(bucket)
+                continue
+            result.extend(bucket[offset:offset + limit - len(result)])
+            offset = 0
+            if len(result) >= limit:
+                break
+        return result
+
+
+def _display_name(user_data: dict):
+    # The board is public: show the name if there is one, otherwise a masked email
+    if user_data.get("name"):
+        return user_data["name"]
+    local, _, domain = (user_data.get("email") or "anonymous").partition("@")
+    return local[:2] + "***" + ("@" + domain if domain else "")
+
+
+class Standing:
+    """One user's running totals"""
+
+    def __init__(self, uid: str, name: str, cash: float, starting_balance: float, portfolio: dict, seq: int = 0):
+        self.uid = uid
+        self.name = name
+        self.cash = cash
+        self.starting_balance = starting_balance or DEFAULT_STARTING_BALANCE
+        self.portfolio = {symbol.upper(): dict(position) for symbol, position in portfolio.items()}
+        self.market_value = 0.0  # over the positions with a known price
+        self.key = None          # current key in the RankIndex
+        self.seq = seq           # ledger seq of the last trade included
+
+    def total_value(self):
+        return self.cash + self.market_value
+
+    def return_percent(self):
+        return (self.total_value() - self.starting_balance) / self.starting_balance * 100
+
+    def entry(self, rank: int):
+        return {
+            "rank": rank,
+            "name": self.name,
+            "return_percent": round(self.return_percent(), 4),
+            "total_value": round(self.total_value(), 2),
+            "positions": len(self.portfolio)
+        }
+
+
+def _read_users():
+    """Every user document (blocking, one scan of the collection)"""
+    return [(doc.id, doc.to_dict()) for doc in get_db().collection("users").stream()]
+
+
+def _standing(uid: str, data: dict):
+    return Standing(uid, _display_name(data), data.get("initial_balance", 0.0),
+                    data.get("starting_balance"), data.get("portfolio") or {}, data.get("ledger_seq", 0))
+
+
+class Leaderboard:
+    def __init__(self, hub=quote_hub):
+        self.hub = hub
+        self.standings = {}     # uid -> Standing
+        self.symbol_users = {}  # symbol -> set of uids holding it
+        self.prices = {}        # symbol -> last price used
+        self.ranks = RankIndex()
+        self.loaded_at = None
+        self.loading = None     # asyncio.Task of the running (re)load
+        self.pending = None     # (uid, transactions) committed while a load is running, replayed after it
+        self.updates = 0
+        hub.add_listener(self.on_quote)
+        add_trade_listener(self.apply_transactions)
+
+    async def ready(self):
+        """Load the board the first time; later, reload it in the background once it's stale"""
+        if self.loading is None and (self.loaded_at is None or time.monotonic() - self.loaded_at > LEADERBOARD_RELOAD):
+            self.loading = asyncio.ensure_future(self._load())
+            self.loading.add_done_callback(self._loaded)
+        if self.loaded_at is None:
+            await asyncio.shield(self.loading)
+
+    async def page(self, offset: int = 0, limit: int = 50):
+        await self.ready()
+        limit = min(limit, MAX_PAGE_SIZE)
+        keys = self.ranks.slice(offset, limit)
+        return {
+            "total": len(self.ranks),
+            "offset": offset,
+            "limit": limit,
+            "entries": [self.standings[key[1]].entry(offset + i + 1) for i, key in enumerate(keys)],
+            "timestamp": datetime.now().isoformat()
+        }
+
+    async def standing(self, uid: str):
+        """The user's own entry and rank, or None if they aren't on the board yet"""
+        await self.ready()
+        user = self.standings.get(uid)
+        if user is None:
+            return None
+        return {**user.entry(self.ranks.index(user.key) + 1), "total": len(self.ranks)}
+
+    def on_quote(self, symbol: str, message: dict):
+        # Called by the quote hub for every update: only the holders of this symbol move
+        price = message.get("price")
+        if price is None or not self.symbol_users.get(symbol):
+            return
+        self._mark(symbol, price)
+
+    def apply_transactions(self, uid: str, transactions: list):
+        """A trade committed: replay it on the user's cash and positions"""
+        if self.pending is not None:
+            # A load is reading the users: it may have read this user before the trade
+            self.pending.append((uid, transactions))
+        user = self.standings.get(uid)
+        if user is None:
+            # Most likely a new user's first trade: read their document (it already includes the trade)
+            if self.loaded_at is not None:
+                asyncio.ensure_future(self._add_user(uid))
+            return
+        # Skip trades the user's document already had when it was read
+        transactions = [transaction for transaction in transactions
+                        if transaction.get("seq") is None or transaction["seq"] > user.seq]
+        if not transactions:
+            return
+        changed = {transaction["symbol"] for transaction in transactions}
+        for symbol in changed:
+            self._unhold(user, symbol)
+        for transaction in transactions:
+            user.cash = apply_entry(user.portfolio, user.cash, transaction)
+            user.seq = max(user.seq, transaction.get("seq") or 0)
+        for symbol in changed:
+            if symbol not in self.prices and symbol in user.portfolio:
+                # The fill price is the freshest price we know if the hub hasn't sent one yet.
+                # Set it as the mark for everyone holding the symbol, not just this user
+                self._mark(symbol, next(t["price"] for t in reversed(transactions) if t["symbol"] == symbol))
+            self._hold(user, symbol)
+        self._rerank(user)
+        self.updates += 1
+
+    def stats(self):
+        return {
+            "users": len(self.standings),
+            "symbols": len(self.symbol_users),
+            "updates": self.updates,
+            "age_seconds": round(time.monotonic() - self.loaded_at, 1) if self.loaded_at else None
+        }
+
+    def _mark(self, symbol: str, price: float):
+        # New price for a symbol: revalue every holder by the change
+        old_price = self.prices.get(symbol)
+        if old_price == price:
+            return
+        self.prices[symbol] = price
+        for uid in self.symbol_users.get(symbol, ()):
+            user = self.standings[uid]
+            user.market_value += user.portfolio[symbol]["quantity"] * (price - (old_price or 0.0))
+            self._rerank(user)
+        self.updates += 1
+
+    def _hold(self, user: Standing, symbol: str):
+        position = user.portfolio.get(symbol)
+        if position is None:
+            return
+        holders = self.symbol_users.setdefault(symbol, set())
+        if not holders:
+            self.hub.watch([symbol])
+        holders.add(user.uid)
+        if symbol in self.prices:
+            user.market_value += position["quantity"] * self.prices[symbol]
+
+    def _unhold(self, user: Standing, symbol: str):
+        position = user.portfolio.get(symbol)
+        holders = self.symbol_users.get(symbol)
+        if position is None or holders is None:
+            return
+        if symbol in self.prices:
+            user.market_value -= position["quantity"] * self.prices[symbol]
+        holders.discard(user.uid)
+        if not holders:
+            del self.symbol_users[symbol]
+            self.hub.unwatch([symbol])
+
+    def _rerank(self, user: Standing):
+        if user.key is not None:
+            self.ranks.remove(user.key)
+        # Best return first; ties broken by uid so the order is stable
+        user.key = (-user.return_percent(), user.uid)
+        self.ranks.add(user.key)
+
+    async def _load(self):
+        started = time.monotonic()
+        self.pending = []
+        try:
+            await self._build()
+            # Trades committed during the scan; ones a user's document already included are skipped
+            pending, self.pending = self.pending, None
+            for uid, transactions in pending:
+                self.apply_transactions(uid, transactions)
+        finally:
+            self.pending = None
+        self.loaded_at = time.monotonic()
+        logger.info("Leaderboard loaded: %d users, %d symbols in %.2fs",
+                    len(self.standings), len(self.symbol_users), time.monotonic() - started)
+
+    async def _build(self):
+        users = await database.run(_read_users, timeout=None)
+
+        # Prices for every held symbol: what the hub already has, then batch lookups for the rest
+        symbols = {symbol.upper() for _, data in users for symbol in (data.get("portfolio") or {})}
+        prices = {symbol: self.prices[symbol] for symbol in symbols if symbol in self.prices}
+        missing = [symbol for symbol in symbols if symbol not in prices and not self._hub_price(symbol)]
+        for start in range(0, len(missing), MAX_BATCH_SIZE):
+            quotes = await get_stocks_data(missing[start:start + MAX_BATCH_SIZE])
+            for symbol, quote in quotes["quotes"].items():
+                if quote.get("price") is not None:
+                    prices[symbol] = quote["price"]
+        # The hub's price last: quotes that came in while we were waiting are newer than anything above
+        for symbol in symbols:
+            if self._hub_price(symbol):
+                prices[symbol] = self._hub_price(symbol)
+
+        # Build the new board on the side, then swap it in (nothing awaits from here on)
+        old_symbols = set(self.symbol_users)
+        self.standings, self.symbol_users, self.prices, self.ranks = {}, {}, prices, RankIndex()
+        for uid, data in users:
+            user = self.standings[uid] = _standing(uid, data)
+            for symbol in user.portfolio:
+                self.symbol_users.setdefault(symbol, set()).add(uid)
+                if symbol in prices:
+                    user.market_value += user.portfolio[symbol]["quantity"] * prices[symbol]
+            self._rerank(user)
+        # Keep the hub polling every symbol somebody holds
+        self.hub.watch(set(self.symbol_users) - old_symbols)
+        self.hub.unwatch(old_symbols - set(self.symbol_users))
+
+    def _hub_price(self, symbol: str):
+        latest = self.hub.latest.get(symbol)
+        return latest.get("price") if latest else None
+
+    async def _add_user(self, uid: str):
+        try:
+            doc = await database.run(get_db().collection("users").document(uid).get)
+            if not doc.exists or uid in self.standings:
+                return
+            user = self.standings[uid] = _standing(uid, doc.to_dict())
+            for symbol in user.portfolio:
+                self._hold(user, symbol)
+            self._rerank(user)
+        except Exception as e:
+            logger.warning("Error adding %s to the leaderboard: %s", uid, e)
+
+    def _loaded(self, task):
+        self.loading = None
+        if not task.cancelled() and task.exception() is not None:
+            logger.error("Error loading the leaderboard: %s", task.exception())
+
+
+# One leaderboard shared by the whole app
+leaderboard = Leaderboard()
+metrics.add_collector("leaderboard", leaderboard.stats)
@@ -0,0 +1,195 @@
+import copy
+
+# Append-only trade ledger.
+#
+# Instead of growing a "transactions" array on the user document forever, every trade is its
+# own document in a subcollection:
+#   users/{uid}/ledger/{seq}       <- one document per trade, never modified
+#   users/{uid}/snapshots/{seq}    <- portfolio + balance right after trade number {seq}
+#
+# seq is a per-user counter kept on the user document ("ledger_seq"). Document ids are the
+# zero-padded seq, so writing the same seq twice (two trades racing each other) fails instead
+# of silently overwriting a trade. A snapshot is written every SNAPSHOT_EVERY trades so the
+# current holdings can be rebuilt from the latest snapshot plus a short tail of trades.
+#
+# Users created before the ledger have their trades in a "transactions" array on the user
+# document instead. The first time such a user trades or reads their history, migrate_legacy()
+# copies that array into the ledger (oldest first) followed by a snapshot of the user document
+# as it is, and marks the user as migrated. The array itself is left in place.
+
+LEDGER_COLLECTION = "ledger"
+SNAPSHOT_COLLECTION = "snapshots"
+
+# Write a portfolio snapshot every this many trades
+SNAPSHOT_EVERY = 50
+
+# Same value as firestore.Query.DESCENDING, without importing the Firestore client library here
+DESCENDING = "DESCENDING"
+
+# Set on the user document once its legacy "transactions" array has been copied into the ledger
+MIGRATED_FIELD = "ledger_migrated"
+
+# Page size limits for reading history
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+
+def _doc_id(seq: int):
+    # Zero-padded so documents sort by seq
+    return f"{seq:012d}"
+
+
+def ledger_ref(db, user_id: str):
+    return db.collection("users").document(user_id).collection(LEDGER_COLLECTION)
+
+
+def snapshots_ref(db, user_id: str):
+    return db.collection("users").document(user_id).collection(SNAPSHOT_COLLECTION)
+
+
+def append_entries(writer, db, user_id: str, last_seq: int, entries, portfolio: dict, balance: float):
+    """
+    Add trades to the ledger using a Firestore batch or transaction (writer).
+    last_seq is the user's current ledger_seq; returns the new one, which the caller
+    must store on the user document in the same batch/transaction.
+    portfolio and balance are the state after these trades, used for snapshots.
+    Every entry gets its "seq" set, so whoever is told about the trades later can tell
+    whether a user document they read already includes them (its ledger_seq is at least that).
+    """
+    seq = last_seq
+    for entry in entries:
+        seq += 1
+        entry["seq"] = seq
+        # create() fails if the document already exists, so a seq can never be reused
+        writer.create(ledger_ref(db, user_id).document(_doc_id(seq)), dict(entry))
+
+    # Did we cross a snapshot boundary with these trades?
+    if seq // SNAPSHOT_EVERY > last_seq // SNAPSHOT_EVERY:
+        writer.set(snapshots_ref(db, user_id).document(_doc_id(seq)), {
+            "seq": seq,
+            "portfolio": portfolio,
+            "balance": balance,
+            "timestamp": entries[-1].get("timestamp")
+        })
+    return seq
+
+
+def needs_migration(user_data: dict):
+    """Whether a user document still has legacy trades that aren't in the ledger"""
+    return bool(user_data.get("transactions")) and not user_data.get(MIGRATED_FIELD)
+
+
+def migrate_legacy(writer, db, user_id: str, user_data: dict):
+    """
+    Copy a user's legacy "transactions" array into the ledger using a Firestore batch or
+    transaction (writer). Returns the user document fields to update in the same
+    batch/transaction ({"ledger_seq", MIGRATED_FIELD}), or None if there is nothing to migrate.
+    The snapshot written after the copied trades is the user document's own portfolio and
+    balance, so rebuilt holdings match what the user had even if the legacy trades don't add up.
+    """
+    if not needs_migration(user_data):
+        return None
+    # ArrayUnion kept them in the order they were made, sorting only guards against clock skew
+    legacy = sorted(user_data["transactions"], key=lambda entry: entry.get("timestamp") or "")
+    seq = user_data.get("ledger_seq", 0)
+    for entry in legacy:
+        seq += 1
+        writer.create(ledger_ref(db, user_id).document(_doc_id(seq)), {**entry, "seq": seq, "legacy": True})
+    writer.set(snapshots_ref(db, user_id).document(_doc_id(seq)), {
+        "seq": seq,
+        "portfolio": copy.deepcopy(user_data.get("portfolio", {})),
+        "balance": user_data["initial_balance"],
+        "timestamp": legacy[-1].get("timestamp")
+    })
+    return {"ledger_seq": seq, MIGRATED_FIELD: True}
+
+
+def ensure_migrated(db, user_id: str, user_data: dict = None):
+    """
+    Migrate a user's legacy trades into the ledger if that hasn't happened yet. Blocking.
+    Pass the user document if it was already read to skip the transaction for users that
+    don't need it.
+    """
+    if user_data is not None and not needs_migration(user_data):
+        return
+    from firebase_admin import firestore  # loaded with the database client, see firebase_service.get_db
+    user_ref = db.collection("users").document(user_id)
+
+    @firestore.transactional
+    def migrate(transaction):
+        user_doc = user_ref.get(transaction=transaction)
+        if not user_doc.exists:
+            return
+        update = migrate_legacy(transaction, db, user_id, user_doc.to_dict())
+        if update is not None:
+            transaction.update(user_ref, update)
+
+    migrate(db.transaction())
+
+
+def get_history(db, user_id: str, cursor: int = None, limit: int = DEFAULT_PAGE_SIZE):
+    """
+    One page of a user's trades, newest first.
+    Pass the returned next_cursor back in to get the following page (None means no more pages).
+    """
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    query = ledger_ref(db, user_id).order_by("seq", direction=DESCENDING)
+    if cursor is not None:
+        query = query.where("seq", "<", cursor)
+    # Ask for one extra document to know if there is another page
+    docs = [doc.to_dict() for doc in query.limit(limit + 1).stream()]
+    has_more = len(docs) > limit
+    docs = docs[:limit]
+    return {
+        "transactions": docs,
+        "next_cursor": docs[-1]["seq"] if has_more else None
+    }
+
+
+def apply_entry(portfolio: dict, balance: float, entry: dict):
+    """Replay one ledger entry on top of a portfolio/balance. Returns the new balance."""
+    symbol = entry["symbol"]
+    quantity = entry["quantity"]
+    price = entry["price"]
+    if entry["type"] == "BUY":
+        position = portfolio.get(symbol)
+        if position:
+            new_quantity = position["quantity"] + quantity
+            position["average_buy_price"] = (
+                (position["quantity"] * position["average_buy_price"]) + (quantity * price)
+            ) / new_quantity
+            position["quantity"] = new_quantity
+        else:
+            portfolio[symbol] = {"quantity": quantity, "average_buy_price": price}
+        portfolio[symbol]["last_updated"] = entry.get("timestamp")
+        return balance - quantity * price
+    else:
+        portfolio[symbol]["quantity"] -= quantity
+        if portfolio[symbol]["quantity"] == 0:
+            del portfolio[symbol]
+        return balance + quantity * price
+
+
+def rebuild_holdings(db, user_id: str, initial_balance: float = 500000.0):
+    """
+    Rebuild a user's holdings from the ledger: start from the latest snapshot and replay
+    only the trades after it (at most SNAPSHOT_EVERY of them) instead of the full history.
+    initial_balance is used if the user has no snapshot yet.
+    """
+    snapshots = (snapshots_ref(db, user_id)
+                 .order_by("seq", direction=DESCENDING)
+                 .limit(1).stream())
+    latest = next(iter(snapshots), None)
+    if latest is not None:
+        snapshot = latest.to_dict()
+        portfolio, balance, seq = snapshot["portfolio"], snapshot["balance"], snapshot["seq"]
+    else:
+        portfolio, balance, seq = {}, initial_balance, 0
+
+    tail = ledger_ref(db, user_id).where("seq", ">", seq).order_by("seq").stream()
+    for doc in tail:
+        entry = doc.to_dict()
+        balance = apply_entry(portfolio, balance, entry)
+        seq = entry["seq"]
+
+    return {"portfolio": portfolio, "balance": balance, "seq": seq}
@@ -0,0 +1,186 @@
+from datetime import date, datetime, time, timedelta, timezone
+from functools import lru_cache
+from zoneinfo import ZoneInfo
+
+# Trading sessions, so quotes are only polled at full speed while prices can actually move.
+#
+# A symbol's exchange is guessed from its Yahoo ticker:
+#   AAPL, ^GSPC        -> US equities (NYSE/Nasdaq regular session, with NYSE holidays and early closes)
+#   VOD.L, SHOP.TO ... -> the exchange of the suffix (regular session only, weekends off)
+#   EURUSD=X, CL=F     -> currencies and futures: around the clock from Sunday evening to Friday evening
+#   BTC-USD            -> crypto: always open
+# Anything we don't recognize is treated as a US equity.
+
+
+class Session:
+    def __init__(self, zone: str, open_time: time, close_time: time, holidays=None, early_closes=None):
+        self.zone = ZoneInfo(zone)
+        self.open_time = open_time
+        self.close_time = close_time
+        self.holidays = holidays or (lambda year: set())
+        self.early_closes = early_closes or (lambda year: {})  # date -> close time
+
+    def hours(self, day: date):
+        """(open, close) on day as aware datetimes, or None if the exchange is closed all day"""
+        if day.weekday() >= 5 or day in self.holidays(day.year):
+            return None
+        close_time = self.early_closes(day.year).get(day, self.close_time)
+        return (datetime.combine(day, self.open_time, self.zone),
+                datetime.combine(day, close_time, self.zone))
+
+    def is_open(self, now: datetime):
+        hours = self.hours(now.astimezone(self.zone).date())
+        return hours is not None and hours[0] <= now < hours[1]
+
+    def next_open(self, now: datetime):
+        """When the session next opens (now if it is open)"""
+        if self.is_open(now):
+            return now
+        day = now.astimezone(self.zone).date()
+        # Long weekends plus holidays never add up to two weeks
+        for offset in range(14):
+            hours = self.hours(day + timedelta(days=offset))
+            if hours is not None and hours[0] > now:
+                return hours[0]
+        return None
+
+
+class WeekdaySession(Session):
+    """Trades around the clock from Sunday evening to Friday evening (New York time)"""
+
+    def __init__(self):
+        super().__init__("America/New_York", time(17, 0), time(17, 0))
+
+    def is_open(self, now: datetime):
+        local = now.astimezone(self.zone)
+        weekday, clock = local.weekday(), local.time()
+        if weekday == 5:
+            return False
+        if weekday == 6:
+            return clock >= self.open_time
+        return weekday < 4 or clock < self.close_time
+
+    def next_open(self, now: datetime):
+        if self.is_open(now):
+            return now
+        local = now.astimezone(self.zone)
+        sunday = local.date() + timedelta(days=(6 - local.weekday()) % 7)
+        return datetime.combine(sunday, self.open_time, self.zone)
+
+
+class AlwaysOpen(Session):
+    def __init__(self):
+        super().__init__("UTC", time(0, 0), time(0, 0))
+
+    def is_open(self, now: datetime):
+        return True
+
+    def next_open(self, now: datetime):
+        return now
+
+
+def _easter(year: int):
+    # Anonymous Gregorian algorithm
+    a, b, c = year % 19, year // 100, year % 100
+    d, e = b // 4, b % 4
+    g = (8 * b + 13) // 25
+    h = (19 * a + b - d - g + 15) % 30
+    i, k = c // 4, c % 4
+    l = (32 + 2 * e + 2 * i - h - k) % 7
+    m = (a + 11 * h + 22 * l) // 451
+    month, day = divmod(h + l - 7 * m + 114, 31)
+    return date(year, month, day + 1)
+
+
+def _nth_weekday(year: int, month: int, weekday: int, n: int):
+    # n-th (1-based) weekday of the month, or the last one for n = -1
+    if n > 0:
+        first = date(year, month, 1)
+        return first + timedelta(days=(weekday - first.weekday()) % 7 + 7 * (n - 1))
+    last = date(year, month + 1, 1) - timedelta(days=1) if month < 12 else date(year, 12, 31)
+    return last - timedelta(days=(last.weekday() - weekday) % 7)
+
+
+def _observed(day: date):
+    # Saturday holidays are taken on Friday, Sunday holidays on Monday
+    if day.weekday() == 5:
+        return day - timedelta(days=1)
+    if day.weekday() == 6:
+        return day + timedelta(days=1)
+    return day
+
+
+@lru_cache(maxsize=8)
+def us_holidays(year: int):
+    """NYSE full-day closures"""
+    days = {
+        _nth_weekday(year, 1, 0, 3),     # Martin Luther King Jr. Day
+        _nth_weekday(year, 2, 0, 3),     # Washington's Birthday
+        _easter(year) - timedelta(days=2),  # Good Friday
+        _nth_weekday(year, 5, 0, -1),    # Memorial Day
+        _observed(date(year, 7, 4)),     # Independence Day
+        _nth_weekday(year, 9, 0, 1),     # Labor Day
+        _nth_weekday(year, 11, 3, 4),    # Thanksgiving
+        _observed(date(year, 12, 25)),   # Christmas
+    }
+    # New Year's Day on a Saturday is not made up on the Friday before (that's still the old year)
+    new_year = date(year, 1, 1)
+    if new_year.weekday() != 5:
+        days.add(_observed(new_year))
+    if year >= 2022:
+        days.add(_observed(date(year, 6, 19)))  # Juneteenth
+    return days
+
+
+@lru_cache(maxsize=8)
+def us_early_closes(year: int):
+    """NYSE days that close at 1 p.m."""
+    closes = {_nth_weekday(year, 11, 3, 4) + timedelta(days=1): time(13, 0)}  # Day after Thanksgiving
+    for day in (date(year, 7, 3), date(year, 12, 24)):
+        if day.weekday() < 5 and day not in us_holidays(year):
+            closes[day] = time(13, 0)
+    return closes
+
+
+US = Session("America/New_York", time(9, 30), time(16, 0), us_holidays, us_early_closes)
+AROUND_THE_CLOCK = WeekdaySession()
+ALWAYS = AlwaysOpen()
+
+# Yahoo ticker suffix -> exchange session
+SUFFIX_SESSIONS = {
+    ".TO": Session("America/Toronto", time(9, 30), time(16, 0)),
+    ".V": Session("America/Toronto", time(9, 30), time(16, 0)),
+    ".L": Session("Europe/London", time(8, 0), time(16, 30)),
+    ".DE": Session("Europe/Berlin", time(9, 0), time(17, 30)),
+    ".PA": Session("Europe/Paris", time(9, 0), time(17, 30)),
+    ".AS": Session("Europe/Amsterdam", time(9, 0), time(17, 30)),
+    ".SW": Session("Europe/Zurich", time(9, 0), time(17, 30)),
+    ".HK": Session("Asia/Hong_Kong", time(9, 30), time(16, 0)),
+    ".T": Session("Asia/Tokyo", time(9, 0), time(15, 30)),
+    ".AX": Session("Australia/Sydney", time(10, 0), time(16, 0)),
+}
+
+CRYPTO_QUOTES = ("-USD", "-USDT", "-EUR", "-BTC")
+
+
+def session_for(symbol: str):
+    symbol = symbol.upper()
+    if symbol.endswith(CRYPTO_QUOTES):
+        return ALWAYS
+    if symbol.endswith(("=X", "=F")):
+        return AROUND_THE_CLOCK
+    _, dot, suffix = symbol.rpartition(".")
+    if dot:
+        session = SUFFIX_SESSIONS.get("." + suffix)
+        if session is not None:
+            return session
+    return US
+
+
+def is_open(symbol: str, now: datetime = None):
+    return session_for(symbol).is_open(now or datetime.now(timezone.utc))
+
+
+def next_open(symbol: str, now: datetime = None):
+    """When symbol's market next opens (now if it is open), None if unknown"""
+    return session_for(symbol).next_open(now or datetime.now(timezone.utc))
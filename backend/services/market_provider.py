@@ -0,0 +1,303 @@
+import abc
+import bisect
+import glob
+import json
+import os
+import threading
+import time
+from datetime import date, datetime, timezone
+import numpy as np
+from config.settings import MARKET_DATA_PROVIDER, MARKET_DATA_RECORD_DIR, REPLAY_DIR, REPLAY_SPEED, REPLAY_START
+
+# Market data providers.
+#
+# Every quote and every price bar the backend uses comes through one provider object, so the
+# rest of the code never talks to Yahoo Finance directly. There are two providers:
+#   - YFinanceProvider: live data from Yahoo Finance
+#   - ReplayProvider:   data recorded earlier, read from files. No network, same answers every run,
+#                       so it is what load tests and benchmarks use. It can also replay a recorded
+#                       trading day through the websocket feed at any speed.
+# A RecordingProvider can wrap the live provider to save everything it returns in the replay format.
+#
+# Replay folder layout (REPLAY_DIR):
+#   quotes/AAPL.jsonl       <- one line per recorded quote: {"time": <epoch seconds>, "info": {...}}
+#   bars/1m/AAPL.csv        <- recorded bars: date (epoch seconds),open,high,low,close,volume
+#   bars/1d/AAPL.csv
+#
+# Both providers answer the same two questions:
+#   get_info(symbol)                          -> quote/profile dict shaped like yf.Ticker(symbol).info
+#   get_history(symbol, start, end, interval) -> bars in [start, end) as a dict of NumPy columns
+#                                                ("date" in epoch seconds plus open/high/low/close/volume)
+
+BAR_COLUMNS = ["open", "high", "low", "close", "volume"]
+
+# Intraday intervals, finest first. Replayed quotes are built from these when a symbol has no recorded quotes.
+INTRADAY_INTERVALS = ["1m", "2m", "5m", "15m", "30m", "60m", "90m", "1h"]
+
+
+def _empty_bars():
+    return {"date": np.array([], dtype=np.int64), **{column: np.array([]) for column in BAR_COLUMNS}}
+
+
+def _day_epoch(day: date):
+    return int(datetime(day.year, day.month, day.day, tzinfo=timezone.utc).timestamp())
+
+
+class MarketDataProvider(abc.ABC):
+    name = "base"
+
+    @abc.abstractmethod
+    def get_info(self, symbol: str):
+        ...
+
+    @abc.abstractmethod
+    def get_history(self, symbol: str, start: date, end: date, interval: str):
+        ...
+
+
+class YFinanceProvider(MarketDataProvider):
+    name = "yfinance"
+
+    def get_info(self, symbol: str):
+        # yfinance (and pandas) are only imported when we really talk to Yahoo
+        import yfinance as yf
+        return yf.Ticker(symbol).info
+
+    def get_history(self, symbol: str, start: date, end: date, interval: str):
+        import yfinance as yf
+        data = yf.Ticker(symbol).history(start=start.isoformat(), end=end.isoformat(), interval=interval)
+        columns = {"date": np.array([int(ts.timestamp()) for ts in data.index], dtype=np.int64)}
+        for column in BAR_COLUMNS:
+            name = column.capitalize()
+            columns[column] = data[name].to_numpy(dtype=np.float64) if name in data else np.full(len(data), np.nan)
+        return columns
+
+
+def _bars_path(folder: str, symbol: str, interval: str):
+    return os.path.join(folder, "bars", interval, f"{symbol}.csv")
+
+
+def _quotes_path(folder: str, symbol: str):
+    return os.path.join(folder, "quotes", f"{symbol}.jsonl")
+
+
+def _read_bars(path: str):
+    if not os.path.exists(path):
+        return None
+    table = np.loadtxt(path, delimiter=",", skiprows=1, ndmin=2)
+    if table.size == 0:
+        return _empty_bars()
+    order = np.argsort(table[:, 0], kind="stable")
+    table = table[order]
+    bars = {"date": table[:, 0].astype(np.int64)}
+    for i, column in enumerate(BAR_COLUMNS, start=1):
+        bars[column] = table[:, i]
+    return bars
+
+
+def _write_bars(path: str, bars: dict):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    table = np.column_stack([bars["date"]] + [bars[column] for column in BAR_COLUMNS])
+    tmp_path = path + ".tmp"
+    np.savetxt(tmp_path, table, delimiter=",", header="date," + ",".join(BAR_COLUMNS), comments="", fmt="%.10g")
+    os.replace(tmp_path, path)
+
+
+class RecordingProvider(MarketDataProvider):
+    """Passes calls through to another provider and saves every answer in the replay format"""
+
+    def __init__(self, inner: MarketDataProvider, folder: str):
+        self.inner = inner
+        self.folder = folder
+        self.name = f"{inner.name}+recording"
+        self.lock = threading.Lock()
+
+    def get_info(self, symbol: str):
+        info = self.inner.get_info(symbol)
+        path = _quotes_path(self.folder, symbol.upper())
+        line = json.dumps({"time": time.time(), "info": info}, default=str)
+        with self.lock:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+        return info
+
+    def get_history(self, symbol: str, start: date, end: date, interval: str):
+        bars = self.inner.get_history(symbol, start, end, interval)
+        path = _bars_path(self.folder, symbol.upper(), interval)
+        with self.lock:
+            existing = _read_bars(path)
+            if existing is not None:
+                # Newly downloaded bars replace recorded ones with the same timestamp
+                keep = ~np.isin(existing["date"], bars["date"])
+                merged = {column: np.concatenate([existing[column][keep], bars[column]]) for column in existing}
+                order = np.argsort(merged["date"], kind="stable")
+                merged = {column: values[order] for column, values in merged.items()}
+            else:
+                merged = bars
+            _write_bars(path, merged)
+        return bars
+
+
+class ReplayProvider(MarketDataProvider):
+    """
+    Serves recorded quotes and bars as of a replay clock.
+    The clock starts at `start` (recorded time) the first time data is asked for and runs
+    `speed` times faster than real time; speed 0 keeps it frozen, which makes runs repeatable.
+    Nothing recorded after the clock is ever returned.
+    """
+    name = "replay"
+
+    def __init__(self, folder: str, speed: float = 1.0, start=None):
+        self.folder = folder
+        self.speed = speed
+        self.start = self._parse_time(start) if start else None
+        self.wall_start = None
+        self.quotes = {}   # symbol -> (times, records)
+        self.bars = {}     # (interval, symbol) -> bars dict, or None when nothing was recorded
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def _parse_time(value):
+        if isinstance(value, (int, float)):
+            return float(value)
+        parsed = datetime.fromisoformat(value)
+        if parsed.tzinfo is None:
+            parsed = parsed.replace(tzinfo=timezone.utc)
+        return parsed.timestamp()
+
+    def now(self):
+        """Current replay time, in epoch seconds"""
+        with self.lock:
+            if self.start is None:
+                self.start = self._earliest_recording()
+            if self.wall_start is None:
+                self.wall_start = time.monotonic()
+            return self.start + (time.monotonic() - self.wall_start) * self.speed
+
+    def reset(self, start=None, speed=None):
+        """Restart the replay clock (optionally from another time or at another speed)"""
+        with self.lock:
+            if start is not None:
+                self.start = self._parse_time(start)
+            if speed is not None:
+                self.speed = speed
+            self.wall_start = None
+
+    def get_info(self, symbol: str):
+        symbol = symbol.upper()
+        now = self.now()
+        times, records = self._quotes(symbol)
+        if times:
+            index = bisect.bisect_right(times, now) - 1
+            return dict(records[index]) if index >= 0 else {}
+        # No recorded quotes: build one from the finest intraday bars we have
+        for interval in INTRADAY_INTERVALS:
+            bars = self._bars(symbol, interval)
+            if bars is not None and len(bars["date"]):
+                return self._info_from_bars(symbol, bars, now)
+        return {}
+
+    def get_history(self, symbol: str, start: date, end: date, interval: str):
+        bars = self._bars(symbol.upper(), interval)
+        if bars is None:
+            return _empty_bars()
+        lo = np.searchsorted(bars["date"], _day_epoch(start), side="left")
+        hi = np.searchsorted(bars["date"], min(_day_epoch(end), self.now()), side="left")
+        return {column: values[lo:hi].copy() for column, values in bars.items()}
+
+    def _quotes(self, symbol: str):
+        cached = self.quotes.get(symbol)
+        if cached is None:
+            records = []
+            path = _quotes_path(self.folder, symbol)
+            if os.path.exists(path):
+                with open(path, encoding="utf-8") as f:
+                    records = [json.loads(line) for line in f if line.strip()]
+            records.sort(key=lambda record: record["time"])
+            cached = ([record["time"] for record in records], [record["info"] for record in records])
+            self.quotes[symbol] = cached
+        return cached
+
+    def _bars(self, symbol: str, interval: str):
+        key = (interval, symbol)
+        if key not in self.bars:
+            self.bars[key] = _read_bars(_bars_path(self.folder, symbol, interval))
+        return self.bars[key]
+
+    @staticmethod
+    def _info_from_bars(symbol: str, bars: dict, now: float):
+        last = np.searchsorted(bars["date"], now, side="right") - 1
+        if last < 0:
+            return {}
+        # The session so far: bars on the same (UTC) day as the latest one
+        day_start = bars["date"][last] - bars["date"][last] % 86400
+        first = np.searchsorted(bars["date"], day_start, side="left")
+        close = float(bars["close"][last])
+        info = {
+            "symbol": symbol,
+            "currentPrice": close,
+            "regularMarketPrice": close,
+            "regularMarketOpen": float(bars["open"][first]),
+            "dayHigh": float(np.nanmax(bars["high"][first:last + 1])),
+            "dayLow": float(np.nanmin(bars["low"][first:last + 1])),
+            "regularMarketVolume": float(np.nansum(bars["volume"][first:last + 1])),
+            "replayTime": datetime.fromtimestamp(int(bars["date"][last]), tz=timezone.utc).isoformat()
+        }
+        info["regularMarketDayHigh"] = info["dayHigh"]
+        info["regularMarketDayLow"] = info["dayLow"]
+        if first > 0:
+            previous_close = float(bars["close"][first - 1])
+            info["previousClose"] = previous_close
+            info["regularMarketChange"] = close - previous_close
+            info["regularMarketChangePercent"] = (close - previous_close) / previous_close * 100 if previous_close else None
+        return info
+
+    def _earliest_recording(self):
+        # Must be called with the lock held
+        earliest = []
+        for path in glob.glob(os.path.join(self.folder, "quotes", "*.jsonl")):
+            with open(path, encoding="utf-8") as f:
+                times = [json.loads(line)["time"] for line in f if line.strip()]
+            if times:
+                earliest.append(min(times))
+        for interval in INTRADAY_INTERVALS:
+            for path in glob.glob(os.path.join(self.folder, "bars", interval, "*.csv")):
+                bars = _read_bars(path)
+                if bars is not None and len(bars["date"]):
+                    earliest.append(float(bars["date"][0]))
+        # Nothing intraday recorded (daily bars only): replay "now"
+        return min(earliest) if earliest else time.time()
+
+
+def create_provider(kind: str = MARKET_DATA_PROVIDER, record_dir: str = MARKET_DATA_RECORD_DIR):
+    if kind == "yfinance":
+        provider = YFinanceProvider()
+    elif kind == "replay":
+        provider = ReplayProvider(REPLAY_DIR, REPLAY_SPEED, REPLAY_START)
+    else:
+        raise ValueError(f"Unknown market data provider {kind}. Use yfinance or replay")
+    if record_dir:
+        provider = RecordingProvider(provider, record_dir)
+    return provider
+
+
+# The one provider the whole app gets market data from (chosen by MARKET_DATA_PROVIDER)
+_provider = None
+_provider_lock = threading.Lock()
+
+
+def get_provider():
+    global _provider
+    if _provider is None:
+        with _provider_lock:
+            if _provider is None:
+                _provider = create_provider()
+    return _provider
+
+
+def set_provider(provider: MarketDataProvider):
+    """Swap the provider at runtime, e.g. to a ReplayProvider in a benchmark"""
+    global _provider
+    with _provider_lock:
+        _provider = provider
@@ -0,0 +1,224 @@
+import threading
+import time
+
+# In-process metrics.
+#
+# Counters and latency histograms kept in memory and read by GET /api/metrics
+# (as JSON, or in the Prometheus text format with ?format=prometheus).
+# Recording a value is a dict lookup and a few additions under a lock, with no string
+# formatting and no I/O, so it is cheap enough to do on every request and upstream call.
+#
+# Every metric has a name and optional labels, e.g.
+#   metrics.observe("http_request_ms", 3.2, method="GET", route="get_stocks")
+# Services that already keep their own stats (the quote cache, the upstream pools...) are not
+# duplicated here: they are registered as collectors and read when the metrics are requested.
+# Gauges (open websockets, subscribed symbols...) come from collectors too.
+
+# Upper bounds (milliseconds) of the latency histogram buckets
+LATENCY_BUCKETS_MS = (1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+
+def _key(name: str, labels: dict):
+    return name, tuple(sorted(labels.items()))
+
+
+class Histogram:
+    def __init__(self, buckets=LATENCY_BUCKETS_MS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # the last one is everything above the largest bound
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float):
+        # Buckets are few, a linear scan is as fast as a binary search here
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                break
+        else:
+            i = len(self.buckets)
+        self.counts[i] += 1
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+    def quantile(self, q: float):
+        """Estimate from the buckets (linear inside the bucket the quantile falls in)"""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        lower = 0.0
+        for i, count in enumerate(self.counts):
+            upper = min(self.buckets[i], self.max) if i < len(self.buckets) else self.max
+            if count and seen + count >= rank:
+                return round(lower + (upper - lower) * (rank - seen) / count, 3)
+            seen += count
+            lower = upper
+        return round(self.max, 3)
+
+    def snapshot(self):
+        return {
+            "count": self.count,
+            "sum": round(self.sum, 3),
+            "mean": round(self.sum / self.count, 3) if self.count else None,
+            "max": round(self.max, 3),
+            "p50": self.quantile(0.50),
+            "p95": self.quantile(0.95),
+            "p99": self.quantile(0.99),
+            "buckets": {str(bound): count for bound, count in zip(self.buckets + ("inf",), self.counts)}
+        }
+
+
+class _Timer:
+    def __init__(self, metrics, name: str, labels: dict):
+        self.metrics = metrics
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        labels = {**self.labels, "outcome": "error" if exc_type else "ok"}
+        self.metrics.observe(self.name, (time.perf_counter() - self.started) * 1000, **labels)
+        return False
+
+
+class Metrics:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}    # (name, labels) -> number
+        self.histograms = {}  # (name, labels) -> Histogram
+        # name -> function returning a dict, called every time metrics are read
+        self.collectors = {}
+
+    def inc(self, name: str, value: float = 1, **labels):
+        key = _key(name, labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name: str, value: float, **labels):
+        key = _key(name, labels)
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(value)
+
+    def timer(self, name: str, **labels):
+        """with metrics.timer("x_ms", ...): ... records the time taken, labelled ok/error"""
+        return _Timer(self, name, labels)
+
+    def add_collector(self, name: str, collect):
+        self.collectors[name] = collect
+
+    def snapshot(self):
+        with self.lock:
+            counters = list(self.counters.items())
+            histograms = [(key, histogram.snapshot()) for key, histogram in self.histograms.items()]
+
+        def group(items):
+            grouped = {}
+            for (name, labels), value in items:
+                grouped.setdefault(name, []).append({"labels": dict(labels), "value": value})
+            return grouped
+
+        collected = {}
+        for name, collect in self.collectors.items():
+            try:
+                collected[name] = collect()
+            except Exception as e:
+                collected[name] = {"error": str(e)}
+        return {
+            "counters": group(counters),
+            "histograms": group(histograms),
+            **collected
+        }
+
+    def prometheus(self):
+        """Everything in the Prometheus text exposition format"""
+        lines = []
+        with self.lock:
+            counters = list(self.counters.items())
+            histograms = [(key, histogram.buckets, list(histogram.counts), histogram.sum, histogram.count)
+                          for key, histogram in self.histograms.items()]
+
+        for (name, labels), value in counters:
+            lines.append(f"{name}{_labels(labels)} {value}")
+        for (name, labels), buckets, counts, total, count in histograms:
+            cumulative = 0
+            for bound, bucket_count in zip(buckets + ("+Inf",), counts):
+                cumulative += bucket_count
+                lines.append(f"{name}_bucket{_labels(labels + (('le', str(bound)),))} {cumulative}")
+            lines.append(f"{name}_sum{_labels(labels)} {total}")
+            lines.append(f"{name}_count{_labels(labels)} {count}")
+
+        # Collector values become gauges named after their path, e.g. quote_cache_hit_ratio
+        for name, collect in self.collectors.items():
+            try:
+                values = collect()
+            except Exception:
+                continue
+            for path, value in _flatten(values, name):
+                lines.append(f"{path} {value}")
+        return "\n".join(lines) + "\n"
+
+
+def _labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{value}"' for key, value in labels) + "}"
+
+
+def _flatten(values: dict, prefix: str):
+    for key, value in values.items():
+        path = f"{prefix}_{key}".replace("-", "_").replace(".", "_")
+        if isinstance(value, dict):
+            yield from _flatten(value, path)
+        elif isinstance(value, bool):
+            yield path, int(value)
+        elif isinstance(value, (int, float)):
+            yield path, value
+
+
+class RequestMetricsMiddleware:
+    """
+    ASGI middleware recording the latency of every HTTP request, per method and route.
+    Routes are named after their handler function (get_stock_history, buy...), not the URL,
+    so /stocks/AAPL and /stocks/MSFT share one series and the number of series stays small.
+    Streaming responses are timed until their last chunk is sent.
+    """
+
+    def __init__(self, app, registry=None):
+        self.app = app
+        self.metrics = registry or metrics
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        status = [500]
+
+        async def send_and_record_status(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_and_record_status)
+        finally:
+            # The router puts the matched route on the scope
+            route = getattr(scope.get("route"), "name", None) or "unmatched"
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            self.metrics.observe("http_request_ms", elapsed_ms, method=scope["method"], route=route)
+            self.metrics.inc("http_requests_total", method=scope["method"], route=route,
+                             status=f"{status[0] // 100}xx")
+
+
+# One registry shared by the whole app
+metrics = Metrics()
@@ -0,0 +1,233 @@
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+from concurrent.futures import FIRST_COMPLETED, as_completed, wait
+from datetime import date
+import numpy as np
+from config.settings import MONTE_CARLO_WORKERS, MONTE_CARLO_CACHE_SIZE
+from services.backtest_service import load_price_matrix
+from services.process_pool import LazyProcessPool
+
+# Monte Carlo projections of a portfolio's future value.
+#
+# Paths are generated in fixed-size batches. Every batch gets its own child of one
+# SeedSequence, so the same seed always gives the same answer no matter how many
+# worker processes run the batches. Workers never send paths back: each one reduces
+# its paths into a fixed-size histogram of log(value / starting value) per time step,
+# and the histograms are simply added together. Memory therefore stays bounded
+# whether 1,000 or 5,000,000 paths are requested.
+
+# Paths simulated by one task sent to the process pool
+BATCH_PATHS = 20000
+# Max numbers (paths x steps x symbols) generated at once inside a task (~16MB of float64)
+CHUNK_ELEMENTS = 2_000_000
+# Histogram resolution for log(value / starting value)
+BINS = 4000
+# Max number of time steps we report bands for (long horizons are sampled evenly)
+MAX_BAND_POINTS = 260
+# Percentiles reported for the terminal value
+TERMINAL_PERCENTILES = [1, 5, 10, 25, 50, 75, 90, 95, 99]
+# Batches submitted to the pool at a time, per worker: enough to keep every worker busy
+# while finished histograms are added up, without queueing every batch of a huge request
+BATCHES_PER_WORKER = 2
+
+_pool = LazyProcessPool(MONTE_CARLO_WORKERS)
+
+# Finished results keyed by a hash of all inputs, least recently used first
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def _simulate_batch(task):
+    """
+    Runs inside a worker process. Simulates task["paths"] paths and returns
+    a (band steps x BINS + 2) histogram of log(value / starting value).
+    The two extra bins count paths below/above the histogram range.
+    """
+    rng = np.random.default_rng(task["seed"])
+    returns = task["returns"]           # historical daily log returns (days x symbols)
+    holdings = task["holdings"]         # money in each symbol today
+    cash = task["cash"]
+    steps = task["steps"]               # which days (0-based) we report bands for
+    lo, hi = task["range"]
+    horizon = int(steps[-1]) + 1
+    start_value = cash + holdings.sum()
+    width = (hi - lo) / BINS
+
+    histogram = np.zeros(len(steps) * (BINS + 2), dtype=np.int64)
+    offsets = np.arange(len(steps)) * (BINS + 2)
+    chunk = max(1, CHUNK_ELEMENTS // (horizon * len(holdings)))
+
+    remaining = task["paths"]
+    while remaining > 0:
+        size = min(chunk, remaining)
+        remaining -= size
+
+        if task["model"] == "gbm":
+            # Correlated normal draws with the historical mean and covariance
+            shocks = rng.standard_normal((size, horizon, len(holdings)))
+            log_returns = task["mu"] + shocks @ task["cholesky"].T
+        else:
+            # Bootstrap: replay randomly chosen historical days (all symbols together,
+            # so correlations between symbols are kept)
+            log_returns = returns[rng.integers(0, len(returns), size=(size, horizon))]
+
+        growth = np.exp(np.cumsum(log_returns, axis=1)[:, steps, :])
+        values = cash + growth @ holdings
+        ratio = np.log(values / start_value)
+
+        # Bin index 0 is "below range", BINS + 1 is "above range"
+        bins = np.clip(((ratio - lo) / width).astype(np.int64) + 1, 0, BINS + 1)
+        bins[ratio < lo] = 0
+        histogram += np.bincount((bins + offsets).ravel(), minlength=len(histogram))
+
+    return histogram.reshape(len(steps), BINS + 2)
+
+
+def _percentiles_from_histogram(counts, percentiles, lo, hi):
+    # counts: (steps x BINS + 2). Returns the log-ratio at each percentile for every step,
+    # using the middle of the bin the percentile falls in
+    width = (hi - lo) / BINS
+    centers = np.concatenate([[lo], lo + (np.arange(BINS) + 0.5) * width, [hi]])
+    cumulative = np.cumsum(counts, axis=1)
+    total = cumulative[:, -1:]
+    result = {}
+    for p in percentiles:
+        target = np.maximum(total * p / 100.0, 1)
+        index = (cumulative < target).sum(axis=1)
+        result[p] = centers[np.minimum(index, BINS + 1)]
+    return result
+
+
+def _cache_key(inputs: dict):
+    return hashlib.sha256(json.dumps(inputs, sort_keys=True).encode()).hexdigest()
+
+
+def run_monte_carlo(portfolio: dict, cash: float, model: str = "gbm", n_paths: int = 10000,
+                    horizon_days: int = 252, lookback_days: int = 756, seed: int = None,
+                    percentiles=(5, 25, 50, 75, 95)):
+    """
+    Project a portfolio forward with n_paths simulated price paths.
+    portfolio is the Firestore portfolio dict ({"AAPL": {"quantity": 10, ...}}).
+    Returns percentile bands over time and the distribution of the terminal value.
+    """
+    positions = {symbol.upper(): float(position["quantity"]) for symbol, position in portfolio.items()
+                 if position.get("quantity", 0) > 0}
+    if not positions:
+        raise ValueError("Portfolio has no positions to simulate")
+    if model not in ("gbm", "bootstrap"):
+        raise ValueError("model must be 'gbm' or 'bootstrap'")
+    if not percentiles or not all(0 <= p <= 100 for p in percentiles):
+        raise ValueError("percentiles must be between 0 and 100")
+
+    percentiles = sorted(set(percentiles))
+    inputs = {
+        "positions": positions, "cash": cash, "model": model, "n_paths": n_paths,
+        "horizon_days": horizon_days, "lookback_days": lookback_days, "seed": seed,
+        "percentiles": percentiles,
+        # History (and so the result) changes every day
+        "as_of": date.today().isoformat()
+    }
+    key = _cache_key(inputs)
+    with _cache_lock:
+        if key in _cache:
+            _cache.move_to_end(key)
+            return _cache[key]
+
+    # Estimate return behaviour from recent history (calendar days ~ 1.45 x trading days)
+    symbols = sorted(positions)
+    start = date.fromordinal(date.today().toordinal() - int(lookback_days * 1.45))
+    _, prices = load_price_matrix(symbols, start=start)
+    returns = np.diff(np.log(prices), axis=0)
+    if len(returns) < 2:
+        raise ValueError("Not enough price history to simulate")
+
+    quantities = np.array([positions[symbol] for symbol in symbols])
+    holdings = quantities * prices[-1]
+    start_value = cash + holdings.sum()
+
+    mu = returns.mean(axis=0)
+    covariance = np.atleast_2d(np.cov(returns, rowvar=False))
+    # A tiny ridge keeps the Cholesky factorization working for perfectly correlated symbols
+    cholesky = np.linalg.cholesky(covariance + np.eye(len(symbols)) * 1e-12)
+
+    # Histogram range: generous multiple of the portfolio's own volatility over the horizon
+    weights = holdings / holdings.sum()
+    daily_volatility = float(np.sqrt(weights @ covariance @ weights))
+    spread = max(8 * daily_volatility * np.sqrt(horizon_days) + abs(float(mu @ weights)) * horizon_days, 0.5)
+    value_range = (-spread, spread)
+
+    steps = np.unique(np.linspace(0, horizon_days - 1, min(horizon_days, MAX_BAND_POINTS)).round().astype(int))
+
+    # Same inputs -> same seed, so repeat requests without a seed are reproducible (and cacheable)
+    root_seed = seed if seed is not None else int(key[:16], 16)
+    batch_sizes = [BATCH_PATHS] * (n_paths // BATCH_PATHS)
+    if n_paths % BATCH_PATHS:
+        batch_sizes.append(n_paths % BATCH_PATHS)
+    seeds = np.random.SeedSequence(root_seed).spawn(len(batch_sizes))
+
+    tasks = (
+        {
+            "paths": size, "seed": child_seed, "model": model, "returns": returns,
+            "mu": mu, "cholesky": cholesky, "holdings": holdings, "cash": cash,
+            "steps": steps, "range": value_range
+        }
+        for size, child_seed in zip(batch_sizes, seeds)
+    )
+
+    # Submit batches through a bounded window and add histograms up as they finish, so at most
+    # `window` batches are queued or running (and holding a histogram) at any time.
+    # Integer counts add up to the same total in any order.
+    counts = np.zeros((len(steps), BINS + 2), dtype=np.int64)
+    pool = _pool.get()
+    window = max(1, MONTE_CARLO_WORKERS * BATCHES_PER_WORKER)
+    in_flight = set()
+    try:
+        for task in tasks:
+            if len(in_flight) >= window:
+                done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    counts += future.result()
+            in_flight.add(pool.submit(_simulate_batch, task))
+        for future in as_completed(in_flight):
+            counts += future.result()
+    finally:
+        # After an error, don't leave the rest of the batches running for nobody
+        for future in in_flight:
+            future.cancel()
+
+    lo, hi = value_range
+    bands = _percentiles_from_histogram(counts, percentiles, lo, hi)
+    terminal = _percentiles_from_histogram(counts[-1:], TERMINAL_PERCENTILES, lo, hi)
+
+    # Terminal distribution, coarsened to 100 bins of dollar values
+    fine = counts[-1, 1:-1].reshape(100, BINS // 100).sum(axis=1)
+    edges = start_value * np.exp(np.linspace(lo, hi, 101))
+    loss_bins = int(np.searchsorted(np.linspace(lo, hi, BINS + 1), 0.0))
+
+    result = {
+        "symbols": symbols,
+        "model": model,
+        "n_paths": n_paths,
+        "horizon_days": horizon_days,
+        "start_value": float(start_value),
+        "days": (steps + 1).tolist(),
+        "bands": {str(p): (start_value * np.exp(values)).round(2).tolist() for p, values in bands.items()},
+        "terminal": {
+            "percentiles": {str(p): float(start_value * np.exp(values[0])) for p, values in terminal.items()},
+            "probability_of_loss": float((counts[-1, 0] + counts[-1, 1:loss_bins + 1].sum()) / n_paths),
+            "histogram": {
+                "edges": edges.round(2).tolist(),
+                "counts": fine.tolist(),
+                "below": int(counts[-1, 0]),
+                "above": int(counts[-1, -1])
+            }
+        }
+    }
+
+    with _cache_lock:
+        _cache[key] = result
+        while len(_cache) > MONTE_CARLO_CACHE_SIZE:
+            _cache.popitem(last=False)
+    return result
@@ -0,0 +1,523 @@
+import asyncio
+import heapq
+import logging
+import time
+import uuid
+from datetime import datetime
+from fastapi import HTTPException
+from google.api_core.exceptions import Aborted, AlreadyExists, ServerError, TooManyRequests
+from config.settings import (
+    ORDER_FILL_BATCH, ORDER_FILL_CONCURRENCY, ORDER_RELOAD, ORDER_MAX_OPEN_PER_USER, ORDER_MAX_FILL_ATTEMPTS
+)
+from services.firebase_service import get_db
+from services.history_store import SYMBOL_PATTERN
+from services.quote_hub import quote_hub
+from services.stock_service import fill_in_transaction, notify_trade
+from services.upstream import database, UpstreamOverloaded, UpstreamTimeout
+from services.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Resting limit, stop and stop-limit orders.
+#
+# Orders are stored in the top-level "orders" collection ({"uid", "symbol", "side", "type",
+# "quantity", "limit_price", "stop_price", "status", ...}) and every open one is also kept in
+# an in-memory order book per symbol. A book has four heaps, each with the order that would
+# trigger first on top:
+#   buy limits   trigger when price <= limit   (highest limit first)
+#   sell limits  trigger when price >= limit   (lowest limit first)
+#   buy stops    trigger when price >= stop    (lowest stop first)
+#   sell stops   trigger when price <= stop    (highest stop first)
+# Every quote from the quote hub pops orders off the tops while they trigger, so a quote costs
+# O(log n) per triggered order and nothing for the orders that stay put. A stop-limit whose stop
+# triggers moves to the limit heap of its side. Cancelled orders are flagged and skipped when
+# they reach the top (and swept out once they pile up).
+#
+# Triggered orders fill at the quote that triggered them. They are queued and filled in batches:
+# one Firestore transaction per user per batch, through the same code as the trade routes, and
+# the transaction also checks and flips each order's status, so an order cancelled (or filled by
+# another worker) in the meantime is never filled twice. Orders that can't be filled
+# (not enough cash or shares) are marked rejected.
+# A fill that fails on a transient error (Firestore busy, contended or timing out) puts its orders
+# back on the book to trigger again, up to ORDER_MAX_FILL_ATTEMPTS times; any other error, or
+# running out of attempts, cancels them with the reason, so a broken order can't fail forever.
+#
+# A reload rebuilds the books from Firestore while orders keep being placed, triggered and
+# cancelled here; those changes are recorded during the load and merged into the new books.
+
+LIMIT, STOP, STOP_LIMIT = "limit", "stop", "stop_limit"
+OPEN, FILLED, CANCELLED, REJECTED = "open", "filled", "cancelled", "rejected"
+
+# Rebuild a book's heaps once it holds more cancelled entries than this (and more than live ones)
+COMPACT_AFTER = 1000
+
+# Errors worth another try: Firestore overloaded, unavailable, timing out or contended
+TRANSIENT_ERRORS = (ServerError, TooManyRequests, Aborted, AlreadyExists, UpstreamOverloaded, UpstreamTimeout,
+                    TimeoutError, ConnectionError)
+
+
+class RestingOrder:
+    __slots__ = ("id", "uid", "symbol", "side", "type", "quantity", "limit_price", "stop_price",
+                 "stop_triggered", "active", "failures")
+
+    def __init__(self, order_id: str, data: dict):
+        self.id = order_id
+        self.uid = data["uid"]
+        self.symbol = data["symbol"]
+        self.side = data["side"]
+        self.type = data["type"]
+        self.quantity = data["quantity"]
+        self.limit_price = data.get("limit_price")
+        self.stop_price = data.get("stop_price")
+        # A stop-limit whose stop already triggered rests as a plain limit order
+        self.stop_triggered = data.get("stop_triggered", False)
+        self.active = True
+        self.failures = 0      # fills of this order that failed on a transient error
+
+
+class OrderBook:
+    def __init__(self):
+        self.buy_limits = []   # (-limit, seq, order)
+        self.sell_limits = []  # (limit, seq, order)
+        self.buy_stops = []    # (stop, seq, order)
+        self.sell_stops = []   # (-stop, seq, order)
+        self.live = 0
+        self.dead = 0          # cancelled entries still in the heaps
+        self.seq = 0           # keeps equal prices in arrival order (and orders never get compared)
+
+    def add(self, order: RestingOrder):
+        self.seq += 1
+        self.live += 1
+        if order.type == LIMIT or order.stop_triggered:
+            if order.side == "BUY":
+                heapq.heappush(self.buy_limits, (-order.limit_price, self.seq, order))
+            else:
+                heapq.heappush(self.sell_limits, (order.limit_price, self.seq, order))
+        elif order.side == "BUY":
+            heapq.heappush(self.buy_stops, (order.stop_price, self.seq, order))
+        else:
+            heapq.heappush(self.sell_stops, (-order.stop_price, self.seq, order))
+
+    def discard(self, order: RestingOrder):
+        # Lazy delete: the entry stays in its heap until it reaches the top
+        order.active = False
+        self.live -= 1
+        self.dead += 1
+        if self.dead > COMPACT_AFTER and self.dead > self.live:
+            for heap in (self.buy_limits, self.sell_limits, self.buy_stops, self.sell_stops):
+                heap[:] = [entry for entry in heap if entry[2].active]
+                heapq.heapify(heap)
+            self.dead = 0
+
+    def _pop_while(self, heap, triggers):
+        popped = []
+        while heap and triggers(heap[0][0]):
+            order = heapq.heappop(heap)[2]
+            if order.active:
+                popped.append(order)
+            else:
+                self.dead -= 1
+        return popped
+
+    def trigger(self, price: float):
+        """
+        Take every order that triggers at price off the book.
+        Returns (orders to fill now, stop-limits whose stop triggered and now rest as limit orders).
+        """
+        fills, converted = [], []
+        # Stops first: a stop-limit that triggers may be marketable at the same price
+        for order in (self._pop_while(self.buy_stops, lambda stop: stop <= price)
+                      + self._pop_while(self.sell_stops, lambda stop: -stop >= price)):
+            self.live -= 1
+            if order.type == STOP_LIMIT:
+                order.stop_triggered = True
+                self.add(order)
+                converted.append(order)
+            else:
+                fills.append(order)
+        for order in (self._pop_while(self.buy_limits, lambda limit: -limit >= price)
+                      + self._pop_while(self.sell_limits, lambda limit: limit <= price)):
+            self.live -= 1
+            fills.append(order)
+        return fills, [order for order in converted if order not in fills]
+
+
+def validate(symbol: str, side: str, order_type: str, quantity: int, limit_price=None, stop_price=None):
+    if not symbol:
+        raise ValueError("Missing symbol")
+    # The symbol is stored and polled for as long as the order rests, so it must look like a ticker
+    if not SYMBOL_PATTERN.match(symbol):
+        raise ValueError(f"Invalid symbol {symbol}")
+    if side not in ("BUY", "SELL"):
+        raise ValueError(f"Unknown order side {side}")
+    if order_type not in (LIMIT, STOP, STOP_LIMIT):
+        raise ValueError(f"Unknown order type {order_type}")
+    if quantity <= 0:
+        raise ValueError("Quantity must be positive")
+    if order_type in (LIMIT, STOP_LIMIT) and not limit_price:
+        raise ValueError(f"A {order_type} order needs a limit_price")
+    if order_type in (STOP, STOP_LIMIT) and not stop_price:
+        raise ValueError(f"A {order_type} order needs a stop_price")
+
+
+def _fill_resting(user_id: str, fills):
+    """
+    Fill triggered orders for one user in one Firestore transaction. fills is a list of
+    (RestingOrder, price). Returns (transactions, {order id: final status}). Blocking.
+    """
+    from firebase_admin import firestore  # loaded with the database client, see firebase_service.get_db
+    db = get_db()
+    user_ref = db.collection("users").document(user_id)
+    order_refs = {order.id: db.collection("orders").document(order.id) for order, _ in fills}
+
+    @firestore.transactional
+    def fill(transaction):
+        user_doc = user_ref.get(transaction=transaction)
+        order_docs = {doc.id: doc for doc in db.get_all(list(order_refs.values()), transaction=transaction)}
+        outcomes = {}
+        live = []
+        for order, price in fills:
+            doc = order_docs.get(order.id)
+            if doc is None or not doc.exists or doc.to_dict().get("status") != OPEN:
+                # Cancelled, or already filled by another worker
+                outcomes[order.id] = None
+            else:
+                live.append((order, price))
+        if not live:
+            return [], outcomes
+        if not user_doc.exists:
+            raise HTTPException(status_code=404, detail="User not found")
+
+        rejected = {}
+        transactions, _ = fill_in_transaction(
+            transaction, db, user_id, user_ref, user_doc.to_dict(),
+            [{"side": order.side, "symbol": order.symbol, "quantity": order.quantity, "price": price}
+             for order, price in live],
+            on_reject=lambda index, reason: rejected.__setitem__(index, reason)
+        )
+        now = datetime.now().isoformat()
+        for index, (order, price) in enumerate(live):
+            if index in rejected:
+                update = {"status": REJECTED, "reason": rejected[index], "closed_at": now}
+            else:
+                update = {"status": FILLED, "fill_price": price, "closed_at": now}
+            transaction.update(order_refs[order.id], update)
+            outcomes[order.id] = update["status"]
+        return transactions, outcomes
+
+    return fill(db.transaction())
+
+
+def _read_open_orders():
+    """Every open order (blocking, one query)"""
+    return [(doc.id, doc.to_dict()) for doc in get_db().collection("orders").where("status", "==", OPEN).stream()]
+
+
+def _create(order_id: str, data: dict, max_open: int = ORDER_MAX_OPEN_PER_USER):
+    """Store a new order, unless the user already has max_open open orders. Blocking."""
+    from firebase_admin import firestore
+    db = get_db()
+    ref = db.collection("orders").document(order_id)
+    open_orders = db.collection("orders").where("uid", "==", data["uid"]).where("status", "==", OPEN)
+
+    @firestore.transactional
+    def create(transaction):
+        if len(list(open_orders.limit(max_open).stream(transaction=transaction))) >= max_open:
+            raise HTTPException(status_code=400, detail=f"Too many open orders (at most {max_open}), cancel some first")
+        transaction.create(ref, data)
+
+    create(db.transaction())
+
+
+def _give_up(order_ids: list, reason: str):
+    """Cancel orders that are still open, with the reason. Returns the ids cancelled. Blocking."""
+    from firebase_admin import firestore
+    db = get_db()
+    refs = [db.collection("orders").document(order_id) for order_id in order_ids]
+
+    @firestore.transactional
+    def cancel(transaction):
+        now = datetime.now().isoformat()
+        cancelled = []
+        docs = {doc.id: doc for doc in db.get_all(refs, transaction=transaction)}
+        for ref in refs:
+            doc = docs.get(ref.id)
+            if doc is not None and doc.exists and doc.to_dict().get("status") == OPEN:
+                transaction.update(ref, {"status": CANCELLED, "reason": reason, "closed_at": now})
+                cancelled.append(ref.id)
+        return cancelled
+
+    return cancel(db.transaction())
+
+
+def _cancel(user_id: str, order_id: str):
+    """Flip an open order to cancelled. Returns the order. Blocking."""
+    from firebase_admin import firestore
+    db = get_db()
+    ref = db.collection("orders").document(order_id)
+
+    @firestore.transactional
+    def cancel(transaction):
+        doc = ref.get(transaction=transaction)
+        if not doc.exists or doc.to_dict().get("uid") != user_id:
+            raise HTTPException(status_code=404, detail="Order not found")
+        data = doc.to_dict()
+        if data["status"] != OPEN:
+            raise HTTPException(status_code=409, detail=f"Order is already {data['status']}")
+        update = {"status": CANCELLED, "closed_at": datetime.now().isoformat()}
+        transaction.update(ref, update)
+        return {"id": order_id, **data, **update}
+
+    return cancel(db.transaction())
+
+
+def _list(user_id: str, status: str = None):
+    query = get_db().collection("orders").where("uid", "==", user_id)
+    if status:
+        query = query.where("status", "==", status)
+    orders = [{"id": doc.id, **doc.to_dict()} for doc in query.stream()]
+    return sorted(orders, key=lambda order: order["created_at"], reverse=True)
+
+
+class OrderEngine:
+    def __init__(self, hub=quote_hub, batch_size: int = ORDER_FILL_BATCH,
+                 concurrency: int = ORDER_FILL_CONCURRENCY, reload_every: float = ORDER_RELOAD,
+                 max_open: int = ORDER_MAX_OPEN_PER_USER, max_attempts: int = ORDER_MAX_FILL_ATTEMPTS):
+        self.hub = hub
+        self.batch_size = batch_size
+        self.reload_every = reload_every
+        self.max_open = max_open
+        self.max_attempts = max_attempts
+        self.books = {}       # symbol -> OrderBook
+        self.orders = {}      # order id -> RestingOrder, every order on a book
+        self.in_flight = set()  # ids of triggered orders being filled
+        self.pending = {}     # uid -> [(RestingOrder, price)] waiting for the next batch
+        self.flusher = None   # task filling the pending orders
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.task = None
+        # While a reload is reading Firestore: ids of orders put on / taken off the books meanwhile
+        self.added_during_load = None
+        self.removed_during_load = None
+        self.filled = 0
+        self.rejected = 0
+        self.triggered = 0
+        self.retried = 0
+        self.given_up = 0
+        hub.add_listener(self.on_quote)
+
+    async def start(self):
+        """Load the open orders, then keep reloading them in the background if ORDER_RELOAD is set"""
+        try:
+            await self._load()
+        finally:
+            if self.reload_every:
+                self.task = asyncio.create_task(self._reload())
+
+    async def stop(self):
+        for task in (self.task, self.flusher):
+            if task is not None and not task.done():
+                task.cancel()
+
+    async def place(self, user_id: str, symbol: str, side: str, order_type: str, quantity: int,
+                    limit_price: float = None, stop_price: float = None):
+        symbol, side, order_type = symbol.strip().upper(), side.upper(), order_type.lower()
+        validate(symbol, side, order_type, quantity, limit_price, stop_price)
+        order_id = uuid.uuid4().hex
+        data = {
+            "uid": user_id,
+            "symbol": symbol,
+            "side": side,
+            "type": order_type,
+            "quantity": quantity,
+            "limit_price": limit_price,
+            "stop_price": stop_price,
+            "status": OPEN,
+            "created_at": datetime.now().isoformat()
+        }
+        await database.run(_create, order_id, data, self.max_open)
+        self._add(RestingOrder(order_id, data))
+        # A marketable order triggers on the quote we already have instead of waiting for the next one
+        latest = self.hub.latest.get(symbol)
+        if latest and latest.get("price") is not None:
+            self.on_quote(symbol, latest)
+        return {"id": order_id, **data}
+
+    async def cancel(self, user_id: str, order_id: str):
+        order = await database.run(_cancel, user_id, order_id)
+        resting = self.orders.get(order_id)
+        if resting is not None:
+            self._remove(resting)
+        return order
+
+    async def list(self, user_id: str, status: str = None):
+        return await database.run(_list, user_id, status)
+
+    def on_quote(self, symbol: str, message: dict):
+        # Called by the quote hub for every update
+        price = message.get("price")
+        book = self.books.get(symbol)
+        if price is None or book is None or not book.live:
+            return
+        started = time.perf_counter()
+        fills, converted = book.trigger(price)
+        for order in fills:
+            del self.orders[order.id]
+            self._note_removed(order.id)
+            self.in_flight.add(order.id)
+            self.pending.setdefault(order.uid, []).append((order, price))
+        for order in converted:
+            # Remember the stop triggered, so a restart puts the order back as a limit order
+            asyncio.ensure_future(self._mark_stop_triggered(order))
+        if fills:
+            self.triggered += len(fills)
+            metrics.observe("order_trigger_ms", (time.perf_counter() - started) * 1000)
+            if self.flusher is None or self.flusher.done():
+                self.flusher = asyncio.ensure_future(self._flush())
+        if not book.live:
+            self._drop_book(symbol)
+
+    def stats(self):
+        return {
+            "open_orders": len(self.orders),
+            "symbols": len(self.books),
+            "pending": sum(len(fills) for fills in self.pending.values()),
+            "in_flight": len(self.in_flight),
+            "triggered": self.triggered,
+            "filled": self.filled,
+            "rejected": self.rejected,
+            "retried": self.retried,
+            "given_up": self.given_up
+        }
+
+    def _add(self, order: RestingOrder):
+        book = self.books.get(order.symbol)
+        if book is None:
+            book = self.books[order.symbol] = OrderBook()
+            # Keep the hub polling every symbol with open orders
+            self.hub.watch([order.symbol])
+        book.add(order)
+        self.orders[order.id] = order
+        if self.added_during_load is not None:
+            self.added_during_load.add(order.id)
+
+    def _note_removed(self, order_id: str):
+        if self.removed_during_load is not None:
+            self.removed_during_load.add(order_id)
+            self.added_during_load.discard(order_id)
+
+    def _remove(self, order: RestingOrder):
+        del self.orders[order.id]
+        self._note_removed(order.id)
+        book = self.books[order.symbol]
+        book.discard(order)
+        if not book.live:
+            self._drop_book(order.symbol)
+
+    def _drop_book(self, symbol: str):
+        del self.books[symbol]
+        self.hub.unwatch([symbol])
+
+    async def _flush(self):
+        # Keep filling until nothing is waiting; orders triggered meanwhile join the next round
+        while self.pending:
+            pending, self.pending = self.pending, {}
+            batches = [
+                (uid, fills[start:start + self.batch_size])
+                for uid, fills in pending.items()
+                for start in range(0, len(fills), self.batch_size)
+            ]
+            await asyncio.gather(*(self._fill(uid, fills) for uid, fills in batches))
+
+    async def _fill(self, uid: str, fills):
+        async with self.semaphore:
+            try:
+                transactions, outcomes = await database.run(_fill_resting, uid, fills, timeout=None)
+            except Exception as e:
+                await self._failed(uid, [order for order, _ in fills], e)
+                return
+        for order, _ in fills:
+            self.in_flight.discard(order.id)
+        self.filled += sum(1 for status in outcomes.values() if status == FILLED)
+        self.rejected += sum(1 for status in outcomes.values() if status == REJECTED)
+        if transactions:
+            notify_trade(uid, transactions)
+
+    async def _failed(self, uid: str, orders: list, error: Exception):
+        # Nothing was committed. After a transient error the orders go back on the book so the
+        # next quote triggers them again; otherwise (or once they have failed too often) they are cancelled.
+        for order in orders:
+            self.in_flight.discard(order.id)
+        if isinstance(error, TRANSIENT_ERRORS):
+            logger.warning("Error filling %d orders for %s, will retry: %s", len(orders), uid, error)
+            retry, give_up = [], []
+            for order in orders:
+                order.failures += 1
+                (retry if order.failures < self.max_attempts else give_up).append(order)
+            reason = f"Could not be filled after {self.max_attempts} attempts: {error}"
+        else:
+            logger.error("Error filling %d orders for %s: %r", len(orders), uid, error, exc_info=error)
+            retry, give_up = [], orders
+            reason = f"Could not be filled: {getattr(error, 'detail', None) or error}"
+        for order in retry:
+            order.active = True
+            self._add(order)
+        self.retried += len(retry)
+        if not give_up:
+            return
+        try:
+            cancelled = await database.run(_give_up, [order.id for order in give_up], reason)
+        except Exception as e:
+            # They stay open in Firestore (but off the books) until the next reload or restart
+            logger.error("Error cancelling %d failed orders for %s: %s", len(give_up), uid, e)
+            return
+        self.given_up += len(cancelled)
+        if cancelled:
+            logger.warning("Cancelled orders %s of %s: %s", ", ".join(cancelled), uid, reason)
+
+    async def _mark_stop_triggered(self, order: RestingOrder):
+        try:
+            await database.run(get_db().collection("orders").document(order.id).update, {"stop_triggered": True})
+        except Exception as e:
+            logger.warning("Error updating order %s: %s", order.id, e)
+
+    async def _reload(self):
+        while True:
+            await asyncio.sleep(self.reload_every)
+            try:
+                await self._load()
+            except Exception as e:
+                logger.error("Error loading open orders: %s", e)
+
+    async def _load(self):
+        started = time.monotonic()
+        self.added_during_load, self.removed_during_load = set(), set()
+        try:
+            rows = await database.run(_read_open_orders, timeout=None)
+        finally:
+            added, removed = self.added_during_load, self.removed_during_load
+            self.added_during_load = self.removed_during_load = None
+        # Rebuild every book on the side, then swap them in. Orders being filled right now
+        # stay out; the fill decides what happens to them. So do orders that triggered or were
+        # cancelled while we were reading, and orders placed (or put back) meanwhile are kept.
+        books, orders = {}, {}
+        for order_id, data in rows:
+            if order_id in self.in_flight or order_id in removed:
+                continue
+            order = RestingOrder(order_id, data)
+            books.setdefault(order.symbol, OrderBook()).add(order)
+            orders[order_id] = order
+        for order_id in added:
+            order = self.orders.get(order_id)
+            if order is not None and order_id not in orders:
+                books.setdefault(order.symbol, OrderBook()).add(order)
+                orders[order_id] = order
+        old_symbols = set(self.books)
+        self.books, self.orders = books, orders
+        self.hub.watch(set(books) - old_symbols)
+        self.hub.unwatch(old_symbols - set(books))
+        logger.info("Loaded %d open orders on %d symbols in %.2fs", len(orders), len(books), time.monotonic() - started)
+
+
+# One engine per worker, loaded when the app starts (see services/startup_service.py)
+order_engine = OrderEngine()
+metrics.add_collector("orders", order_engine.stats)
@@ -0,0 +1,222 @@
+import asyncio
+import heapq
+import logging
+import math
+import statistics
+import time
+from datetime import datetime, timezone
+from config.settings import QUOTE_POLL_BUDGET, QUOTE_POLL_MIN_INTERVAL, QUOTE_POLL_CLOSED_INTERVAL
+from services.market_hours import session_for
+
+logger = logging.getLogger(__name__)
+
+# Decides when the quote hub polls each symbol.
+#
+# Every symbol the hub needs gets a next-poll time in one heap, and one loop polls whatever is due.
+# How often depends on:
+#   - its market: while the exchange is closed (nights, weekends, holidays) a symbol is polled once
+#     right after the close, then every QUOTE_POLL_CLOSED_INTERVAL seconds and again at the open
+#   - demand: a symbol watched by one client is polled every base interval (6 seconds), and
+#     faster the more clients watch it (each doubling of watchers adds one base rate)
+#   - volatility: symbols moving more than the median (per second, measured between polls)
+#     are polled up to twice as fast, quiet ones down to half as fast
+# never faster than QUOTE_POLL_MIN_INTERVAL. All open symbols share QUOTE_POLL_BUDGET requests per
+# second: when their rates add up to more, every rate is scaled down by the same factor, so the
+# budget is split in proportion to how much each symbol is watched. A token bucket holds the loop
+# to the budget even when many symbols come due at once (e.g. at the open).
+# fetch must go to upstream every time (the hub's skips the quote cache): every poll is charged to
+# the budget, and the volatility estimate needs a new price from each one.
+
+# Seconds between recomputing every symbol's interval (adding or dropping a symbol triggers it right away)
+REBALANCE_INTERVAL = 5.0
+
+# Weight of a new squared return in the running volatility estimate
+VOLATILITY_ALPHA = 0.2
+
+# Bounds of the volatility factor applied to a symbol's rate
+MIN_VOLATILITY_FACTOR = 0.5
+MAX_VOLATILITY_FACTOR = 2.0
+
+
+class SymbolState:
+    __slots__ = ("symbol", "session", "interval", "due", "last_poll", "last_price", "volatility",
+                 "polled_open", "in_flight")
+
+    def __init__(self, symbol: str, now: float):
+        self.symbol = symbol
+        self.session = session_for(symbol)
+        self.interval = None     # seconds between polls while the market is open (set by _rebalance)
+        self.due = now           # next poll (monotonic); a new symbol is polled right away
+        self.last_poll = None
+        self.last_price = None
+        self.volatility = None   # running mean of squared log return per second
+        self.polled_open = False  # whether the last poll happened while the market was open
+        self.in_flight = False
+
+
+class PollScheduler:
+    def __init__(self, fetch, publish, demand, base_interval: float, budget: float = QUOTE_POLL_BUDGET,
+                 min_interval: float = QUOTE_POLL_MIN_INTERVAL, closed_interval: float = QUOTE_POLL_CLOSED_INTERVAL):
+        self.fetch = fetch        # async fetch(symbol) -> quote message
+        self.publish = publish    # publish(symbol, message)
+        self.demand = demand      # demand(symbol) -> number of clients/services watching it
+        self.base_interval = base_interval
+        self.budget = budget
+        self.min_interval = min_interval
+        self.closed_interval = closed_interval
+        self.symbols = {}         # symbol -> SymbolState
+        self.heap = []            # (due, symbol); entries whose due no longer matches the state are skipped
+        self.tokens = budget
+        self.refilled_at = time.monotonic()
+        self.next_rebalance = 0.0
+        self.open_symbols = 0
+        self.wakeup = None
+        self.task = None
+        self.polls = 0
+        self.errors = 0
+
+    def __len__(self):
+        return len(self.symbols)
+
+    def __contains__(self, symbol: str):
+        return symbol in self.symbols
+
+    def add(self, symbol: str):
+        if symbol in self.symbols:
+            return
+        state = self.symbols[symbol] = SymbolState(symbol, time.monotonic())
+        heapq.heappush(self.heap, (state.due, symbol))
+        self.changed()
+
+    def remove(self, symbol: str):
+        # Its heap entries are skipped when they come up
+        if self.symbols.pop(symbol, None) is not None:
+            self.changed()
+
+    def changed(self):
+        """Recompute the intervals now instead of at the next rebalance"""
+        self.next_rebalance = 0.0
+        self._ensure_running()
+        self.wakeup.set()
+
+    def stats(self):
+        rates = [1 / state.interval for state in self.symbols.values() if state.interval]
+        return {
+            "symbols": len(self.symbols),
+            "open_symbols": self.open_symbols,
+            "budget_per_second": self.budget,
+            "planned_per_second": round(sum(rates), 3),
+            "fastest_interval": round(1 / max(rates), 2) if rates else None,
+            "slowest_interval": round(1 / min(rates), 2) if rates else None,
+            "polls": self.polls,
+            "errors": self.errors
+        }
+
+    def _ensure_running(self):
+        loop = asyncio.get_running_loop()
+        if self.task is None or self.task.done() or self.task.get_loop() is not loop:
+            self.wakeup = asyncio.Event()
+            self.task = loop.create_task(self._run())
+
+    def _rebalance(self, now: float):
+        wall = datetime.now(timezone.utc)
+        open_states = [state for state in self.symbols.values() if state.session.is_open(wall)]
+        for state in self.symbols.values():
+            state.interval = None
+        self.open_symbols = len(open_states)
+
+        known = [state.volatility for state in open_states if state.volatility]
+        typical = statistics.median(known) if known else None
+        rates = {}
+        for state in open_states:
+            weight = 1 + math.log2(max(self.demand(state.symbol), 1))
+            if typical and state.volatility:
+                weight *= min(max(math.sqrt(state.volatility / typical), MIN_VOLATILITY_FACTOR), MAX_VOLATILITY_FACTOR)
+            rates[state] = min(weight / self.base_interval, 1 / self.min_interval)
+        total = sum(rates.values())
+        scale = min(1.0, self.budget / total) if total else 1.0
+        for state, rate in rates.items():
+            state.interval = 1 / (rate * scale)
+
+        # Move polls that are now due earlier (or later) than planned
+        for state in self.symbols.values():
+            if state.last_poll is not None and not state.in_flight:
+                self._schedule(state, now, wall)
+        self.next_rebalance = now + REBALANCE_INTERVAL
+
+    def _schedule(self, state: SymbolState, now: float, wall: datetime):
+        if state.session.is_open(wall):
+            due = state.last_poll + (state.interval or self.base_interval)
+            if state.interval is None:
+                # The market just opened: give it its share of the budget
+                self.next_rebalance = 0.0
+        elif state.polled_open:
+            # One more poll right after the close picks up the closing price
+            due = now
+        else:
+            opens = state.session.next_open(wall)
+            until_open = (opens - wall).total_seconds() if opens is not None else self.closed_interval
+            due = min(state.last_poll + self.closed_interval, now + until_open)
+        if due != state.due:
+            state.due = due
+            heapq.heappush(self.heap, (due, state.symbol))
+
+    async def _run(self):
+        while self.symbols:
+            now = time.monotonic()
+            if now >= self.next_rebalance:
+                self._rebalance(now)
+            # Bursts of up to one second's budget (and at least one request)
+            self.tokens = min(max(self.budget, 1.0), self.tokens + (now - self.refilled_at) * self.budget)
+            self.refilled_at = now
+            while self.heap and self.heap[0][0] <= now and self.tokens >= 1:
+                due, symbol = heapq.heappop(self.heap)
+                state = self.symbols.get(symbol)
+                if state is None or state.due != due or state.in_flight:
+                    continue
+                self.tokens -= 1
+                state.in_flight = True
+                state.due = None
+                asyncio.create_task(self._poll(state))
+
+            timeout = self.next_rebalance - now
+            if self.heap:
+                wait = self.heap[0][0] - now
+                if self.tokens < 1:
+                    wait = max(wait, (1 - self.tokens) / self.budget)
+                timeout = min(timeout, wait)
+            self.wakeup.clear()
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), max(timeout, 0.0))
+            except asyncio.TimeoutError:
+                pass
+
+    async def _poll(self, state: SymbolState):
+        try:
+            message = await self.fetch(state.symbol)
+        except Exception as e:
+            self.errors += 1
+            logger.warning("Error polling %s: %s", state.symbol, e)
+            message = None
+        now = time.monotonic()
+        wall = datetime.now(timezone.utc)
+        is_open = state.session.is_open(wall)
+        price = message.get("price") if message else None
+        if price and state.last_price and is_open and state.polled_open:
+            # Squared log return per second since the last poll
+            sample = math.log(price / state.last_price) ** 2 / max(now - state.last_poll, 1e-3)
+            state.volatility = sample if state.volatility is None else \
+                (1 - VOLATILITY_ALPHA) * state.volatility + VOLATILITY_ALPHA * sample
+        if price:
+            state.last_price = price
+        state.last_poll = now
+        state.polled_open = is_open
+        state.in_flight = False
+        self.polls += 1
+        if self.symbols.get(state.symbol) is not state:
+            # Nobody needs this symbol any more
+            return
+        if message is not None:
+            self.publish(state.symbol, message)
+        self._schedule(state, now, wall)
+        self.wakeup.set()
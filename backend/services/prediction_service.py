@@ -0,0 +1,352 @@
+import asyncio
+import json
+import logging
+import os
+import shutil
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+import numpy as np
+from config.settings import (
+    MODEL_DIR, MODEL_CACHE_SIZE, MODEL_KEEP_VERSIONS, MODEL_RETRAIN_AFTER, MODEL_DISK_RECHECK,
+    PREDICTION_WORKERS, PREDICTION_TRAINING_SYMBOLS
+)
+from services.feature_service import feature_store, forward_returns, FEATURES, FEATURE_VERSION
+from services.process_pool import LazyProcessPool
+from services.upstream import market_data
+from services.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Price predictions with scikit-learn.
+#
+# A model predicts the log return of a symbol over the next `horizon` trading days from the
+# features in services/feature_service.py. One model is trained on the pooled history of many
+# symbols (PREDICTION_TRAINING_SYMBOLS) and can then score any symbol.
+#
+# Training runs in a background process pool, and every trained model is saved as a new version:
+#   data/models/ridge-5d/v0003/model.joblib
+#   data/models/ridge-5d/v0003/meta.json     <- features, training range, validation scores
+# The newest versions are also kept in memory (least recently used evicted), so predictions
+# are served by whatever version is already there and never wait for a training run.
+# A model older than MODEL_RETRAIN_AFTER is retrained in the background while the old
+# version keeps answering. Scoring a batch of symbols is one predict() call over a matrix
+# with one row (the latest features) per symbol, run off the event loop.
+# Every worker checks the model folder again every MODEL_DISK_RECHECK seconds, so a version
+# trained by another worker is picked up without a restart.
+#
+# scikit-learn is only imported when a model is trained or loaded, so the rest of the API
+# works without it.
+
+# Model kinds: name -> (estimator, parameters)
+MODEL_KINDS = {
+    "ridge": ("sklearn.linear_model.Ridge", {"alpha": 1.0}),
+    "forest": ("sklearn.ensemble.RandomForestRegressor", {"n_estimators": 200, "max_depth": 8, "min_samples_leaf": 50, "n_jobs": 1}),
+    "gbm": ("sklearn.ensemble.HistGradientBoostingRegressor", {"max_iter": 200, "learning_rate": 0.05, "max_leaf_nodes": 31}),
+}
+
+# Horizons (trading days) a model can be trained for
+HORIZONS = (1, 5, 21)
+
+# Share of the most recent dates held out to score a new model before it is saved
+VALIDATION_SHARE = 0.2
+
+# After a failed training run, wait this many seconds before a prediction request starts another
+RETRY_AFTER_FAILURE = 60
+
+
+class ModelNotReady(Exception):
+    """No trained version of the model exists yet (a training run has been started)"""
+
+
+def model_name(kind: str, horizon: int):
+    if kind not in MODEL_KINDS:
+        raise ValueError(f"Unknown model {kind}. Use one of {sorted(MODEL_KINDS)}")
+    if horizon not in HORIZONS:
+        raise ValueError(f"Invalid horizon {horizon}. Use one of {list(HORIZONS)}")
+    return f"{kind}-{horizon}d"
+
+
+def _estimator(kind: str):
+    # Lazy import: scikit-learn is only needed by the processes that train models
+    import importlib
+    from sklearn.pipeline import make_pipeline
+    from sklearn.preprocessing import StandardScaler
+    path, params = MODEL_KINDS[kind]
+    module, name = path.rsplit(".", 1)
+    estimator = getattr(importlib.import_module(module), name)(**params)
+    return make_pipeline(StandardScaler(), estimator)
+
+
+def _fit(task):
+    """
+    Runs inside a worker process. Scores the model on the most recent VALIDATION_SHARE of
+    dates after training on the rest, then refits on everything.
+    Returns (fitted model, validation scores).
+    """
+    features, target, dates = task["features"], task["target"], task["dates"]
+    cutoff = np.quantile(dates, 1 - VALIDATION_SHARE)
+    train, holdout = dates < cutoff, dates >= cutoff
+
+    model = _estimator(task["kind"])
+    model.fit(features[train], target[train])
+    predicted = model.predict(features[holdout])
+    actual = target[holdout]
+    residual = ((actual - predicted) ** 2).sum()
+    total = ((actual - actual.mean()) ** 2).sum()
+    scores = {
+        "r2": float(1 - residual / total) if total else None,
+        # How often the predicted direction was right
+        "hit_rate": float((np.sign(predicted) == np.sign(actual)).mean()) if len(actual) else None,
+        "train_rows": int(train.sum()),
+        "validation_rows": int(holdout.sum())
+    }
+
+    model = _estimator(task["kind"])
+    model.fit(features, target)
+    return model, scores
+
+
+_pool = LazyProcessPool(PREDICTION_WORKERS)
+
+
+def _training_set(symbols, horizon: int):
+    """Pool every symbol's (cached) feature rows with a known target into one matrix. Blocking."""
+    features, targets, dates, used = [], [], [], []
+    for symbol in symbols:
+        try:
+            symbol_dates, closes, symbol_features = feature_store.get(symbol)
+        except Exception as e:
+            logger.warning("Skipping %s for training: %s", symbol, e)
+            continue
+        target = forward_returns(closes, horizon)
+        complete = ~np.isnan(symbol_features).any(axis=1) & ~np.isnan(target)
+        if complete.any():
+            features.append(symbol_features[complete])
+            targets.append(target[complete])
+            dates.append(symbol_dates[complete])
+            used.append(symbol.upper())
+    if not features:
+        raise ValueError("No training data: none of the training symbols has enough history")
+    return np.concatenate(features), np.concatenate(targets), np.concatenate(dates), used
+
+
+def _versions(name: str):
+    try:
+        entries = os.listdir(os.path.join(MODEL_DIR, name))
+    except FileNotFoundError:
+        return []
+    return sorted(int(entry[1:]) for entry in entries if entry.startswith("v") and entry[1:].isdigit())
+
+
+def _version_folder(name: str, version: int):
+    return os.path.join(MODEL_DIR, name, f"v{version:04d}")
+
+
+def _save(name: str, model, meta: dict):
+    """Write a new version and return its number. Blocking."""
+    import joblib
+    versions = _versions(name)
+    version = versions[-1] + 1 if versions else 1
+    folder = _version_folder(name, version)
+    # Write into a temporary folder and rename it, so a half-written version is never picked up
+    tmp_folder = folder + ".tmp"
+    os.makedirs(tmp_folder, exist_ok=True)
+    joblib.dump(model, os.path.join(tmp_folder, "model.joblib"))
+    with open(os.path.join(tmp_folder, "meta.json"), "w") as f:
+        json.dump({**meta, "version": version}, f, indent=2)
+    os.replace(tmp_folder, folder)
+    # Only keep the newest few versions on disk
+    for old in versions[:max(0, len(versions) + 1 - MODEL_KEEP_VERSIONS)]:
+        shutil.rmtree(_version_folder(name, old), ignore_errors=True)
+    return version
+
+
+def _load_latest(name: str, newer_than: int = 0):
+    """(model, meta) of the newest usable version on disk above newer_than, or None. Blocking."""
+    import joblib
+    for version in reversed(_versions(name)):
+        if version <= newer_than:
+            break
+        folder = _version_folder(name, version)
+        try:
+            with open(os.path.join(folder, "meta.json")) as f:
+                meta = json.load(f)
+            if meta.get("feature_version") != FEATURE_VERSION:
+                continue
+            return joblib.load(os.path.join(folder, "model.joblib")), meta
+        except (FileNotFoundError, ValueError) as e:
+            logger.warning("Skipping model %s v%s: %s", name, version, e)
+    return None
+
+
+class ModelRegistry:
+    """
+    Newest version of every model, in memory (LRU) and on disk, plus the background
+    training runs. Used from the event loop only.
+    """
+
+    def __init__(self, max_models: int = MODEL_CACHE_SIZE):
+        self.max_models = max_models
+        self.models = OrderedDict()  # name -> (model, meta)
+        self.training = {}           # name -> asyncio.Task of the running training
+        self.failures = {}           # name -> (error, time) of the last failed training run
+        self.checked_disk = {}       # name -> when we last looked on disk for a newer version (monotonic)
+
+    async def latest(self, name: str):
+        """(model, meta) of the newest version, or None if the model has never been trained"""
+        entry = self.models.get(name)
+        now = time.monotonic()
+        if now - self.checked_disk.get(name, float("-inf")) > MODEL_DISK_RECHECK:
+            self.checked_disk[name] = now
+            newer = await asyncio.to_thread(_load_latest, name, entry[1]["version"] if entry else 0)
+            if newer is not None:
+                self._remember(name, *newer)
+            entry = self.models.get(name)
+        if entry is not None:
+            self.models.move_to_end(name)
+        return entry
+
+    def train(self, kind: str, horizon: int, symbols=None):
+        """Start a background training run (or return the one already running)"""
+        name = model_name(kind, horizon)
+        task = self.training.get(name)
+        if task is None:
+            task = asyncio.ensure_future(self._train(name, kind, horizon, symbols or PREDICTION_TRAINING_SYMBOLS))
+            self.training[name] = task
+            task.add_done_callback(lambda done: self._finished(name, done))
+        return task
+
+    def _retrain(self, kind: str, horizon: int, name: str):
+        # Background retraining triggered by a prediction request (not too often after a failure)
+        failure = self.failures.get(name)
+        if failure is None or time.time() - failure[1] > RETRY_AFTER_FAILURE:
+            self.train(kind, horizon)
+
+    async def predict(self, symbols, kind: str = "ridge", horizon: int = 5):
+        """
+        Score many symbols with one model. Returns {"model": ..., "predictions": {...}, "errors": {...}}.
+        Raises ModelNotReady (after starting a training run) if no version exists yet.
+        """
+        name = model_name(kind, horizon)
+        entry = await self.latest(name)
+        if entry is None:
+            self._retrain(kind, horizon, name)
+            if name in self.failures and name not in self.training:
+                raise ModelNotReady(f"Model {name} is not trained yet; the last training run failed: {self.failures[name][0]}")
+            raise ModelNotReady(f"Model {name} is not trained yet; training has started, try again shortly")
+        model, meta = entry
+        if time.time() - meta["trained_at"] > MODEL_RETRAIN_AFTER:
+            self._retrain(kind, horizon, name)
+
+        symbols = list(dict.fromkeys(symbol.strip().upper() for symbol in symbols if symbol.strip()))
+        features = await asyncio.gather(*(market_data.run(feature_store.get, symbol) for symbol in symbols),
+                                        return_exceptions=True)
+
+        rows, scored, errors = [], [], {}
+        for symbol, result in zip(symbols, features):
+            if isinstance(result, Exception):
+                errors[symbol] = str(result)
+                continue
+            dates, closes, symbol_features = result
+            if not len(dates) or np.isnan(symbol_features[-1]).any():
+                errors[symbol] = "Not enough price history"
+                continue
+            rows.append(symbol_features[-1])
+            scored.append((symbol, int(dates[-1]), float(closes[-1])))
+
+        predictions = {}
+        if rows:
+            # One vectorized call for the whole batch
+            with metrics.timer("prediction_ms", model=name):
+                returns = await asyncio.to_thread(model.predict, np.vstack(rows))
+            for (symbol, as_of, close), log_return in zip(scored, returns.tolist()):
+                predictions[symbol] = {
+                    "as_of": datetime.fromtimestamp(as_of, tz=timezone.utc).isoformat(),
+                    "close": close,
+                    "expected_return": float(np.expm1(log_return)),
+                    "predicted_price": close * float(np.exp(log_return)),
+                    "direction": "up" if log_return > 0 else "down"
+                }
+        return {
+            "model": name,
+            "version": meta["version"],
+            "trained_at": meta["trained_at"],
+            "horizon_days": horizon,
+            "training": name in self.training,
+            "predictions": predictions,
+            "errors": errors
+        }
+
+    def status(self):
+        names = set(self.models) | set(self.training) | set(self.failures)
+        if os.path.isdir(MODEL_DIR):
+            names |= {name for name in os.listdir(MODEL_DIR) if _versions(name)}
+        result = {}
+        for name in sorted(names):
+            meta = self.models[name][1] if name in self.models else None
+            result[name] = {
+                "loaded": meta is not None,
+                "version": meta["version"] if meta else None,
+                "trained_at": meta["trained_at"] if meta else None,
+                "scores": meta["scores"] if meta else None,
+                "versions_on_disk": _versions(name),
+                "training": name in self.training,
+                "last_error": self.failures[name][0] if name in self.failures else None
+            }
+        return result
+
+    def stats(self):
+        return {"loaded": len(self.models), "training": len(self.training), "failed": len(self.failures)}
+
+    async def _train(self, name: str, kind: str, horizon: int, symbols):
+        started = time.monotonic()
+        try:
+            # Features come from the shared cache; only the fit itself goes to the process pool
+            features, target, dates, used = await market_data.run(_training_set, symbols, horizon, timeout=None)
+            task = {"kind": kind, "features": features, "target": target, "dates": dates}
+            model, scores = await asyncio.get_running_loop().run_in_executor(_pool.get(), _fit, task)
+            meta = {
+                "name": name,
+                "kind": kind,
+                "horizon_days": horizon,
+                "features": FEATURES,
+                "feature_version": FEATURE_VERSION,
+                "symbols": used,
+                "train_start": datetime.fromtimestamp(int(dates.min()), tz=timezone.utc).date().isoformat(),
+                "train_end": datetime.fromtimestamp(int(dates.max()), tz=timezone.utc).date().isoformat(),
+                "trained_at": time.time(),
+                "training_seconds": round(time.monotonic() - started, 3),
+                "scores": scores
+            }
+            meta["version"] = await asyncio.to_thread(_save, name, model, meta)
+            self._remember(name, model, meta)
+            self.failures.pop(name, None)
+            logger.info("Trained %s v%s in %.1fs: %s", name, meta["version"], meta["training_seconds"], scores)
+            metrics.observe("model_training_ms", (time.monotonic() - started) * 1000, model=name, outcome="ok")
+            return meta
+        except Exception as e:
+            self.failures[name] = (str(e), time.time())
+            logger.error("Training %s failed: %s", name, e)
+            metrics.observe("model_training_ms", (time.monotonic() - started) * 1000, model=name, outcome="error")
+            raise
+
+    def _finished(self, name: str, task):
+        self.training.pop(name, None)
+        # Failures are logged and kept in self.failures; mark the exception as retrieved
+        if not task.cancelled():
+            task.exception()
+
+    def _remember(self, name: str, model, meta: dict):
+        self.models[name] = (model, meta)
+        self.models.move_to_end(name)
+        while len(self.models) > self.max_models:
+            evicted, _ = self.models.popitem(last=False)
+            # Still on disk, so look there again next time
+            self.checked_disk.pop(evicted, None)
+
+
+# One registry shared by the whole app
+model_registry = ModelRegistry()
+metrics.add_collector("models", model_registry.stats)
+metrics.add_collector("features", feature_store.stats)
@@ -0,0 +1,33 @@
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+# Worker process pools for the CPU heavy services (Monte Carlo paths, sweep cells, model training).
+#
+# Workers are started with "forkserver" (or "spawn" where that isn't available), never "fork".
+# Forking copies the whole API process, including locks that other threads (the upstream pools,
+# the Firebase client, the quote cache...) happened to hold at that moment, and a worker that
+# touches one of them hangs forever. A forkserver worker starts from a clean process that only
+# imports the module its task function lives in, so task functions must be top-level functions
+# and their arguments must pickle.
+
+
+def _start_method():
+    return "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+
+
+class LazyProcessPool:
+    """A ProcessPoolExecutor created on first use, so importing a service doesn't start processes"""
+
+    def __init__(self, max_workers: int):
+        self.max_workers = max_workers
+        self.pool = None
+        self.lock = threading.Lock()
+
+    def get(self):
+        with self.lock:
+            if self.pool is None:
+                self.pool = ProcessPoolExecutor(max_workers=self.max_workers,
+                                                mp_context=multiprocessing.get_context(_start_method()))
+            return self.pool
+
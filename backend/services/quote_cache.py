@@ -0,0 +1,182 @@
+import threading
+import time
+from collections import OrderedDict
+from config.settings import QUOTE_PRICE_TTL, QUOTE_PROFILE_TTL, QUOTE_CACHE_MAX_ENTRIES
+from services.market_provider import get_provider
+from services.metrics import metrics
+
+# In-process cache for quote data (the dict returned by yf.Ticker(symbol).info, fetched through
+# the market data provider in services/market_provider.py).
+# It is shared by the quote endpoints, /search-stock and the websocket quote hub, so a burst
+# of requests for the same ticker only hits Yahoo once.
+#
+# Fields are split into classes with their own TTL:
+#   - "profile": things that almost never change (name, sector, industry...) -> hours
+#   - "price":   everything else (prices, volume, market cap...) -> seconds
+# If several threads miss on the same symbol at the same time, only one of them
+# calls Yahoo and the others wait for its result ("single-flight").
+
+PROFILE_FIELDS = {
+    "symbol", "shortName", "longName", "sector", "industry", "exchange",
+    "quoteType", "currency", "country", "website", "longBusinessSummary"
+}
+
+
+def split_fields(info: dict):
+    # Split a full info dict into {"price": {...}, "profile": {...}}
+    profile = {key: value for key, value in info.items() if key in PROFILE_FIELDS}
+    price = {key: value for key, value in info.items() if key not in PROFILE_FIELDS}
+    return {"price": price, "profile": profile}
+
+
+class _Flight:
+    """A fetch that is currently in progress. Other callers wait on it instead of fetching again."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class QuoteCache:
+    def __init__(self, fetch, ttls: dict, max_entries: int):
+        self.fetch = fetch              # function(symbol) -> info dict
+        self.ttls = ttls                # field class -> seconds
+        self.max_entries = max_entries
+        # symbol -> {field class: (fields dict, fetched_at)}, ordered from least to most recently used
+        self.entries = OrderedDict()
+        self.inflight = {}              # symbol -> _Flight
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+
+    def get(self, symbol: str, field_classes=("price",)):
+        """
+        Return the cached info for a symbol, fetching it from upstream if any of the
+        requested field classes is missing or stale.
+        """
+        return self._get(symbol.upper(), field_classes, use_cache=True)
+
+    def refresh(self, symbol: str, field_classes=("price",)):
+        """
+        Fetch a symbol from upstream even if the cached copy is still fresh, and cache the result.
+        For pollers that need a new price every time: a cached one would just repeat the last.
+        """
+        return self._get(symbol.upper(), field_classes, use_cache=False)
+
+    def _get(self, symbol, field_classes, use_cache: bool):
+        with self.lock:
+            if use_cache:
+                cached = self._lookup(symbol, field_classes)
+                if cached is not None:
+                    self.hits += 1
+                    return cached
+
+            flight = self.inflight.get(symbol)
+            if flight is not None:
+                # Somebody is already fetching this symbol, wait for them
+                self.coalesced += 1
+                leader = False
+            else:
+                self.misses += 1
+                flight = _Flight()
+                self.inflight[symbol] = flight
+                leader = True
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return self._merge(flight.result, field_classes)
+
+        # We are the leader: call upstream outside the lock so other symbols aren't blocked
+        try:
+            info = self.fetch(symbol)
+            flight.result = split_fields(info or {})
+            self.put(symbol, flight.result)
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self.lock:
+                self.inflight.pop(symbol, None)
+            flight.done.set()
+
+        return self._merge(flight.result, field_classes)
+
+    def put(self, symbol: str, classes: dict):
+        # Store freshly fetched field classes for a symbol
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.setdefault(symbol, {})
+            for field_class, fields in classes.items():
+                entry[field_class] = (fields, now)
+            self.entries.move_to_end(symbol)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, symbol: str):
+        with self.lock:
+            self.entries.pop(symbol.upper(), None)
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses + self.coalesced
+            return {
+                "entries": len(self.entries),
+                "max_entries": self.max_entries,
+                "ttls": dict(self.ttls),
+                "hits": self.hits,
+                "misses": self.misses,
+                "coalesced": self.coalesced,
+                "evictions": self.evictions,
+                "hit_ratio": (self.hits / lookups) if lookups else None
+            }
+
+    def _lookup(self, symbol, field_classes):
+        # Must be called with the lock held. Returns None if anything requested is missing or stale.
+        entry = self.entries.get(symbol)
+        if entry is None:
+            return None
+        now = time.monotonic()
+        for field_class in field_classes:
+            cached = entry.get(field_class)
+            if cached is None or now - cached[1] > self.ttls[field_class]:
+                return None
+        self.entries.move_to_end(symbol)
+        return self._merge({field_class: entry[field_class][0] for field_class in field_classes}, field_classes)
+
+    @staticmethod
+    def _merge(classes, field_classes):
+        info = {}
+        for field_class in field_classes:
+            info.update(classes.get(field_class, {}))
+        return info
+
+
+def _fetch_info(symbol: str):
+    provider = get_provider()
+    with metrics.timer("market_data_call_ms", provider=provider.name, call="info"):
+        return provider.get_info(symbol)
+
+
+# One cache shared by the whole app
+quote_cache = QuoteCache(
+    fetch=_fetch_info,
+    ttls={"price": QUOTE_PRICE_TTL, "profile": QUOTE_PROFILE_TTL},
+    max_entries=QUOTE_CACHE_MAX_ENTRIES
+)
+metrics.add_collector("quote_cache", quote_cache.stats)
+
+
+def get_info(symbol: str, field_classes=("price",)):
+    """Cached replacement for yf.Ticker(symbol).info"""
+    return quote_cache.get(symbol, field_classes)
+
+
+def refresh_info(symbol: str, field_classes=("price",)):
+    """Like get_info, but always fetches from upstream (and updates the cache)"""
+    return quote_cache.refresh(symbol, field_classes)
@@ -0,0 +1,236 @@
+import logging
+import asyncio
+from datetime import datetime
+from services.quote_cache import refresh_info
+from services.poll_scheduler import PollScheduler
+from services.upstream import market_data
+from services.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# The quote hub sits between Yahoo Finance and all of our websocket clients.
+# Instead of every connection polling Yahoo on its own, the hub runs ONE poller
+# per distinct symbol and fans each update out to everyone subscribed to it.
+# 500 clients watching AAPL -> 1 upstream call per cycle instead of 500.
+# When each symbol is polled (market hours, demand, the upstream budget) is decided by
+# the poll scheduler, see services/poll_scheduler.py.
+
+# How often (in seconds) a symbol with one watcher is polled while its market is open
+POLL_INTERVAL = 6
+
+# How many unsent updates we keep for a single connection.
+# If a client is too slow to keep up, the oldest updates are dropped
+# so it can never stall the broadcast for everyone else.
+QUEUE_SIZE = 20
+
+
+def fetch_quote(symbol: str):
+    """
+    Blocking call to Yahoo Finance for one symbol. Returns the same message shape the websocket has always sent.
+    It skips the shared quote cache (every poll is a real upstream call, paid for out of the
+    scheduler's budget, and a cached copy would only repeat the last price) but refreshes it
+    so the REST endpoints get the new price for free.
+    """
+    stock_info = refresh_info(symbol)
+    return {
+        "symbol": symbol,                                  # Stock symbol (e.g., AAPL)
+        # Current stock price (ETFs, indices and some ADRs only have regularMarketPrice)
+        "price": stock_info.get("currentPrice") or stock_info.get("regularMarketPrice"),
+        "timestamp": datetime.now().isoformat(),          # When this update was fetched
+        "volume": stock_info.get("regularMarketVolume"),  # Trading volume
+        "dayHigh": stock_info.get("dayHigh"),             # Highest price today
+        "dayLow": stock_info.get("dayLow")                # Lowest price today
+    }
+
+
+class Subscriber:
+    """
+    One connected websocket client, the symbols it is subscribed to,
+    and a bounded queue of updates waiting to be sent to it.
+    """
+
+    def __init__(self, websocket, queue_size: int = QUEUE_SIZE):
+        self.websocket = websocket
+        self.symbols = set()
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        # Number of updates thrown away because the client was too slow
+        self.dropped = 0
+        # QuoteStream once the client switched to the compact protocol (see services/quote_stream.py)
+        self.stream = None
+
+    def offer(self, message: dict):
+        # Never block the broadcaster: if the queue is full we drop the
+        # oldest update to make room for the newest one
+        while True:
+            try:
+                self.queue.put_nowait(message)
+                return
+            except asyncio.QueueFull:
+                try:
+                    self.queue.get_nowait()
+                    self.dropped += 1
+                except asyncio.QueueEmpty:
+                    pass
+
+
+class ConnectionRegistry:
+    """
+    Keeps track of every active connection and which symbols it watches.
+    We keep the mapping both ways so a broadcast for one symbol only
+    touches the subscribers of that symbol.
+    """
+
+    def __init__(self):
+        self.subscribers = {}         # websocket -> Subscriber
+        self.symbol_subscribers = {}  # symbol -> set of Subscribers
+
+    def __len__(self):
+        return len(self.subscribers)
+
+    def add(self, websocket):
+        subscriber = Subscriber(websocket)
+        self.subscribers[websocket] = subscriber
+        return subscriber
+
+    def remove(self, subscriber: Subscriber):
+        # Returns the symbols that no longer have anybody watching them
+        self.subscribers.pop(subscriber.websocket, None)
+        return self.unsubscribe(subscriber, list(subscriber.symbols))
+
+    def subscribe(self, subscriber: Subscriber, symbols):
+        # Returns the symbols that did not have any subscribers before
+        new_symbols = []
+        for symbol in symbols:
+            watchers = self.symbol_subscribers.setdefault(symbol, set())
+            if not watchers:
+                new_symbols.append(symbol)
+            watchers.add(subscriber)
+            subscriber.symbols.add(symbol)
+        return new_symbols
+
+    def unsubscribe(self, subscriber: Subscriber, symbols):
+        # Returns the symbols that no longer have anybody watching them
+        empty_symbols = []
+        for symbol in symbols:
+            subscriber.symbols.discard(symbol)
+            watchers = self.symbol_subscribers.get(symbol)
+            if watchers is None:
+                continue
+            watchers.discard(subscriber)
+            if not watchers:
+                del self.symbol_subscribers[symbol]
+                empty_symbols.append(symbol)
+        return empty_symbols
+
+    def subscribers_for(self, symbol: str):
+        return self.symbol_subscribers.get(symbol, set())
+
+    def symbols(self):
+        return list(self.symbol_subscribers.keys())
+
+
+class QuoteHub:
+    """
+    Polls every subscribed symbol (through one shared scheduler) and broadcasts
+    every update to all of that symbol's subscribers.
+    """
+
+    def __init__(self, registry: ConnectionRegistry = None, poll_interval: float = POLL_INTERVAL):
+        self.registry = registry or ConnectionRegistry()
+        self.pollers = PollScheduler(self._fetch, self.broadcast, self._demand, poll_interval)
+        self.latest = {}   # symbol -> last message we broadcast
+        # Other services (not websockets) that need a symbol kept up to date: symbol -> count
+        self.watchers = {}
+        # Functions called with every update, e.g. to revalue portfolios: listener(symbol, message)
+        self.listeners = []
+
+    def connect(self, websocket):
+        return self.registry.add(websocket)
+
+    def disconnect(self, subscriber: Subscriber):
+        for symbol in self.registry.remove(subscriber):
+            self._stop_poller(symbol)
+
+    def subscribe(self, subscriber: Subscriber, symbols):
+        symbols = [symbol.upper() for symbol in symbols]
+        for symbol in self.registry.subscribe(subscriber, symbols):
+            self._start_poller(symbol)
+        # Give new subscribers the last known quote right away
+        # instead of making them wait for the next poll
+        for symbol in symbols:
+            if symbol in self.latest:
+                subscriber.offer(self.latest[symbol])
+        return symbols
+
+    def unsubscribe(self, subscriber: Subscriber, symbols):
+        symbols = [symbol.upper() for symbol in symbols]
+        for symbol in self.registry.unsubscribe(subscriber, symbols):
+            self._stop_poller(symbol)
+        return symbols
+
+    def watch(self, symbols):
+        # Keep polling these symbols even if no websocket is subscribed to them
+        for symbol in symbols:
+            symbol = symbol.upper()
+            self.watchers[symbol] = self.watchers.get(symbol, 0) + 1
+            self._start_poller(symbol)
+
+    def unwatch(self, symbols):
+        for symbol in symbols:
+            symbol = symbol.upper()
+            count = self.watchers.get(symbol, 0) - 1
+            if count > 0:
+                self.watchers[symbol] = count
+                continue
+            self.watchers.pop(symbol, None)
+            if not self.registry.subscribers_for(symbol):
+                self._stop_poller(symbol)
+
+    def add_listener(self, listener):
+        self.listeners.append(listener)
+
+    def broadcast(self, symbol: str, message: dict):
+        self.latest[symbol] = message
+        for subscriber in list(self.registry.subscribers_for(symbol)):
+            subscriber.offer(message)
+        for listener in self.listeners:
+            try:
+                listener(symbol, message)
+            except Exception as e:
+                logger.exception("Error in quote listener for %s: %s", symbol, e)
+
+    def stats(self):
+        subscribers = list(self.registry.subscribers.values())
+        return {
+            "connections": len(subscribers),
+            "subscribed_symbols": len(self.registry.symbol_subscribers),
+            "watched_symbols": len(self.watchers),
+            "compact_connections": sum(1 for subscriber in subscribers if subscriber.stream is not None),
+            "pollers": len(self.pollers),
+            "queued_messages": sum(subscriber.queue.qsize() for subscriber in subscribers),
+            "dropped_messages": sum(subscriber.dropped for subscriber in subscribers)
+        }
+
+    def _start_poller(self, symbol: str):
+        self.pollers.add(symbol)
+
+    def _stop_poller(self, symbol: str):
+        if self.watchers.get(symbol):
+            # Still needed by another service
+            return
+        self.pollers.remove(symbol)
+        self.latest.pop(symbol, None)
+
+    def _demand(self, symbol: str):
+        # How many clients and services want this symbol, for the scheduler to share the polling budget by
+        return len(self.registry.subscribers_for(symbol)) + self.watchers.get(symbol, 0)
+
+    async def _fetch(self, symbol: str):
+        # yfinance is blocking, so run it on the market data pool to keep the event loop free
+        return await market_data.run(fetch_quote, symbol)
+
+
+# One hub shared by the whole app
+quote_hub = QuoteHub()
+metrics.add_collector("quote_hub", quote_hub.stats)
+metrics.add_collector("quote_polling", quote_hub.pollers.stats)
@@ -0,0 +1,152 @@
+import json
+import time
+from datetime import datetime
+
+# msgpack is optional: only needed for the binary encoding
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+# Compact quote stream for the stock update websockets.
+#
+# By default a connection gets every quote as the full JSON message from the quote hub,
+# every poll, changed or not. A client can switch its connection to the compact protocol with
+#   {"action": "configure", "delta": true, "encoding": "msgpack", "interval": 5,
+#    "fields": ["price"], "heartbeat": 30}
+# after which updates come as frames like
+#   {"type": "quotes", "t": 1700000000000, "q": {"AAPL": {"p": 190.12, "v": 51234567}}}
+#   - the first update for a symbol has every selected field, later ones only the fields that
+#     changed since the last one sent on this connection (clients merge them into what they have)
+#   - a symbol is sent at most once every `interval` seconds; updates in between are merged
+#     into one, so nothing is lost, only coalesced
+#   - nothing is sent when nothing changed; a {"type": "heartbeat", "t": ...} frame goes out
+#     instead once the connection has been quiet for `heartbeat` seconds
+#   - "t" is epoch milliseconds instead of an ISO string
+#   - "encoding": "msgpack" sends binary frames (MessagePack) instead of JSON text
+# Other messages on the connection (indicators) keep their shape, in the chosen encoding.
+# Replies to commands ({"subscribed": ...}, {"error": ...}) are always JSON text.
+
+# Quote field -> key used in compact frames
+FIELDS = {
+    "price": "p",
+    "volume": "v",
+    "dayHigh": "h",
+    "dayLow": "l"
+}
+
+ENCODINGS = ("json", "msgpack")
+
+# Seconds of silence before a heartbeat is sent (clients may ask for another value)
+HEARTBEAT_INTERVAL = 15.0
+
+# Longest update interval and heartbeat a client may ask for
+MAX_INTERVAL = 300.0
+
+
+def _epoch_ms(timestamp):
+    if not timestamp:
+        return int(time.time() * 1000)
+    return int(datetime.fromisoformat(timestamp).timestamp() * 1000)
+
+
+class QuoteStream:
+    """Per-connection state of the compact protocol: what was last sent and what's held back"""
+
+    def __init__(self, fields=None, interval: float = 0.0, encoding: str = "json",
+                 heartbeat: float = HEARTBEAT_INTERVAL):
+        fields = list(fields or FIELDS)
+        unknown = [field for field in fields if field not in FIELDS]
+        if unknown:
+            raise ValueError(f"Unknown fields {unknown}. Use any of {list(FIELDS)}")
+        if encoding not in ENCODINGS:
+            raise ValueError(f"Unknown encoding {encoding}. Use one of {list(ENCODINGS)}")
+        if encoding == "msgpack" and msgpack is None:
+            raise ValueError("The msgpack encoding needs the msgpack package installed")
+        if not 0 <= interval <= MAX_INTERVAL:
+            raise ValueError(f"interval must be between 0 and {MAX_INTERVAL:g} seconds")
+        if not 1 <= heartbeat <= MAX_INTERVAL:
+            raise ValueError(f"heartbeat must be between 1 and {MAX_INTERVAL:g} seconds")
+        self.keys = [(field, FIELDS[field]) for field in fields]
+        self.interval = interval
+        self.encoding = encoding
+        self.heartbeat = heartbeat
+        self.sent = {}      # symbol -> {key: value} last sent
+        self.sent_at = {}   # symbol -> monotonic time of the last update sent
+        self.pending = {}   # symbol -> newest quote not sent yet (waiting for its interval)
+        self.other = []     # non-quote messages to pass through
+        self.last_frame = time.monotonic()
+        self.frames = 0
+        self.skipped = 0    # quotes that had nothing new in them
+
+    def options(self):
+        return {
+            "delta": True,
+            "fields": [field for field, _ in self.keys],
+            "interval": self.interval,
+            "encoding": self.encoding,
+            "heartbeat": self.heartbeat
+        }
+
+    def add(self, message: dict):
+        if "type" in message or "symbol" not in message:
+            self.other.append(message)
+        else:
+            # Only the newest quote per symbol matters
+            self.pending[message["symbol"]] = message
+
+    def forget(self, symbols):
+        # The next update for these symbols is a full one again (after a resubscribe)
+        for symbol in symbols:
+            self.sent.pop(symbol, None)
+            self.sent_at.pop(symbol, None)
+            self.pending.pop(symbol, None)
+
+    def timeout(self):
+        """Seconds until something is due: a held back quote or the next heartbeat"""
+        now = time.monotonic()
+        due = self.last_frame + self.heartbeat
+        for symbol in self.pending:
+            due = min(due, self._due(symbol))
+        return max(due - now, 0.0)
+
+    def _due(self, symbol: str):
+        # When the symbol may be sent again (a symbol never sent is due right away)
+        return self.sent_at.get(symbol, float("-inf")) + self.interval
+
+    def flush(self):
+        """Encoded frames to send now (str for JSON, bytes for msgpack)"""
+        now = time.monotonic()
+        messages = self.other
+        self.other = []
+        quotes = {}
+        newest = None
+        for symbol, message in list(self.pending.items()):
+            if now < self._due(symbol):
+                continue
+            del self.pending[symbol]
+            sent = self.sent.setdefault(symbol, {})
+            changes = {}
+            for field, key in self.keys:
+                value = message.get(field)
+                if key not in sent or sent[key] != value:
+                    changes[key] = sent[key] = value
+            if not changes:
+                self.skipped += 1
+                continue
+            self.sent_at[symbol] = now
+            quotes[symbol] = changes
+            newest = max(newest or "", message.get("timestamp") or "")
+        if quotes:
+            messages.append({"type": "quotes", "t": _epoch_ms(newest), "q": quotes})
+        if not messages and now - self.last_frame >= self.heartbeat:
+            messages.append({"type": "heartbeat", "t": _epoch_ms(None)})
+        if messages:
+            self.last_frame = now
+            self.frames += len(messages)
+        return [self.encode(message) for message in messages]
+
+    def encode(self, message: dict):
+        if self.encoding == "msgpack":
+            return msgpack.packb(message)
+        return json.dumps(message, separators=(",", ":"))
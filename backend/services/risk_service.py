@@ -0,0 +1,335 @@
+import logging
+import math
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta, timezone
+from statistics import NormalDist
+import numpy as np
+from config.settings import RISK_BENCHMARK, RISK_CACHE_SIZE, RISK_FREE_RATE, RISK_WINDOW, HISTORY_TAIL_REFRESH
+from services.history_store import get_history
+from services.valuation_service import position_index
+from services.upstream import market_data
+from services.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Portfolio risk analytics: volatility, Sharpe ratio, beta, max drawdown and value at risk.
+#
+# Daily closes of a set of symbols (plus the benchmark) are read from the history store,
+# lined up on the days they all traded, and turned into one returns matrix (days x symbols).
+# Alongside it we keep the column sums and the cross products (returns^T @ returns), which give
+# the mean vector and the covariance matrix directly:
+#     covariance = (cross - outer(sums, sums) / days) / (days - 1)
+# Matrices are cached per (symbols, window). When a new bar comes in, the oldest row leaves the
+# window and the new one enters it, and the sums and cross products are updated by those two rows
+# (O(symbols^2)) instead of being recomputed from the whole window; while the market is open the
+# last row is revised the same way as today's bar changes.
+#
+# A user's risk is then a product of their weights with the cached matrices:
+#     portfolio variance = w^T @ covariance @ w
+# plus one pass over the window for the historical VaR and the drawdown.
+#
+# Everything is computed on simple daily returns and annualized with TRADING_DAYS.
+
+TRADING_DAYS = 252
+
+# Window lengths (in daily returns) a request may ask for
+MIN_WINDOW = 20
+MAX_WINDOW = 5 * TRADING_DAYS
+
+# Confidence levels VaR is reported at
+VAR_LEVELS = (0.95, 0.99)
+
+SECONDS_PER_DAY = 86400
+
+
+def _daily_closes(symbol: str, start: date):
+    """(day numbers, closes) of symbol's daily bars since start, skipping empty bars"""
+    bars = get_history(symbol, start, None, "1d")
+    closes = bars["close"]
+    valid = ~np.isnan(closes) & (closes > 0)
+    # Daily bars are stamped at the exchange's midnight, so the UTC day is the trading day
+    return bars["date"][valid].astype(np.int64) // SECONDS_PER_DAY, closes[valid]
+
+
+class ReturnsWindow:
+    """
+    The last `window` daily returns of a set of symbols, with running column sums and
+    cross products so the mean and covariance are always one step away.
+    """
+
+    def __init__(self, symbols: list, window: int, days, closes):
+        # days has one more entry than there are returns: closes[0] is the base of the first return
+        self.symbols = symbols
+        self.column = {symbol: i for i, symbol in enumerate(symbols)}
+        self.window = window
+        self.days = days[1:]
+        self.returns = closes[1:] / closes[:-1] - 1
+        self.prev_close = closes[-2]
+        self.last_close = closes[-1]
+        self.checked_at = time.monotonic()
+        self.missing = []  # symbols asked for that have no usable history
+        self._recompute()
+
+    def _recompute(self):
+        self.sums = self.returns.sum(axis=0)
+        self.cross = self.returns.T @ self.returns
+        # Updates since the sums were last computed from scratch
+        self.updates = 0
+
+    def _updated(self):
+        self.updates += 1
+        # Adding and subtracting rows slowly piles up rounding error; start over once per window
+        if self.updates >= self.window:
+            self._recompute()
+
+    def append(self, day: int, close):
+        """A new bar: its return enters the window and (once full) the oldest one leaves"""
+        row = close / self.last_close - 1
+        if len(self.returns) >= self.window:
+            old = self.returns[0]
+            self.sums -= old
+            self.cross -= np.outer(old, old)
+            self.returns = np.vstack([self.returns[1:], row])
+            self.days = np.append(self.days[1:], day)
+        else:
+            self.returns = np.vstack([self.returns, row])
+            self.days = np.append(self.days, day)
+        self.sums += row
+        self.cross += np.outer(row, row)
+        self.prev_close, self.last_close = self.last_close, close
+        self._updated()
+
+    def revise(self, close):
+        """The last bar changed (it is still forming): replace its return"""
+        old = self.returns[-1]
+        row = close / self.prev_close - 1
+        self.sums += row - old
+        self.cross += np.outer(row, row) - np.outer(old, old)
+        self.returns[-1] = row
+        self.last_close = close
+        self._updated()
+
+    def mean(self):
+        return self.sums / len(self.returns)
+
+    def covariance(self):
+        count = len(self.returns)
+        return (self.cross - np.outer(self.sums, self.sums) / count) / (count - 1)
+
+    def correlation(self):
+        covariance = self.covariance()
+        deviations = np.sqrt(np.diag(covariance))
+        with np.errstate(divide="ignore", invalid="ignore"):
+            correlation = covariance / np.outer(deviations, deviations)
+        return np.nan_to_num(correlation)
+
+
+class RiskModel:
+    def __init__(self, benchmark: str = RISK_BENCHMARK, max_entries: int = RISK_CACHE_SIZE,
+                 risk_free_rate: float = RISK_FREE_RATE):
+        self.benchmark = benchmark
+        self.max_entries = max_entries
+        self.risk_free_rate = risk_free_rate
+        self.entries = OrderedDict()  # (symbols, window) -> ReturnsWindow
+        self.lock = threading.Lock()
+        self.locks = {}               # (symbols, window) -> lock held while that matrix is built or used
+        self.hits = 0
+        self.builds = 0
+        self.rolls = 0                # bars added to cached matrices
+        self.revisions = 0            # forming bars updated in cached matrices
+
+    @contextmanager
+    def matrix(self, symbols, window: int):
+        """
+        The returns window for symbols (plus the benchmark), built or brought up to date.
+        Held locked until the block ends. Blocking (reads the history store).
+        """
+        key = (tuple(sorted({symbol.upper() for symbol in symbols} | {self.benchmark})), window)
+        with self.lock:
+            key_lock = self.locks.setdefault(key, threading.Lock())
+        with key_lock:
+            with self.lock:
+                matrix = self.entries.get(key)
+                if matrix is not None:
+                    self.entries.move_to_end(key)
+                    self.hits += 1
+            if matrix is None:
+                matrix = self._build(list(key[0]), window)
+                with self.lock:
+                    self.entries[key] = matrix
+                    self.builds += 1
+                    while len(self.entries) > self.max_entries:
+                        evicted, _ = self.entries.popitem(last=False)
+                        self.locks.pop(evicted, None)
+            elif time.monotonic() - matrix.checked_at >= HISTORY_TAIL_REFRESH:
+                if not self._refresh(matrix):
+                    matrix = self._build(list(key[0]), window)
+                    with self.lock:
+                        self.entries[key] = matrix
+                        self.builds += 1
+            yield matrix
+
+    def _build(self, symbols: list, window: int):
+        # Enough calendar days for `window` trading days plus holidays
+        start = date.today() - timedelta(days=int((window + 1) * 365 / TRADING_DAYS) + 15)
+        series = {}
+        missing = []
+        for symbol in symbols:
+            try:
+                days, closes = _daily_closes(symbol, start)
+            except Exception as e:
+                logger.warning("No history for %s: %s", symbol, e)
+                days = []
+            if len(days) > 1:
+                series[symbol] = (days, closes)
+            elif symbol == self.benchmark:
+                raise ValueError(f"No history for the benchmark {self.benchmark}")
+            else:
+                missing.append(symbol)
+
+        common = None
+        for days, _ in series.values():
+            common = days if common is None else np.intersect1d(common, days, assume_unique=True)
+        common = common[-(window + 1):]
+        if len(common) <= MIN_WINDOW:
+            raise ValueError(f"Not enough common history: {max(len(common) - 1, 0)} daily returns, need {MIN_WINDOW}")
+        kept = list(series)
+        closes = np.column_stack([series[symbol][1][np.searchsorted(series[symbol][0], common)] for symbol in kept])
+        matrix = ReturnsWindow(kept, window, common, closes)
+        matrix.missing = missing
+        return matrix
+
+    def _refresh(self, matrix: ReturnsWindow):
+        """Bring a cached matrix up to the latest bars. Returns False if it has to be rebuilt."""
+        last_day = int(matrix.days[-1])
+        start = datetime.fromtimestamp(last_day * SECONDS_PER_DAY, timezone.utc).date() - timedelta(days=7)
+        latest = []
+        for symbol in matrix.symbols:
+            days, closes = _daily_closes(symbol, start)
+            position = np.searchsorted(days, last_day)
+            if position >= len(days) or days[position] != last_day:
+                # The last bar we used has disappeared from the history (data corrected)
+                return False
+            latest.append((days[position:], closes[position:]))
+
+        revised = np.array([closes[0] for _, closes in latest])
+        if not np.array_equal(revised, matrix.last_close):
+            matrix.revise(revised)
+            self.revisions += 1
+        new_days = None
+        for days, _ in latest:
+            new_days = days[1:] if new_days is None else np.intersect1d(new_days, days[1:], assume_unique=True)
+        for day in new_days:
+            row = np.array([closes[np.searchsorted(days, day)] for days, closes in latest])
+            matrix.append(int(day), row)
+            self.rolls += 1
+        matrix.checked_at = time.monotonic()
+        return True
+
+    def analyze(self, quantities: dict, prices: dict, window: int = RISK_WINDOW, correlation: bool = False):
+        """
+        Risk of holding quantities ({symbol: shares}), valued at prices (falls back to the last close).
+        Blocking, so call it from a worker thread.
+        """
+        with self.matrix(quantities, window) as matrix:
+            held = [symbol for symbol in sorted(quantities) if symbol in matrix.column]
+            columns = [matrix.column[symbol] for symbol in held]
+            benchmark = matrix.column[self.benchmark]
+            values = np.array([quantities[symbol] * (prices.get(symbol) or matrix.last_close[matrix.column[symbol]])
+                               for symbol in held])
+            invested = float(values.sum())
+            covariance = matrix.covariance()
+            mean = matrix.mean()
+            result = {
+                "benchmark": self.benchmark,
+                "window": len(matrix.returns),
+                "start": _day_iso(matrix.days[0]),
+                "end": _day_iso(matrix.days[-1]),
+                "invested_value": round(invested, 2),
+                "missing": sorted(set(matrix.missing) & set(quantities))
+            }
+            if invested <= 0:
+                return {**result, "positions": []}
+
+            weights = values / invested
+            held_covariance = covariance[np.ix_(columns, columns)]
+            marginal = held_covariance @ weights
+            variance = float(weights @ marginal)
+            daily_volatility = math.sqrt(max(variance, 0.0))
+            daily_mean = float(weights @ mean[columns])
+            benchmark_variance = covariance[benchmark, benchmark]
+            annual_return = daily_mean * TRADING_DAYS
+            annual_volatility = daily_volatility * math.sqrt(TRADING_DAYS)
+
+            # One pass over the window with today's weights, for the historical VaR and drawdown
+            history = matrix.returns[:, columns] @ weights
+            wealth = np.cumprod(1 + history)
+            peaks = np.maximum.accumulate(np.concatenate([[1.0], wealth]))[1:]
+
+            result.update({
+                "annual_return": round(annual_return, 6),
+                "volatility": round(annual_volatility, 6),
+                "sharpe_ratio": round((annual_return - self.risk_free_rate) / annual_volatility, 4)
+                                if annual_volatility > 0 else None,
+                "beta": round(float(weights @ covariance[columns, benchmark]) / benchmark_variance, 4)
+                        if benchmark_variance > 0 else None,
+                "max_drawdown": round(float(np.max(1 - wealth / peaks)), 6),
+                # One-day losses not expected to be exceeded at each confidence level, in money
+                "var": {
+                    "historical": {str(int(level * 100)): round(-float(np.quantile(history, 1 - level)) * invested, 2)
+                                   for level in VAR_LEVELS},
+                    "parametric": {str(int(level * 100)): round(-(daily_mean - NormalDist().inv_cdf(level) * daily_volatility) * invested, 2)
+                                   for level in VAR_LEVELS}
+                },
+                "positions": [
+                    {
+                        "symbol": symbol,
+                        "weight": round(float(weights[i]), 6),
+                        "volatility": round(math.sqrt(max(held_covariance[i, i], 0.0) * TRADING_DAYS), 6),
+                        "beta": round(float(covariance[column, benchmark] / benchmark_variance), 4)
+                                if benchmark_variance > 0 else None,
+                        # Share of the portfolio variance coming from this position (sums to 1)
+                        "risk_contribution": round(float(weights[i] * marginal[i] / variance), 6) if variance > 0 else None
+                    }
+                    for i, (symbol, column) in enumerate(zip(held, columns))
+                ]
+            })
+            if correlation:
+                result["correlation"] = {
+                    "symbols": held,
+                    "matrix": np.round(matrix.correlation()[np.ix_(columns, columns)], 4).tolist()
+                }
+            return result
+
+    async def portfolio_risk(self, uid: str, window: int = RISK_WINDOW, correlation: bool = False):
+        # Positions and prices come from the in-memory position index (no Firestore read when warm)
+        user = await position_index.get(uid)
+        quantities = {symbol: position["quantity"] for symbol, position in user.positions.items()
+                      if position["quantity"] > 0}
+        started = time.perf_counter()
+        result = await market_data.run(self.analyze, quantities, dict(user.prices), window, correlation, timeout=None)
+        metrics.observe("risk_ms", (time.perf_counter() - started) * 1000)
+        result["timestamp"] = datetime.now().isoformat()
+        return result
+
+    def stats(self):
+        with self.lock:
+            return {
+                "matrices": len(self.entries),
+                "hits": self.hits,
+                "builds": self.builds,
+                "rolls": self.rolls,
+                "revisions": self.revisions
+            }
+
+
+def _day_iso(day):
+    return datetime.fromtimestamp(int(day) * SECONDS_PER_DAY, timezone.utc).date().isoformat()
+
+
+# One risk model shared by the whole app
+risk_model = RiskModel()
+metrics.add_collector("risk", risk_model.stats)
@@ -0,0 +1,149 @@
+import asyncio
+import logging
+import time
+from datetime import date, timedelta
+from config.settings import (WARMUP_SYMBOLS, WARMUP_HISTORY_DAYS, WARMUP_TIMEOUT,
+                             STARTUP_RETRY_DELAY, STARTUP_RETRY_MAX_DELAY)
+from services.firebase_service import get_db
+from services.history_store import get_history
+from services.order_service import order_engine
+from services.stock_service import get_stocks_data, MAX_BATCH_SIZE, MAX_CONCURRENT_QUOTES
+from services.symbol_index import symbol_search
+from services.token_service import token_verifier
+from services.upstream import market_data, database
+from services.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Worker startup.
+#
+# Nothing slow happens when the app is imported. Once the app starts (FastAPI lifespan hook),
+# these steps run in the background while the worker already answers /health/live:
+#   - firebase:     connect to Firebase and create the Firestore client
+#   - symbol_index: build the search index from the ticker CSV
+#   - orders:       load the open limit/stop orders into the order books (once Firebase is up)
+#   - warmup:       load quotes and recent daily history for WARMUP_SYMBOLS into the quote cache
+#                   and the history store, and download Google's token signing keys
+# /health/ready answers 503 until they are done, so a new worker only gets traffic once its
+# first requests will be served from warm caches. The warm-up is best effort: if it fails or
+# takes longer than WARMUP_TIMEOUT the worker reports ready anyway.
+# A failed Firebase connection (a network blip, a slow metadata server) is retried with growing
+# delays until it succeeds, so the worker becomes ready by itself instead of staying out for good.
+
+PENDING, OK, FAILED, TIMED_OUT = "pending", "ok", "failed", "timed_out"
+
+# Steps the worker can't serve requests without (the warm-up only makes it faster, and
+# if the open orders can't be loaded, only the orders placed on this worker get filled)
+REQUIRED_STEPS = ("firebase", "symbol_index")
+
+
+class Startup:
+    def __init__(self, symbols=WARMUP_SYMBOLS, history_days: int = WARMUP_HISTORY_DAYS,
+                 warmup_timeout: float = WARMUP_TIMEOUT):
+        self.symbols = symbols
+        self.history_days = history_days
+        self.warmup_timeout = warmup_timeout
+        self.checks = {}  # step -> {"status": ..., "seconds": ..., "error": ...}
+        self.started_at = None
+        self.task = None
+
+    def start(self):
+        self.started_at = time.monotonic()
+        self.checks = {name: {"status": PENDING} for name in (*REQUIRED_STEPS, "orders", "warmup")}
+        self.task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self.task is not None and not self.task.done():
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+        await order_engine.stop()
+
+    def ready(self):
+        if not self.checks:
+            return False
+        return all(check["status"] == OK if name in REQUIRED_STEPS else check["status"] != PENDING
+                   for name, check in self.checks.items())
+
+    def status(self):
+        return {
+            "ready": self.ready(),
+            "uptime_seconds": round(time.monotonic() - self.started_at, 3) if self.started_at else None,
+            "checks": self.checks
+        }
+
+    async def _run(self):
+        async def database_steps():
+            await self._retry("firebase", lambda: database.run(get_db))
+            await self._step("orders", order_engine.start)
+
+        await asyncio.gather(
+            database_steps(),
+            self._step("symbol_index", lambda: asyncio.to_thread(symbol_search.get_index)),
+            self._step("warmup", self._warm_up, self.warmup_timeout)
+        )
+        metrics.observe("startup_ms", (time.monotonic() - self.started_at) * 1000)
+        logger.info("Startup finished in %.2fs: %s", time.monotonic() - self.started_at,
+                    {name: check["status"] for name, check in self.checks.items()})
+
+    async def _step(self, name: str, run, timeout: float = None):
+        started = time.monotonic()
+        try:
+            await asyncio.wait_for(run(), timeout)
+            status, error = OK, None
+        except asyncio.TimeoutError:
+            status, error = TIMED_OUT, f"Not finished after {timeout:g} seconds"
+            logger.warning("Startup step %s timed out after %ss", name, timeout)
+        except Exception as e:
+            status, error = FAILED, str(e)
+            logger.error("Startup step %s failed: %s", name, e)
+        self.checks[name] = {"status": status, "seconds": round(time.monotonic() - started, 3)}
+        if error:
+            self.checks[name]["error"] = error
+
+    async def _retry(self, name: str, run):
+        """Run a required step until it succeeds, waiting longer after every failure"""
+        delay = STARTUP_RETRY_DELAY
+        attempts = 0
+        while True:
+            await self._step(name, run)
+            attempts += 1
+            if self.checks[name]["status"] == OK:
+                return
+            self.checks[name].update(attempts=attempts, retry_in=delay)
+            logger.info("Retrying startup step %s in %gs", name, delay)
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, STARTUP_RETRY_MAX_DELAY)
+
+    async def _warm_up(self):
+        tasks = [asyncio.to_thread(token_verifier.refresh_keys)]
+        if self.symbols:
+            # Quotes go through the normal batch path, so they land in the shared quote cache
+            for start in range(0, len(self.symbols), MAX_BATCH_SIZE):
+                tasks.append(get_stocks_data(self.symbols[start:start + MAX_BATCH_SIZE]))
+            end = date.today() + timedelta(days=1)
+            history_start = end - timedelta(days=self.history_days)
+            semaphore = asyncio.Semaphore(MAX_CONCURRENT_QUOTES)
+
+            async def load_history(symbol):
+                async with semaphore:
+                    await market_data.run(get_history, symbol, history_start, end, "1d")
+
+            tasks.extend(load_history(symbol) for symbol in self.symbols)
+
+        results = await asyncio.gather(*tasks, return_exceptions=True)
+        failures = [result for result in results if isinstance(result, Exception)]
+        # A batch quote call reports bad symbols instead of raising
+        for result in results:
+            if isinstance(result, dict) and result.get("errors"):
+                logger.warning("Warm-up could not load quotes for %s", ", ".join(result["errors"]))
+        for failure in failures:
+            logger.warning("Warm-up error: %s", failure)
+        if failures and len(failures) == len(results):
+            raise failures[0]
+
+
+# One startup state per worker
+startup = Startup()
@@ -1,220 +1,334 @@
-import yfinance as yf
+import logging
+import asyncio
 from pydantic import BaseModel
 from services.firebase_service import get_db
+from services.ledger_service import append_entries, apply_entry, migrate_legacy
+from services.quote_cache import get_info
+from services.quote_hub import quote_hub
+from services.history_store import get_history, COLUMNS
+from services.upstream import market_data, database, UpstreamOverloaded
 from routes.auth import verify_token
-from datetime import datetime
+from datetime import datetime, timezone
+import numpy as np
 from fastapi import HTTPException
 
-def get_multiple_stocks_data(stock_symbol):
-    # Fetch stock data using yfinance
-    try:
-        stock = yf.Ticker(stock_symbol)
-        data = stock.history(interval="1mo", start="2024-01-01", end="2024-01-31")
-        return data
-    except Exception as e:
-        print(f"Error fetching data for {stock_symbol}: {e}")
-        return None
+logger = logging.getLogger(__name__)
+
+def get_multiple_stocks_data(stock_symbol, start=None, end=None, interval="1d"):
+    """
+    Price history for one symbol between start and end (YYYY-MM-DD, end is exclusive).
+    Served from the local history store; only date ranges we don't have yet are downloaded.
+    Returns the bars as columns: {"date": [...], "open": [...], ...}
+    """
+    bars = get_history(stock_symbol, start, end, interval)
+    return {
+        "symbol": stock_symbol.upper(),
+        "interval": interval,
+        "date": [datetime.fromtimestamp(int(ts), tz=timezone.utc).isoformat() for ts in bars["date"]],
+        # NaN isn't valid JSON, so missing values become None
+        **{column: [None if np.isnan(value) else float(value) for value in bars[column]] for column in COLUMNS}
+    }
 
 class StockData(BaseModel):
     stock_symbol: str
     stock_data: dict
 
-def get_stocks_data(stock_symbols: str):
-    try:
-        print(f"Attempting to fetch data for symbol: {stock_symbols}")
-        # Get the stock info
-        stock = yf.Ticker(stock_symbols)
-        info = stock.info
-        
-        if not info:
-            print(f"No data found for symbol {stock_symbols}")
-            raise HTTPException(status_code=404, detail=f"No data found for symbol {stock_symbols}")
-            
-        # Extract the data we want
-        stock_data = {
-            "symbol": stock_symbols,
-            "price": info.get("currentPrice"),
-            "change": info.get("regularMarketChange"),
-            "changePercent": info.get("regularMarketChangePercent"),
-            "open": info.get("regularMarketOpen"),
-            "high": info.get("regularMarketDayHigh"),
-            "low": info.get("regularMarketDayLow"),
-            "volume": info.get("regularMarketVolume"),
-            "marketCap": info.get("marketCap"),
-            "timestamp": datetime.now().isoformat()
-        }
-        
-        print(f"Debug - Stock data: {stock_data}")
-        return stock_data
-    
-    except Exception as e:
-        print(f"Error fetching stock data: {str(e)}")
-        raise HTTPException(status_code=500, detail=f"Error fetching stock data: {str(e)}")
+# How many Yahoo Finance calls a single batch request may have in flight at once.
+# Bounded so one big watchlist can't flood Yahoo (and get us rate-limited).
+MAX_CONCURRENT_QUOTES = 8
+
+# Biggest watchlist we accept in one request
+MAX_BATCH_SIZE = 100
 
-async def buy_stock(user_id: str, stock_symbol: str, quantity: int, price: float):
+def get_stock_quote(stock_symbol: str):
     """
-    Function to handle stock purchase. Takes user_id, stock symbol, quantity, and price as parameters.
-    Returns success/failure and updates user's portfolio in Firestore.
+    Fetch the quote for a single symbol. Raises ValueError if Yahoo has no data for it.
     """
-    try:
-        # Initialize Firestore database connection from firebase_service.py
-        db = get_db()
-        
-        # Get user document from Firestore using user_id
-        user_ref = db.collection('users').document(user_id)
-        user_doc = user_ref.get()
-        
-        if not user_doc.exists:
-            raise HTTPException(status_code=404, detail="User not found")
-        
-        # Get current user data
-        user_data = user_doc.to_dict()
-        
-        # Calculate total cost of purchase
+    # Get the stock info (served from the shared quote cache when fresh)
+    info = get_info(stock_symbol)
+
+    if not info or (info.get("currentPrice") is None and info.get("regularMarketPrice") is None):
+        raise ValueError(f"No data found for symbol {stock_symbol}")
+
+    # Extract the data we want
+    return {
+        "symbol": stock_symbol,
+        # ETFs, indices and some ADRs only have regularMarketPrice
+        "price": info.get("currentPrice") or info.get("regularMarketPrice"),
+        "change": info.get("regularMarketChange"),
+        "changePercent": info.get("regularMarketChangePercent"),
+        "open": info.get("regularMarketOpen"),
+        "high": info.get("regularMarketDayHigh"),
+        "low": info.get("regularMarketDayLow"),
+        "volume": info.get("regularMarketVolume"),
+        "marketCap": info.get("marketCap"),
+        "timestamp": datetime.now().isoformat()
+    }
+
+async def get_stocks_data(stock_symbols: list[str]):
+    """
+    Fetch quotes for many symbols in one call using a bounded concurrent fan-out.
+    One bad symbol doesn't fail the whole batch: successful quotes go in "quotes"
+    and failures go in "errors", both keyed by symbol.
+    """
+    # Normalize and de-duplicate while keeping the order the client asked for
+    symbols = list(dict.fromkeys(symbol.strip().upper() for symbol in stock_symbols if symbol.strip()))
+    if not symbols:
+        raise HTTPException(status_code=400, detail="No stock symbols provided")
+    if len(symbols) > MAX_BATCH_SIZE:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_BATCH_SIZE} symbols per request")
+
+    semaphore = asyncio.Semaphore(MAX_CONCURRENT_QUOTES)
+    quotes = {}
+    errors = {}
+
+    async def fetch(symbol):
+        async with semaphore:
+            try:
+                # yfinance is blocking, so run it on the market data pool to keep the event loop free
+                quotes[symbol] = await market_data.run(get_stock_quote, symbol)
+            except UpstreamOverloaded:
+                # Shed the whole request rather than answering with a batch of "busy" errors
+                raise
+            except Exception as e:
+                logger.warning("Error fetching stock data for %s: %s", symbol, e)
+                errors[symbol] = str(e)
+
+    await asyncio.gather(*(fetch(symbol) for symbol in symbols))
+
+    return {
+        # Rebuild the dicts so results come back in the requested order
+        "quotes": {symbol: quotes[symbol] for symbol in symbols if symbol in quotes},
+        "errors": {symbol: errors[symbol] for symbol in symbols if symbol in errors}
+    }
+
+def get_user_data(user_id: str):
+    """Read a user's document from Firestore as a dict"""
+    user_doc = get_db().collection("users").document(user_id).get()
+    if not user_doc.exists:
+        raise HTTPException(status_code=404, detail="User not found")
+    return user_doc.to_dict()
+
+def get_user_portfolio(user_id: str):
+    """
+    Read a user's current holdings and cash balance from Firestore.
+    Returns (portfolio, balance) where portfolio looks like {"AAPL": {"quantity": 10, ...}}
+    """
+    user_data = get_user_data(user_id)
+    return user_data.get("portfolio", {}), user_data.get("initial_balance", 0.0)
+
+# Most orders a single basket may contain. Every order writes one ledger document and a
+# Firestore commit is limited to 500 writes, so this leaves room for the user/snapshot writes.
+MAX_BASKET_ORDERS = 200
+
+def _apply_order(portfolio: dict, balance: float, order: dict, timestamp: str):
+    """
+    Apply one order to an in-memory portfolio/balance after checking it is allowed.
+    Returns (new balance, transaction record). Raises HTTPException if the order can't be filled.
+    """
+    symbol = order["symbol"]
+    quantity = order["quantity"]
+    price = order["price"]
+
+    if order["side"] == "BUY":
+        # Calculate total cost of purchase and check if user has enough balance
         total_cost = quantity * price
-        
-        # Check if user has enough balance
-        if user_data['initial_balance'] < total_cost:
-            raise HTTPException(
-                status_code=400, 
-                detail="Insufficient funds for purchase"
-            )
-        
-        # Get current portfolio or create empty one if doesn't exist
-        portfolio = user_data.get('portfolio', {})
-        
-        # Update or create stock position in portfolio
-        if stock_symbol in portfolio:
-            # If user already owns this stock, update quantity and average price
-            current_quantity = portfolio[stock_symbol]['quantity']
-            current_avg_price = portfolio[stock_symbol]['average_buy_price']
-            
-            # Calculate new average price
-            new_total_quantity = current_quantity + quantity
-            new_avg_price = ((current_quantity * current_avg_price) + (quantity * price)) / new_total_quantity
-            
-            portfolio[stock_symbol] = {
-                'quantity': new_total_quantity,
-                'average_buy_price': new_avg_price,
-                'last_updated': datetime.now().isoformat()
-            }
-        else:
-            # If this is a new stock position
-            portfolio[stock_symbol] = {
-                'quantity': quantity,
-                'average_buy_price': price,
-                'last_updated': datetime.now().isoformat()
-            }
-        
-        # Create transaction record
+        if balance < total_cost:
+            raise HTTPException(status_code=400, detail=f"Insufficient funds to buy {quantity} {symbol}")
         transaction = {
             'type': 'BUY',
-            'symbol': stock_symbol,
+            'symbol': symbol,
             'quantity': quantity,
             'price': price,
             'total_cost': total_cost,
-            'timestamp': datetime.now().isoformat()
+            'timestamp': timestamp
         }
-        
-        # Update user document in Firestore
-        user_ref.update({
-            'initial_balance': user_data['initial_balance'] - total_cost,  # Subtract cost from balance
-            'portfolio': portfolio,  # Update portfolio
-            'transactions': firestore.ArrayUnion([transaction])  # Add new transaction to history
-        })
-        
-        return {
-            'status': 'success',
-            'message': f'Successfully purchased {quantity} shares of {stock_symbol}',
-            'transaction': transaction,
-            'new_balance': user_data['initial_balance'] - total_cost
+    else:
+        #check if user has enough stock to sell
+        if symbol not in portfolio:
+            raise HTTPException(status_code=400, detail=f"{symbol} not found in portfolio")
+        if portfolio[symbol]["quantity"] < quantity:
+            raise HTTPException(status_code=400, detail=f"Insufficient {symbol} quantity")
+        avg_buy_price = portfolio[symbol]["average_buy_price"]
+        transaction = {
+            "type": "SELL",
+            "symbol": symbol,
+            "quantity": quantity,
+            "price": price,
+            "total_sale_amount": quantity * price,
+            "profit_loss": (price - avg_buy_price) * quantity,
+            "profit_loss_percentage": ((price - avg_buy_price) / avg_buy_price) * 100,
+            "timestamp": timestamp
         }
-        
-    except HTTPException as http_error:
-        # Re-raise HTTP exceptions
-        raise http_error
-    except Exception as e:
-        # Handle any other errors
-        print(f"Error in buy_stock: {str(e)}")
-        raise HTTPException(status_code=500, detail=f"Error processing purchase: {str(e)}")
 
-async def sell_stock(user_id: str, stock_symbol: str, quantity: int, price: float):
+    # Same math the ledger uses to replay trades, so the two can never disagree
+    new_balance = apply_entry(portfolio, balance, transaction)
+    return new_balance, transaction
+
+def fill_in_transaction(transaction, db, user_id: str, user_ref, user_data: dict, orders: list[dict], on_reject=None):
     """
-    Function to handle stock sale. Takes user_id, stock symbol, quantity, and price as parameters.
-    Returns success/failure and updates user's portfolio in Firestore. first checks if the user has enough stock to sell.
+    Apply orders to the user document read in this transaction and stage the writes
+    (balance/portfolio update and ledger entries). Returns (transaction records, new balance).
+    By default an order that can't be filled fails the whole batch; with on_reject, it is
+    reported as on_reject(index, reason) and the other orders still go through.
     """
-    try:
-        db = get_db()
+    # A user from before the ledger gets their old trades copied in first, so the new ones follow them
+    # (this snapshots the portfolio as it is now, so it has to happen before the orders change it)
+    update = migrate_legacy(transaction, db, user_id, user_data) or {}
+    portfolio = user_data.get('portfolio', {})
+    balance = user_data['initial_balance']
+    timestamp = datetime.now().isoformat()
+    transactions = []
+    for index, order in enumerate(orders):
+        try:
+            balance, record = _apply_order(portfolio, balance, order, timestamp)
+        except HTTPException as e:
+            if on_reject is not None:
+                on_reject(index, e.detail)
+                continue
+            # Say which order failed when there are several
+            detail = e.detail if len(orders) == 1 else f"Order {index}: {e.detail}"
+            raise HTTPException(status_code=e.status_code, detail=detail)
+        transactions.append(record)
+    if not transactions:
+        if update:
+            transaction.update(user_ref, update)
+        return transactions, balance
+
+    ledger_seq = append_entries(transaction, db, user_id, update.get('ledger_seq', user_data.get('ledger_seq', 0)),
+                                transactions, portfolio, balance)
+    update.update({
+        'initial_balance': balance,
+        'portfolio': portfolio,
+        'ledger_seq': ledger_seq
+    })
+    sells = [record for record in transactions if record['type'] == 'SELL']
+    if sells:
+        # Keep the P&L of the latest sale on the user document like before
+        update['profit_loss'] = sells[-1]['profit_loss']
+        update['profit_loss_percentage'] = sells[-1]['profit_loss_percentage']
+    transaction.update(user_ref, update)
+    return transactions, balance
+
+def execute_orders(user_id: str, orders: list[dict]):
+    """
+    Fill every order for a user in ONE Firestore transaction: read the user document once,
+    apply all orders in memory, then commit the new balance/portfolio and the ledger entries
+    together. Either every order is filled or none are. If another trade changes the user
+    document at the same time, Firestore retries the whole function with fresh data,
+    so concurrent trades can't lose each other's updates.
+    Every order needs "side" ("BUY"/"SELL"), "symbol", "quantity" and "price".
+    """
+    from firebase_admin import firestore  # loaded with the database client, see firebase_service.get_db
+    db = get_db()
+    user_ref = db.collection('users').document(user_id)
 
-        user_ref = db.collection("users").document(user_id)
-        user_doc = user_ref.get()
-        user_data = user_doc.to_dict() #to_dict -> converts the firestore document to a dictionary
+    @firestore.transactional
+    def fill(transaction):
+        user_doc = user_ref.get(transaction=transaction)
         if not user_doc.exists:
             raise HTTPException(status_code=404, detail="User not found")
-        
-        #get current portfolio
-        portfolio = user_data.get("portfolio", {})
-        if stock_symbol not in portfolio:
-            raise HTTPException(status_code=400, detail="Stock not found in portfolio")
+        return fill_in_transaction(transaction, db, user_id, user_ref, user_doc.to_dict(), orders)
 
-        #check if user has enough stock to sell
-        current_quanitity = portfolio[stock_symbol]["quantity"]
-        if current_quanitity < quantity: #quantity came from the buy stock function
-            raise HTTPException(status_code=400, detail="Insufficient stock quantity")
-        
-        #calculate the total sale amount
-        stock = yf.Ticker(stock_symbol)
-        stock_info = stock.info
-        current_price = stock_info("currentPrice")
-        total_sale_amount = quantity * current_price
-
-        avg_buy_price = portfolio[stock_symbol]["average_buy_price"]
-        profit_loss = (current_price - avg_buy_price) * quantity
-        profit_loss_percentage = ((current_price - avg_buy_price) / avg_buy_price) * 100
-
-        #update the user's balance
-        user_ref.update({
-            "initial_balance": user_data["initial_balance"] + total_sale_amount,
-            "profit_loss": profit_loss,
-            "profit_loss_percentage": profit_loss_percentage
-        })
-
-        #update the user's portfolio
-        portfolio[stock_symbol]["quantity"] -= quantity 
-        #^^ shorthand for portfolio[stock_symbol]["quantity"] = portfolio[stock_symbol]["quantity"] - quantity
-        if portfolio[stock_symbol]["quantity"] == 0:
-            del portfolio[stock_symbol]
-            
-        #create the transaction record. transaction is from user.py in the user model
-        transaction = {
-            "type": "SELL",
-            "symbol": stock_symbol,
-            "quantity": quantity,
-            "price": current_price,
-            "total_sale_amount": total_sale_amount,
-            "timestamp": datetime.now().isoformat()
-        }
-        
-        #update user document in firestore
-        user_ref.update({
-            "portfolio": portfolio,
-            "transactions": firestore.ArrayUnion([transaction])
-        })
-        
-        return {
-            'status': 'success',
-            'message': f'Successfully sold {quantity} shares of {stock_symbol}',
-            'transaction': transaction,
-            'new_balance': user_data['initial_balance'] + total_sale_amount
-        }
-        
+    return fill(db.transaction())
+
+# Functions called after every committed trade with (user_id, transaction records), e.g. to
+# update the in-memory portfolio valuations and the leaderboard without re-reading Firestore
+trade_listeners = []
+
+def add_trade_listener(listener):
+    trade_listeners.append(listener)
+
+def notify_trade(user_id: str, transactions: list[dict]):
+    for listener in trade_listeners:
+        try:
+            listener(user_id, transactions)
+        except Exception as e:
+            logger.exception("Error in trade listener for %s: %s", user_id, e)
+
+async def place_orders(user_id: str, orders: list[dict]):
+    """
+    Fill market orders atomically at the current market price, which is looked up for all of
+    them at once before the transaction starts (never taken from the client).
+    Returns (transaction records, new balance).
+    """
+    if not orders:
+        raise HTTPException(status_code=400, detail="No orders provided")
+    if len(orders) > MAX_BASKET_ORDERS:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_BASKET_ORDERS} orders per basket")
+
+    orders = [{"side": order["side"].upper(), "symbol": order["symbol"].upper(), "quantity": order["quantity"],
+               "price": None} for order in orders]
+    for order in orders:
+        if order["side"] not in ("BUY", "SELL"):
+            raise HTTPException(status_code=400, detail=f"Unknown order side {order['side']}")
+        if order["quantity"] <= 0:
+            raise HTTPException(status_code=400, detail="Quantity must be positive")
+
+    # Use the latest streamed quote when the hub is already polling the symbol
+    for order in orders:
+        latest = quote_hub.latest.get(order["symbol"])
+        if latest and isinstance(latest.get("price"), (int, float)):
+            order["price"] = latest["price"]
+
+    unpriced = list(dict.fromkeys(order["symbol"] for order in orders if order["price"] is None))
+    if unpriced:
+        quotes = await get_stocks_data(unpriced)
+        if quotes["errors"]:
+            raise HTTPException(status_code=400, detail=f"No market price for {', '.join(quotes['errors'])}")
+        for order in orders:
+            if order["price"] is None:
+                order["price"] = quotes["quotes"][order["symbol"]]["price"]
+        missing = list(dict.fromkeys(order["symbol"] for order in orders
+                                     if not isinstance(order["price"], (int, float)) or order["price"] <= 0))
+        if missing:
+            raise HTTPException(status_code=400, detail=f"No market price for {', '.join(missing)}")
+
+    try:
+        # The Firestore client is blocking, so run the transaction on the database pool.
+        # No timeout here: a commit we stopped waiting for could still go through, and the
+        # client would be told the trade failed when it didn't.
+        transactions, balance = await database.run(execute_orders, user_id, orders, timeout=None)
     except HTTPException as http_error:
         # Re-raise HTTP exceptions
         raise http_error
     except Exception as e:
         # Handle any other errors
-        print(f"Error in sell_stock: {str(e)}")
-        raise HTTPException(status_code=500, detail=f"Error processing sale: {str(e)}")
+        logger.exception("Error executing orders: %s", e)
+        raise HTTPException(status_code=500, detail=f"Error executing orders: {str(e)}")
+    notify_trade(user_id, transactions)
+    return transactions, balance
+
+async def buy_stock(user_id: str, stock_symbol: str, quantity: int):
+    """
+    Function to handle stock purchase at the current market price. Takes user_id, stock symbol and quantity.
+    Returns success/failure and updates user's portfolio in Firestore in a single transaction.
+    """
+    transactions, new_balance = await place_orders(user_id, [
+        {"side": "BUY", "symbol": stock_symbol, "quantity": quantity}
+    ])
+    return {
+        'status': 'success',
+        'message': f'Successfully purchased {quantity} shares of {stock_symbol}',
+        'transaction': transactions[0],
+        'new_balance': new_balance
+    }
+
+async def sell_stock(user_id: str, stock_symbol: str, quantity: int):
+    """
+    Function to handle stock sale at the current market price. Takes user_id, stock symbol and quantity.
+    Returns success/failure and updates user's portfolio in Firestore in a single transaction.
+    first checks if the user has enough stock to sell.
+    """
+    transactions, new_balance = await place_orders(user_id, [
+        {"side": "SELL", "symbol": stock_symbol, "quantity": quantity}
+    ])
+    return {
+        'status': 'success',
+        'message': f'Successfully sold {quantity} shares of {stock_symbol}',
+        'transaction': transactions[0],
+        'new_balance': new_balance
+    }
 
 
 ''' Notes
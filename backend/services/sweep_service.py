@@ -0,0 +1,190 @@
+import asyncio
+import itertools
+import json
+import uuid
+from multiprocessing import shared_memory
+import numpy as np
+from config.settings import SWEEP_WORKERS, SWEEP_MAX_CELLS
+from services.backtest_service import load_price_matrix, run_backtest, summarize, PERIODS_PER_YEAR
+from services.process_pool import LazyProcessPool
+
+# Strategy parameter sweeps (grid search).
+#
+# A sweep takes a grid like {"frequency": ["monthly", "quarterly"], "weights": [...10 weightings...]}
+# and evaluates every combination ("cell") against the same price history.
+#
+# The price matrix is loaded once and copied into shared memory. Worker processes attach to it
+# read-only instead of each receiving their own copy. Cells are sent to the workers in small
+# groups, and each group is evaluated with one vectorized backtest call. Results are streamed
+# back as groups finish, and a sweep can be cancelled at any time.
+
+# Parameters a grid is allowed to vary (the StrategyConfig fields)
+GRID_PARAMETERS = {"type", "name", "weights", "frequency", "contribution"}
+
+# Cells evaluated together in one task (and one vectorized backtest call)
+CELLS_PER_TASK = 16
+
+_pool = LazyProcessPool(SWEEP_WORKERS)
+
+# Sweeps that are still running, by id, so they can be cancelled
+active_sweeps = {}
+
+# Shared memory blocks this worker process is attached to (name -> (block, array))
+_attached = {}
+
+
+def _attach(name: str, shape, dtype):
+    """Runs inside a worker: map the shared price matrix once per sweep and reuse it"""
+    if name not in _attached:
+        # Only keep the current sweep's block mapped
+        for old_block, _ in _attached.values():
+            old_block.close()
+        _attached.clear()
+        block = shared_memory.SharedMemory(name=name)
+        prices = np.ndarray(shape, dtype=dtype, buffer=block.buf)
+        prices.flags.writeable = False
+        _attached[name] = (block, prices)
+    return _attached[name][1]
+
+
+def _run_cells(task):
+    """Runs inside a worker: backtest one group of cells against the shared price matrix"""
+    prices = _attach(task["shm_name"], task["shape"], task["dtype"])
+    cells = task["cells"]
+    try:
+        strategies = [cell["strategy"] for cell in cells]
+        equity, flows = run_backtest(task["dates"], prices, task["symbols"], strategies, task["initial_capital"])
+        stats = summarize(task["dates"], equity, flows, task["initial_capital"],
+                          task["periods_per_year"], task["risk_free_rate"])
+        return [{"cell": cell["cell"], "params": cell["params"], "stats": cell_stats}
+                for cell, cell_stats in zip(cells, stats)]
+    except Exception:
+        # One bad cell shouldn't hide the others, so retry them one by one to find it
+        if len(cells) == 1:
+            raise
+        results = []
+        for cell in cells:
+            try:
+                results.extend(_run_cells({**task, "cells": [cell]}))
+            except Exception as e:
+                results.append({"cell": cell["cell"], "params": cell["params"], "error": str(e)})
+        return results
+
+
+def expand_grid(base: dict, grid: dict):
+    """Every combination of the grid's values, each merged over the base strategy"""
+    unknown = set(grid) - GRID_PARAMETERS
+    if unknown:
+        raise ValueError(f"Unknown grid parameters: {sorted(unknown)}")
+    names = list(grid)
+    total = 1
+    for name in names:
+        if not grid[name]:
+            raise ValueError(f"Grid parameter {name} has no values")
+        total *= len(grid[name])
+    if total > SWEEP_MAX_CELLS:
+        raise ValueError(f"Grid has {total} cells, the limit is {SWEEP_MAX_CELLS}")
+
+    cells = []
+    for index, values in enumerate(itertools.product(*(grid[name] for name in names))):
+        params = dict(zip(names, values))
+        cells.append({"cell": index, "params": params, "strategy": {**base, **params}})
+    return cells
+
+
+class Sweep:
+    def __init__(self, cells, futures, block):
+        self.id = uuid.uuid4().hex
+        self.cells = cells
+        self.futures = futures
+        self.block = block
+        self.cancelled = False
+        self.completed = 0
+
+    def cancel(self):
+        self.cancelled = True
+        self._drop_tasks()
+
+    def _drop_tasks(self):
+        # Tasks that haven't started yet are dropped; running ones finish and are ignored
+        for future in self.futures:
+            future.cancel()
+
+    def close(self):
+        # Not a cancel: the summary line after a finished sweep must still say it wasn't cancelled
+        self._drop_tasks()
+        active_sweeps.pop(self.id, None)
+        if self.block is not None:
+            self.block.close()
+            self.block.unlink()
+            self.block = None
+
+    async def results(self):
+        """Yield each cell's result dict as soon as its group finishes"""
+        self.completed = 0
+        try:
+            for next_done in asyncio.as_completed([asyncio.wrap_future(future) for future in self.futures]):
+                try:
+                    results = await next_done
+                except asyncio.CancelledError:
+                    if not self.cancelled:
+                        raise
+                    continue
+                except Exception as e:
+                    results = [{"error": str(e)}]
+                if self.cancelled:
+                    continue
+                for result in results:
+                    self.completed += 1
+                    yield result
+        finally:
+            # Runs when the sweep finishes, is cancelled, or the client disconnects
+            self.close()
+
+    async def stream(self):
+        """Yield NDJSON lines: a header, one line per cell as it finishes, then a summary"""
+        try:
+            yield json.dumps({"sweep_id": self.id, "cells": len(self.cells)}) + "\n"
+            async for result in self.results():
+                yield json.dumps(result) + "\n"
+            yield json.dumps({"done": True, "completed": self.completed, "cancelled": self.cancelled}) + "\n"
+        finally:
+            self.close()
+
+
+def start_sweep(symbols, base: dict, grid: dict, start=None, end=None, interval="1d",
+                initial_capital=10000.0, risk_free_rate=0.0):
+    """Load prices into shared memory and submit every cell to the worker pool"""
+    symbols = list(dict.fromkeys(symbol.upper() for symbol in symbols))
+    if not symbols:
+        raise ValueError("No symbols provided")
+    cells = expand_grid(base, grid)
+    dates, prices = load_price_matrix(symbols, start, end, interval)
+
+    # Copy the price matrix into shared memory once for all workers
+    block = shared_memory.SharedMemory(create=True, size=prices.nbytes)
+    shared = np.ndarray(prices.shape, dtype=prices.dtype, buffer=block.buf)
+    shared[:] = prices
+
+    task = {
+        "shm_name": block.name, "shape": prices.shape, "dtype": prices.dtype.str,
+        "dates": dates, "symbols": symbols, "initial_capital": initial_capital,
+        "periods_per_year": PERIODS_PER_YEAR[interval], "risk_free_rate": risk_free_rate
+    }
+    pool = _pool.get()
+    futures = [
+        pool.submit(_run_cells, {**task, "cells": cells[i:i + CELLS_PER_TASK]})
+        for i in range(0, len(cells), CELLS_PER_TASK)
+    ]
+
+    sweep = Sweep(cells, futures, block)
+    active_sweeps[sweep.id] = sweep
+    return sweep
+
+
+def cancel_sweep(sweep_id: str):
+    sweep = active_sweeps.get(sweep_id)
+    if sweep is None:
+        return False
+    sweep.cancel()
+    return True
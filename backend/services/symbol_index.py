@@ -0,0 +1,276 @@
+import logging
+import bisect
+import csv
+import heapq
+import io
+import itertools
+import re
+import threading
+import time
+from collections import Counter
+import requests
+from config.settings import SYMBOL_UNIVERSE_PATH, SYMBOL_UNIVERSE_DOWNLOAD, SYMBOL_INDEX_REFRESH
+from services.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Local ticker search for search-as-you-type.
+#
+# The whole ticker universe (symbol, name, sector, industry) is kept in memory and indexed
+# three ways, so a keystroke never waits on Yahoo:
+#   - sorted symbols          -> "AA" finds AAPL, AAL, ... with a binary search
+#   - sorted names and words  -> "app" finds Apple Inc., "motor" finds Ford Motor Company
+#   - trigrams of every term  -> "aple" or "mircosoft" still find something (typo tolerance)
+#
+# The universe comes from a CSV shipped with the app (well known stocks with sector/industry)
+# plus, optionally, the full list of US listed symbols published by NASDAQ Trader. A background
+# thread rebuilds the index every SYMBOL_INDEX_REFRESH seconds and swaps it in all at once,
+# so searches running at the same time always see a complete index.
+
+# Full lists of US listed securities, pipe separated, refreshed daily by NASDAQ
+NASDAQ_LISTED_URL = "https://www.nasdaqtrader.com/dynamic/SymDir/nasdaqlisted.txt"
+OTHER_LISTED_URL = "https://www.nasdaqtrader.com/dynamic/SymDir/otherlisted.txt"
+
+# Most matches looked at per pass (keeps one-letter queries fast on a big universe)
+MAX_PREFIX_SCAN = 200
+# Most terms looked at during the fuzzy pass
+MAX_FUZZY_CANDIDATES = 50
+# How similar (0-1, share of trigrams in common) a fuzzy match has to be to be returned
+MIN_FUZZY_SCORE = 0.5
+
+# How a result matched, best first: exact symbol, symbol prefix, name prefix, word prefix, fuzzy.
+# Results are ranked by exact match first, then prefix matches before fuzzy ones, then well known
+# stocks (from our CSV) before the rest of the exchange listings, then by how they matched.
+EXACT, SYMBOL_PREFIX, NAME_PREFIX, WORD_PREFIX, FUZZY = range(5)
+
+
+def _normalize(text: str):
+    # Lowercase and turn punctuation into spaces, so "Amazon.com, Inc." -> "amazon com inc"
+    return " ".join(re.sub(r"[^a-z0-9]+", " ", text.lower()).split())
+
+
+def _trigrams(text: str):
+    padded = f" {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def _prefix_range(keys, prefix: str):
+    """Positions in a sorted list of keys that start with prefix"""
+    start = bisect.bisect_left(keys, prefix)
+    end = bisect.bisect_left(keys, prefix + "\uffff")
+    return range(start, min(end, start + MAX_PREFIX_SCAN))
+
+
+class SymbolIndex:
+    def __init__(self, entries):
+        # entries: list of {"symbol", "shortName", "sector", "industry", "listed"}
+        # "listed" marks entries that only came from the exchange lists (no sector/industry),
+        # they rank after the well known stocks from our own CSV
+        self.entries = entries
+        names = [_normalize(entry["shortName"] or "") for entry in entries]
+
+        symbol_pairs = sorted((entry["symbol"], i) for i, entry in enumerate(entries))
+        self.symbol_keys = [key for key, _ in symbol_pairs]
+        self.symbol_rows = [i for _, i in symbol_pairs]
+
+        name_pairs = sorted((name, i) for i, name in enumerate(names) if name)
+        self.name_keys = [key for key, _ in name_pairs]
+        self.name_rows = [i for _, i in name_pairs]
+
+        word_pairs = sorted({(word, i) for i, name in enumerate(names) for word in name.split()})
+        self.word_keys = [key for key, _ in word_pairs]
+        self.word_rows = [i for _, i in word_pairs]
+
+        self.names = names
+        self.name_words = [name.split() for name in names]
+
+        # Fuzzy matching works on terms (a symbol or one word of a name):
+        # trigram -> ids of the terms containing it
+        terms = {}  # term -> rows it appears in
+        for i, entry in enumerate(entries):
+            for term in {entry["symbol"].lower(), *self.name_words[i]}:
+                terms.setdefault(term, []).append(i)
+        self.term_rows = list(terms.values())
+        self.term_sizes = [len(_trigrams(term)) for term in terms]
+        self.trigrams = {}
+        for term_id, term in enumerate(terms):
+            for gram in _trigrams(term):
+                self.trigrams.setdefault(gram, []).append(term_id)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def search(self, query: str, limit: int = 10):
+        """Best matches for a partial symbol or company name, best first"""
+        symbol_query = query.strip().upper()
+        name_query = _normalize(query)
+        if not symbol_query:
+            return []
+        matches = {}  # row -> (tier, score)
+
+        def add(row, tier, score=0.0):
+            if row not in matches or (tier, score) < matches[row]:
+                matches[row] = (tier, score)
+
+        for position in _prefix_range(self.symbol_keys, symbol_query):
+            row = self.symbol_rows[position]
+            add(row, EXACT if self.symbol_keys[position] == symbol_query else SYMBOL_PREFIX)
+
+        if name_query:
+            for position in _prefix_range(self.name_keys, name_query):
+                add(self.name_rows[position], NAME_PREFIX)
+
+            # Every word typed has to start some word of the name ("motor co" -> Ford Motor Company)
+            words = name_query.split()
+            longest = max(words, key=len)
+            others = [word for word in words if word is not longest]
+            for position in _prefix_range(self.word_keys, longest):
+                row = self.word_rows[position]
+                name_words = self.name_words[row]
+                if all(any(name_word.startswith(word) for name_word in name_words) for word in others):
+                    add(row, WORD_PREFIX)
+
+            # Only go fuzzy when the exact passes didn't find enough
+            if len(matches) < limit and len(name_query) >= 3:
+                for row, score in itertools.islice(self._fuzzy(name_query), MAX_PREFIX_SCAN):
+                    add(row, FUZZY, -score)
+
+        def rank(row):
+            entry = self.entries[row]
+            tier, score = matches[row]
+            return (tier != EXACT, tier == FUZZY, entry["listed"], tier, score, len(entry["symbol"]), entry["symbol"])
+
+        return [self._public(self.entries[row]) for row in heapq.nsmallest(limit, matches, key=rank)]
+
+    def _fuzzy(self, name_query: str):
+        # Score terms by the share of trigrams they have in common with the longest word typed
+        # (Dice coefficient): "mircosoft" vs "microsoft" -> 0.56, "aple" vs "apple" -> 0.67
+        grams = _trigrams(max(name_query.split(), key=len))
+        counts = Counter(itertools.chain.from_iterable(self.trigrams.get(gram, ()) for gram in grams))
+        for term_id, shared in counts.most_common(MAX_FUZZY_CANDIDATES):
+            score = 2 * shared / (len(grams) + self.term_sizes[term_id])
+            if score >= MIN_FUZZY_SCORE:
+                for row in self.term_rows[term_id]:
+                    yield row, score
+
+    @staticmethod
+    def _public(entry: dict):
+        return {key: entry[key] for key in ("symbol", "shortName", "sector", "industry")}
+
+
+def load_universe_csv(path: str):
+    entries = []
+    with open(path, newline="", encoding="utf-8") as f:
+        for row in csv.DictReader(f):
+            symbol = (row.get("symbol") or "").strip().upper()
+            if symbol:
+                entries.append({
+                    "symbol": symbol,
+                    "shortName": (row.get("shortName") or "").strip() or None,
+                    "sector": (row.get("sector") or "").strip() or None,
+                    "industry": (row.get("industry") or "").strip() or None,
+                    "listed": False
+                })
+    return entries
+
+
+def _parse_listing(text: str, symbol_column: str):
+    """Rows of a NASDAQ Trader symbol directory file (pipe separated, footer line at the end)"""
+    entries = []
+    for row in csv.DictReader(io.StringIO(text), delimiter="|"):
+        symbol = (row.get(symbol_column) or "").strip()
+        if not symbol or row.get("Test Issue") == "Y" or symbol.startswith("File Creation Time"):
+            continue
+        # "Apple Inc. - Common Stock" -> "Apple Inc."
+        name = (row.get("Security Name") or "").split(" - ")[0].strip()
+        entries.append({
+            # Yahoo writes share classes with a dash: BRK.B -> BRK-B
+            "symbol": symbol.replace(".", "-").upper(),
+            "shortName": name or None,
+            "sector": None,
+            "industry": None,
+            "listed": True
+        })
+    return entries
+
+
+def download_listed_symbols():
+    entries = []
+    for url, symbol_column in ((NASDAQ_LISTED_URL, "Symbol"), (OTHER_LISTED_URL, "ACT Symbol")):
+        response = requests.get(url, timeout=30)
+        response.raise_for_status()
+        entries.extend(_parse_listing(response.text, symbol_column))
+    return entries
+
+
+def build_universe(path: str = SYMBOL_UNIVERSE_PATH, download: bool = SYMBOL_UNIVERSE_DOWNLOAD):
+    """Our CSV plus (optionally) the exchange lists; the CSV wins when a symbol is in both"""
+    entries = {}
+    if download:
+        try:
+            for entry in download_listed_symbols():
+                entries[entry["symbol"]] = entry
+        except Exception as e:
+            # Not fatal: search still works on the CSV alone
+            logger.warning("Error downloading listed symbols: %s", e)
+    for entry in load_universe_csv(path):
+        entries[entry["symbol"]] = entry
+    return list(entries.values())
+
+
+class SymbolSearch:
+    """Holds the current index and keeps it fresh in the background"""
+
+    def __init__(self, refresh_interval: float = SYMBOL_INDEX_REFRESH):
+        self.refresh_interval = refresh_interval
+        self.index = None
+        self.built_at = None
+        self.lock = threading.Lock()
+        self.refresher = None
+
+    def get_index(self):
+        if self.index is None:
+            with self.lock:
+                if self.index is None:
+                    # First search: answer from the CSV right away, the exchange lists
+                    # are downloaded by the background thread
+                    self._swap(SymbolIndex(build_universe(download=False)))
+            self.start_background_refresh()
+        return self.index
+
+    def search(self, query: str, limit: int = 10):
+        return self.get_index().search(query, limit)
+
+    def refresh(self):
+        # Build the new index completely before swapping it in
+        self._swap(SymbolIndex(build_universe()))
+
+    def _swap(self, index: SymbolIndex):
+        self.index = index
+        self.built_at = time.time()
+
+    def start_background_refresh(self):
+        if self.refresher is not None:
+            return
+        with self.lock:
+            if self.refresher is not None:
+                return
+            self.refresher = threading.Thread(target=self._refresh_loop, name="symbol-index-refresh", daemon=True)
+            self.refresher.start()
+
+    def _refresh_loop(self):
+        while True:
+            try:
+                self.refresh()
+            except Exception as e:
+                logger.warning("Error refreshing symbol index: %s", e)
+            time.sleep(self.refresh_interval)
+
+    def stats(self):
+        index = self.index
+        return {"symbols": len(index) if index else 0, "built_at": self.built_at}
+
+
+# One search index shared by the whole app
+symbol_search = SymbolSearch()
+metrics.add_collector("symbol_index", symbol_search.stats)
@@ -0,0 +1,243 @@
+import logging
+import hashlib
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+import requests
+from firebase_admin import auth as firebase_auth
+from google.auth import jwt
+from config.settings import (
+    TOKEN_CACHE_SIZE, TOKEN_CHECK_REVOKED, TOKEN_REVOCATION_RECHECK, TOKEN_KEY_REFRESH, TOKEN_KEY_MIN_REFETCH,
+    FIREBASE_PROJECT_ID
+)
+from services.metrics import metrics
+from services.firebase_service import init_firebase
+
+logger = logging.getLogger(__name__)
+
+# Fast Firebase ID token verification for protected routes.
+#
+# firebase_auth.verify_id_token() does a full RSA signature check on every request.
+# A signed-in user sends the same token with every request until it expires (1 hour),
+# so we verify it once and remember the decoded claims (keyed by a hash of the token,
+# so raw tokens are never kept in memory) until the token's "exp".
+#
+# The public keys Google signs tokens with are also kept locally and refreshed by a
+# background thread, so a request never waits on a key download unless Google has
+# just rotated to a key we haven't seen yet. That download happens at most once every
+# TOKEN_KEY_MIN_REFETCH seconds, so a flood of tokens with made up key ids can't turn
+# every request into a call to Google.
+
+# Where Google publishes the certificates used to sign Firebase ID tokens
+CERTS_URL = "https://www.googleapis.com/robot/v1/metadata/x509/securetoken@system.gserviceaccount.com"
+ISSUER_PREFIX = "https://securetoken.google.com/"
+
+
+class InvalidTokenError(Exception):
+    pass
+
+
+def _token_hash(token: str):
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+class TokenVerifier:
+    def __init__(self, project_id: str = None, max_entries: int = TOKEN_CACHE_SIZE,
+                 check_revoked: bool = TOKEN_CHECK_REVOKED, revocation_recheck: float = TOKEN_REVOCATION_RECHECK,
+                 min_refetch: float = TOKEN_KEY_MIN_REFETCH):
+        self._project_id = project_id
+        self.max_entries = max_entries
+        self.check_revoked = check_revoked
+        self.revocation_recheck = revocation_recheck
+        self.min_refetch = min_refetch
+        # token hash -> (claims, exp, last revocation check), least recently used first
+        self.cache = OrderedDict()
+        self.lock = threading.Lock()
+        # key id -> PEM certificate
+        self.keys = {}
+        self.keys_lock = threading.Lock()
+        # Held while downloading keys for an unknown key id, so concurrent requests share one download
+        self.refetch_lock = threading.Lock()
+        self.refetched_at = None
+        self.refresher = None
+        self.hits = 0
+        self.misses = 0
+        self.unknown_keys = 0
+
+    @property
+    def project_id(self):
+        if self._project_id is None:
+            self._project_id = FIREBASE_PROJECT_ID or init_firebase().project_id
+        return self._project_id
+
+    def cached(self, token: str):
+        """
+        Claims for a token that was verified recently, without any network or crypto work.
+        Returns None when the token needs the full verify() (which may block on Google/Firebase).
+        """
+        if not token:
+            return None
+        if token.startswith("Bearer "):
+            token = token[len("Bearer "):]
+        key = _token_hash(token)
+        now = time.time()
+        with self.lock:
+            cached = self.cache.get(key)
+            if cached is None or cached[1] <= now:
+                return None
+            if self.check_revoked and now - cached[2] > self.revocation_recheck:
+                return None
+            self.cache.move_to_end(key)
+            self.hits += 1
+            return cached[0]
+
+    def verify(self, token: str):
+        """Return the decoded claims for a valid token, raising InvalidTokenError otherwise"""
+        if not token:
+            raise InvalidTokenError("Missing token")
+        if token.startswith("Bearer "):
+            token = token[len("Bearer "):]
+
+        key = _token_hash(token)
+        now = time.time()
+        with self.lock:
+            cached = self.cache.get(key)
+            if cached is not None and cached[1] > now:
+                self.cache.move_to_end(key)
+                self.hits += 1
+                claims, exp, checked_at = cached
+            else:
+                cached = None
+                self.cache.pop(key, None)
+                self.misses += 1
+
+        if cached is None:
+            claims = self._decode(token)
+            exp = claims["exp"]
+            checked_at = 0
+
+        if self.check_revoked and now - checked_at > self.revocation_recheck:
+            self._check_not_revoked(claims)
+            checked_at = now
+
+        if self.max_entries > 0:
+            with self.lock:
+                self.cache[key] = (claims, exp, checked_at)
+                self.cache.move_to_end(key)
+                while len(self.cache) > self.max_entries:
+                    self.cache.popitem(last=False)
+        return claims
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self.cache),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": (self.hits / lookups) if lookups else None,
+                "unknown_key_rejections": self.unknown_keys
+            }
+
+    def _decode(self, token: str):
+        # The emulator issues unsigned tokens, let the Firebase SDK deal with those
+        if os.getenv("FIREBASE_AUTH_EMULATOR_HOST"):
+            try:
+                return firebase_auth.verify_id_token(token, app=init_firebase())
+            except Exception as e:
+                raise InvalidTokenError(str(e))
+
+        try:
+            header = jwt.decode_header(token)
+            payload = jwt.decode(token, verify=False)
+        except ValueError as e:
+            raise InvalidTokenError(str(e))
+
+        # Same checks the Firebase SDK does before checking the signature
+        subject = payload.get("sub")
+        if header.get("alg") != "RS256":
+            raise InvalidTokenError("Token has incorrect algorithm")
+        if payload.get("aud") != self.project_id:
+            raise InvalidTokenError("Token has incorrect audience")
+        if payload.get("iss") != ISSUER_PREFIX + self.project_id:
+            raise InvalidTokenError("Token has incorrect issuer")
+        if not isinstance(subject, str) or not subject or len(subject) > 128:
+            raise InvalidTokenError("Token has an invalid subject")
+
+        certificate = self._key_for(header.get("kid"))
+        try:
+            claims = jwt.decode(token, certs={header["kid"]: certificate}, audience=self.project_id)
+        except ValueError as e:
+            raise InvalidTokenError(str(e))
+        claims["uid"] = claims["sub"]
+        return claims
+
+    def _check_not_revoked(self, claims: dict):
+        try:
+            user = firebase_auth.get_user(claims["uid"], app=init_firebase())
+        except Exception as e:
+            raise InvalidTokenError(str(e))
+        if user.disabled:
+            raise InvalidTokenError("User is disabled")
+        # Tokens issued before the user's "valid after" time have been revoked
+        if user.tokens_valid_after_timestamp and claims["iat"] * 1000 < user.tokens_valid_after_timestamp:
+            raise InvalidTokenError("Token has been revoked")
+
+    def _key_for(self, kid: str):
+        if not kid:
+            raise InvalidTokenError("Token has no key id")
+        with self.keys_lock:
+            certificate = self.keys.get(kid)
+        if certificate is None:
+            # Probably a freshly rotated key: fetch once right now, unless we just did
+            with self.refetch_lock:
+                with self.keys_lock:
+                    certificate = self.keys.get(kid)
+                now = time.monotonic()
+                if certificate is None and (self.refetched_at is None or now - self.refetched_at >= self.min_refetch):
+                    self.refetched_at = now
+                    self.refresh_keys()
+                    with self.keys_lock:
+                        certificate = self.keys.get(kid)
+        if certificate is None:
+            with self.lock:
+                self.unknown_keys += 1
+            raise InvalidTokenError("Token was signed with an unknown key")
+        self.start_background_refresh()
+        return certificate
+
+    def refresh_keys(self):
+        """Download Google's current signing certificates. Returns seconds until they should be refreshed."""
+        response = requests.get(CERTS_URL, timeout=10)
+        response.raise_for_status()
+        with self.keys_lock:
+            self.keys = response.json()
+        match = re.search(r"max-age=(\d+)", response.headers.get("Cache-Control", ""))
+        return int(match.group(1)) if match else TOKEN_KEY_REFRESH
+
+    def start_background_refresh(self):
+        if self.refresher is not None:
+            return
+        with self.keys_lock:
+            if self.refresher is not None:
+                return
+            self.refresher = threading.Thread(target=self._refresh_loop, name="token-key-refresh", daemon=True)
+            self.refresher.start()
+
+    def _refresh_loop(self):
+        delay = TOKEN_KEY_REFRESH
+        while True:
+            # Refresh well before the keys expire
+            time.sleep(max(delay / 2, 60))
+            try:
+                delay = self.refresh_keys()
+            except Exception as e:
+                logger.warning("Error refreshing token signing keys: %s", e)
+                delay = 120
+
+
+# One verifier shared by the whole app
+token_verifier = TokenVerifier()
+metrics.add_collector("token_cache", token_verifier.stats)
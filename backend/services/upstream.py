@@ -0,0 +1,127 @@
+import asyncio
+import math
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from fastapi import HTTPException
+from config.settings import (
+    MARKET_DATA_CONCURRENCY, MARKET_DATA_QUEUE, MARKET_DATA_TIMEOUT,
+    DATABASE_CONCURRENCY, DATABASE_QUEUE, DATABASE_TIMEOUT
+)
+from services.metrics import metrics
+
+# Execution layer for blocking calls to upstream services.
+#
+# yfinance and the Firestore / Firebase Auth clients are blocking. Calling them directly from an
+# async route freezes the event loop (and every websocket) until they answer, so every such call
+# goes through one of the pools below instead:
+#   - market_data: Yahoo Finance (quotes, history downloads)
+#   - database:    Firestore and Firebase Auth
+# Each pool has its own threads, so a slow Yahoo can't use up the threads Firestore needs.
+#
+# Each pool also limits how much work may pile up. When more than `concurrency + queue_size`
+# calls are waiting, new calls are refused straight away with a 503 (and a Retry-After header)
+# instead of queueing forever, so a burst degrades into quick errors rather than everyone timing out.
+# Every call also has a timeout (504 when it runs out).
+
+
+class UpstreamOverloaded(HTTPException):
+    """Raised (as a 503) when a pool already has as much waiting work as it is allowed"""
+
+    def __init__(self, pool: str, retry_after: int):
+        super().__init__(
+            status_code=503,
+            detail=f"The {pool} service is busy, please try again shortly",
+            headers={"Retry-After": str(retry_after)}
+        )
+
+
+class UpstreamTimeout(HTTPException):
+    """Raised (as a 504) when an upstream call takes longer than its timeout"""
+
+    def __init__(self, pool: str, timeout: float):
+        super().__init__(status_code=504, detail=f"The {pool} service did not answer within {timeout:g} seconds")
+
+
+class UpstreamPool:
+    def __init__(self, name: str, concurrency: int, queue_size: int, timeout: float):
+        self.name = name
+        self.concurrency = concurrency
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self.executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix=name)
+        # Calls submitted and not finished yet (running or waiting for a thread).
+        # A call that timed out still counts until its thread is really done with it.
+        self.in_flight = 0
+        self.lock = threading.Lock()
+        # Moving average of how long calls take, used to suggest a Retry-After
+        self.average_seconds = 0.1
+        self.completed = 0
+        self.rejected = 0
+        self.timeouts = 0
+        self.errors = 0
+
+    async def run(self, func, *args, timeout: float = -1, **kwargs):
+        """
+        Run func(*args, **kwargs) on this pool's threads without blocking the event loop.
+        timeout defaults to the pool's timeout; pass None to wait as long as it takes.
+        """
+        with self.lock:
+            if self.in_flight >= self.concurrency + self.queue_size:
+                self.rejected += 1
+                raise UpstreamOverloaded(self.name, self._retry_after())
+            self.in_flight += 1
+
+        started = time.monotonic()
+        try:
+            future = self.executor.submit(func, *args, **kwargs)
+        except Exception:
+            self._finished(started, failed=True)
+            raise
+        future.add_done_callback(lambda done: self._finished(started, failed=done.exception() is not None))
+
+        if timeout == -1:
+            timeout = self.timeout
+        try:
+            # shield: if we stop waiting, the thread keeps its result instead of being left half-cancelled
+            return await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(future)), timeout)
+        except asyncio.TimeoutError:
+            with self.lock:
+                self.timeouts += 1
+            raise UpstreamTimeout(self.name, timeout)
+
+    def _finished(self, started: float, failed: bool):
+        # Runs on the worker thread when a call ends (or right away if it never started)
+        elapsed = time.monotonic() - started
+        with self.lock:
+            self.in_flight -= 1
+            self.completed += 1
+            if failed:
+                self.errors += 1
+            self.average_seconds += 0.1 * (elapsed - self.average_seconds)
+        # Includes the time spent waiting for a free thread
+        metrics.observe("upstream_call_ms", elapsed * 1000, pool=self.name, outcome="error" if failed else "ok")
+
+    def _retry_after(self):
+        # Roughly how long until the work already queued has drained (at least a second)
+        return max(1, math.ceil(self.in_flight / self.concurrency * self.average_seconds))
+
+    def stats(self):
+        with self.lock:
+            return {
+                "concurrency": self.concurrency,
+                "queue_size": self.queue_size,
+                "timeout": self.timeout,
+                "in_flight": self.in_flight,
+                "completed": self.completed,
+                "rejected": self.rejected,
+                "timeouts": self.timeouts,
+                "errors": self.errors,
+                "average_ms": round(self.average_seconds * 1000, 2)
+            }
+
+
+# Shared pools, one per upstream service
+market_data = UpstreamPool("market-data", MARKET_DATA_CONCURRENCY, MARKET_DATA_QUEUE, MARKET_DATA_TIMEOUT)
+database = UpstreamPool("database", DATABASE_CONCURRENCY, DATABASE_QUEUE, DATABASE_TIMEOUT)
+metrics.add_collector("upstream", lambda: {"market_data": market_data.stats(), "database": database.stats()})
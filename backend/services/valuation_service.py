@@ -0,0 +1,249 @@
+import asyncio
+import time
+from datetime import datetime
+from config.settings import VALUATION_RELOAD, VALUATION_IDLE
+from services.ledger_service import apply_entry
+from services.quote_hub import quote_hub
+from services.stock_service import get_user_data, get_stocks_data, add_trade_listener
+from services.upstream import database
+from services.metrics import metrics
+
+# Mark-to-market portfolio valuation.
+#
+# Every user we have been asked about is kept in an in-memory position index together with
+# the latest price of each symbol they hold and their running totals (market value, cost basis).
+# A reverse index (symbol -> users holding it) means a new quote only touches the users that
+# hold that symbol, and each of them is updated with a constant-time delta:
+#     market value += quantity * (new price - old price)
+# so there is no re-reading Firestore and no re-fetching every quote.
+# Quotes come from the shared quote hub, the same one that feeds /ws/stock-updates.
+# Trades committed while a user is being (re)loaded are kept and replayed on the loaded copy,
+# skipping the ones the document already included (each trade carries its ledger seq).
+
+
+class UserPositions:
+    def __init__(self, uid: str, portfolio: dict, balance: float, seq: int = 0):
+        self.uid = uid
+        self.balance = balance
+        self.seq = seq           # ledger seq of the last trade included
+        self.positions = {}      # symbol -> {"quantity", "average_buy_price"}
+        self.prices = {}         # symbol -> last known price
+        # Running totals, kept up to date one position at a time
+        self.market_value = 0.0  # sum of quantity * price over positions with a known price
+        self.priced_cost = 0.0   # sum of quantity * average_buy_price over the same positions
+        self.cost_basis = 0.0    # sum of quantity * average_buy_price over all positions
+        self.loaded_at = time.monotonic()
+        self.last_access = time.monotonic()
+        self.subscribers = set()  # websocket Subscribers streaming this user's value
+        for symbol, position in portfolio.items():
+            self.add(symbol.upper(), position)
+
+    def add(self, symbol: str, position: dict):
+        position = {"quantity": position["quantity"], "average_buy_price": position["average_buy_price"]}
+        self.positions[symbol] = position
+        cost = position["quantity"] * position["average_buy_price"]
+        self.cost_basis += cost
+        if symbol in self.prices:
+            self.market_value += position["quantity"] * self.prices[symbol]
+            self.priced_cost += cost
+
+    def remove(self, symbol: str):
+        position = self.positions.pop(symbol, None)
+        if position is None:
+            return
+        cost = position["quantity"] * position["average_buy_price"]
+        self.cost_basis -= cost
+        if symbol in self.prices:
+            self.market_value -= position["quantity"] * self.prices[symbol]
+            self.priced_cost -= cost
+
+    def set_price(self, symbol: str, price: float):
+        # Constant-time update of the running totals
+        position = self.positions.get(symbol)
+        if position is None or price is None:
+            return False
+        old_price = self.prices.get(symbol)
+        if old_price == price:
+            return False
+        if old_price is None:
+            old_price = 0.0
+            self.priced_cost += position["quantity"] * position["average_buy_price"]
+        self.market_value += position["quantity"] * (price - old_price)
+        self.prices[symbol] = price
+        return True
+
+    def summary(self):
+        unrealized = self.market_value - self.priced_cost
+        return {
+            "balance": self.balance,
+            "market_value": round(self.market_value, 2),
+            "cost_basis": round(self.cost_basis, 2),
+            "unrealized_pl": round(unrealized, 2),
+            "unrealized_pl_percent": round(unrealized / self.priced_cost * 100, 4) if self.priced_cost else 0.0,
+            "total_value": round(self.balance + self.market_value, 2),
+            "timestamp": datetime.now().isoformat()
+        }
+
+
+class PositionIndex:
+    def __init__(self, hub=quote_hub):
+        self.hub = hub
+        self.users = {}         # uid -> UserPositions
+        self.symbol_users = {}  # symbol -> set of uids holding it
+        self.loading = {}       # uid -> asyncio.Task loading that user from Firestore
+        self.pending = {}       # uid -> transaction lists committed while that user is being loaded
+        hub.add_listener(self.on_quote)
+        add_trade_listener(self.apply_transactions)
+
+    async def get(self, uid: str):
+        """The user's indexed positions, loading them from Firestore the first time (or when stale)"""
+        user = self.users.get(uid)
+        if user is None or time.monotonic() - user.loaded_at > VALUATION_RELOAD:
+            # Several requests for the same user at once share one load
+            task = self.loading.get(uid)
+            if task is None:
+                task = asyncio.ensure_future(self._load(uid))
+                self.loading[uid] = task
+                task.add_done_callback(lambda _: self.loading.pop(uid, None))
+            user = await task
+        user.last_access = time.monotonic()
+        return user
+
+    async def valuation(self, uid: str):
+        user = await self.get(uid)
+        result = user.summary()
+        result["positions"] = [
+            {
+                "symbol": symbol,
+                "quantity": position["quantity"],
+                "average_buy_price": position["average_buy_price"],
+                "price": user.prices.get(symbol),
+                "market_value": round(position["quantity"] * user.prices[symbol], 2) if symbol in user.prices else None,
+                "unrealized_pl": round(position["quantity"] * (user.prices[symbol] - position["average_buy_price"]), 2)
+                                 if symbol in user.prices else None
+            }
+            for symbol, position in sorted(user.positions.items())
+        ]
+        return result
+
+    def on_quote(self, symbol: str, message: dict):
+        # Called by the quote hub for every update: revalue only the users holding this symbol
+        price = message.get("price")
+        for uid in self.symbol_users.get(symbol, ()):
+            user = self.users[uid]
+            if user.set_price(symbol, price):
+                self._publish(user, [symbol])
+
+    def apply_transactions(self, uid: str, transactions: list):
+        """Update an indexed user right after their trades commit (same replay math as the ledger)"""
+        if uid in self.pending:
+            # Being loaded: the document may have been read before this trade
+            self.pending[uid].append(transactions)
+        user = self.users.get(uid)
+        if user is None:
+            return
+        # Skip trades the user's document already had when it was read
+        transactions = [transaction for transaction in transactions
+                        if transaction.get("seq") is None or transaction["seq"] > user.seq]
+        if not transactions:
+            return
+        before = set(user.positions)
+        portfolio = {symbol: dict(position) for symbol, position in user.positions.items()}
+        balance = user.balance
+        for transaction in transactions:
+            balance = apply_entry(portfolio, balance, transaction)
+            user.seq = max(user.seq, transaction.get("seq") or 0)
+
+        changed = sorted({transaction["symbol"] for transaction in transactions})
+        for symbol in changed:
+            user.remove(symbol)
+            if symbol not in portfolio:
+                user.prices.pop(symbol, None)
+                continue
+            # The fill price is the freshest price we know if the hub hasn't sent one yet
+            if symbol not in user.prices:
+                user.prices[symbol] = next(t["price"] for t in reversed(transactions) if t["symbol"] == symbol)
+            user.add(symbol, portfolio[symbol])
+
+        user.balance = balance
+        self._reindex(uid, before, set(user.positions))
+        self._publish(user, changed)
+
+    def add_subscriber(self, user: UserPositions, subscriber):
+        user.subscribers.add(subscriber)
+        subscriber.offer({"type": "portfolio", **user.summary()})
+
+    def remove_subscriber(self, user: UserPositions, subscriber):
+        user.subscribers.discard(subscriber)
+
+    async def _load(self, uid: str):
+        self._evict_idle()
+        self.pending[uid] = []
+        try:
+            data = await database.run(get_user_data, uid)
+        finally:
+            pending = self.pending.pop(uid)
+        user = UserPositions(uid, data.get("portfolio", {}), data.get("initial_balance", 0.0), data.get("ledger_seq", 0))
+
+        old = self.users.get(uid)
+        if old is not None:
+            user.subscribers = old.subscribers
+        self.users[uid] = user
+        self._reindex(uid, set(old.positions) if old else set(), set(user.positions))
+        for transactions in pending:
+            self.apply_transactions(uid, transactions)
+
+        # Seed prices: whatever the hub already has, then one batch lookup for the rest
+        missing = []
+        for symbol in user.positions:
+            latest = self.hub.latest.get(symbol)
+            if latest and latest.get("price") is not None:
+                user.set_price(symbol, latest["price"])
+            else:
+                missing.append(symbol)
+        if missing:
+            quotes = await get_stocks_data(missing)
+            for symbol, quote in quotes["quotes"].items():
+                user.set_price(symbol, quote.get("price"))
+        return user
+
+    def stats(self):
+        return {
+            "users": len(self.users),
+            "symbols": len(self.symbol_users),
+            "connections": sum(len(user.subscribers) for user in self.users.values())
+        }
+
+    def _reindex(self, uid: str, old_symbols: set, new_symbols: set):
+        added = new_symbols - old_symbols
+        removed = old_symbols - new_symbols
+        for symbol in added:
+            self.symbol_users.setdefault(symbol, set()).add(uid)
+        for symbol in removed:
+            holders = self.symbol_users.get(symbol)
+            if holders is not None:
+                holders.discard(uid)
+                if not holders:
+                    del self.symbol_users[symbol]
+        # Keep the hub polling every symbol somebody in the index holds
+        self.hub.watch(added)
+        self.hub.unwatch(removed)
+
+    def _evict_idle(self):
+        now = time.monotonic()
+        for uid, user in list(self.users.items()):
+            if not user.subscribers and now - user.last_access > VALUATION_IDLE:
+                del self.users[uid]
+                self._reindex(uid, set(user.positions), set())
+
+    def _publish(self, user: UserPositions, changed_symbols):
+        if not user.subscribers:
+            return
+        tick = {"type": "portfolio", "changed": changed_symbols, **user.summary()}
+        for subscriber in list(user.subscribers):
+            subscriber.offer(tick)
+
+
+# One index shared by the whole app
+position_index = PositionIndex()
+metrics.add_collector("portfolio_streams", position_index.stats)
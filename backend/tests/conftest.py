@@ -0,0 +1,48 @@
+"""
+Shared setup for the backend tests: the app runs in-process against the fakes from
+benchmarks/fakes.py (in-memory Firestore, synthetic market data), so nothing leaves the process.
+
+Run from the backend folder:
+    python -m pytest tests
+"""
+import os
+import sys
+import tempfile
+
+# Settings are read when config.settings is first imported, so these have to be set before
+# anything from the app is imported
+os.environ.setdefault("HISTORY_DIR", tempfile.mkdtemp(prefix="test-history-"))
+os.environ.setdefault("SYMBOL_UNIVERSE_DOWNLOAD", "false")
+os.environ.setdefault("FIREBASE_PROJECT_ID", "test-project")
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks import fakes  # noqa: E402
+
+fake_db, fake_provider = fakes.install()
+
+import pytest  # noqa: E402
+from fastapi.testclient import TestClient  # noqa: E402
+import main  # noqa: E402
+from routes.auth import verify_token  # noqa: E402
+
+USER_ID = "test-user"
+
+
+@pytest.fixture
+def db():
+    # Every test starts with an empty database
+    with fake_db.lock:
+        fake_db.collections.clear()
+        fake_db.versions.clear()
+    return fake_db
+
+
+@pytest.fixture
+def client(db):
+    main.app.dependency_overrides[verify_token] = lambda: USER_ID
+    try:
+        yield TestClient(main.app)
+    finally:
+        main.app.dependency_overrides.pop(verify_token, None)
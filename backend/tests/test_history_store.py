@@ -0,0 +1,41 @@
+import os
+from datetime import date
+import numpy as np
+from services import history_store
+
+START, END = date(2024, 1, 1), date(2024, 3, 1)
+
+
+def folder(symbol):
+    return history_store._folder(symbol, "1d")
+
+
+def test_corrupt_meta_is_downloaded_again():
+    expected = history_store.get_history("CORRUPT", START, END)
+    with open(os.path.join(folder("CORRUPT"), "meta.json"), "w") as f:
+        f.write('{"start": "2024-01-01", "en')
+    assert history_store._read_meta(folder("CORRUPT")) is None
+
+    again = history_store.get_history("CORRUPT", START, END)
+    np.testing.assert_array_equal(again["date"], expected["date"])
+    assert history_store._read_meta(folder("CORRUPT")) is not None
+
+
+def test_write_leaves_other_writers_versions_alone():
+    history_store.get_history("SHARED", START, END)
+    # Another worker is halfway through writing the next version
+    meta = history_store._read_meta(folder("SHARED"))
+    other = os.path.join(folder("SHARED"), f"v{int(os.path.basename(meta[3])[1:]) + 1:06d}")
+    os.mkdir(other)
+    with open(os.path.join(other, "date.npy"), "wb") as f:
+        f.write(b"partial")
+
+    columns = history_store._read_columns(meta[3])
+    history_store._write(folder("SHARED"), {name: np.array(values) for name, values in columns.items()},
+                         START, END)
+    new_meta = history_store._read_meta(folder("SHARED"))
+    assert os.path.dirname(new_meta[3]) == folder("SHARED")
+    assert new_meta[3] not in (meta[3], other)
+    with open(os.path.join(other, "date.npy"), "rb") as f:
+        assert f.read() == b"partial"
+    assert not [name for name in os.listdir(folder("SHARED")) if name.endswith(".tmp")]
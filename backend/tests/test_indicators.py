@@ -0,0 +1,30 @@
+import numpy as np
+import pytest
+from services.indicator_service import INDICATORS, parse_spec, _ewm
+
+CLOSES = 100 + np.cumsum(np.random.default_rng(7).normal(size=1000))
+
+
+def naive_ewm(values, alpha, initial):
+    out = []
+    previous = initial
+    for value in values:
+        previous = previous + alpha * (value - previous)
+        out.append(previous)
+    return np.array(out)
+
+
+@pytest.mark.parametrize("alpha", [1.0, 2 / 3, 0.5, 2 / 21, 1 / 14, 0.01])
+def test_ewm_matches_recurrence(alpha):
+    expected = naive_ewm(CLOSES, alpha, CLOSES[0])
+    with np.errstate(all="raise"):
+        result = _ewm(CLOSES, alpha, CLOSES[0])
+    np.testing.assert_allclose(result, expected, rtol=1e-9)
+
+
+@pytest.mark.parametrize("spec", ["ema:1", "rsi:1", "macd:1:2:1"])
+def test_period_one_gives_values(spec):
+    _, name, params = parse_spec(spec)
+    outputs = INDICATORS[name][0](*params).compute(CLOSES)
+    for values in (outputs.values() if isinstance(outputs, dict) else [outputs]):
+        assert not np.isnan(np.asarray(values, dtype=np.float64)[5:]).any()
@@ -0,0 +1,106 @@
+from conftest import USER_ID
+from services import ledger_service
+
+# A user document as written before the ledger existed: every trade in a "transactions" array,
+# no ledger_seq. The legacy sell never credited the balance, so the balance on the document is
+# not what replaying the trades gives; the migration must keep what the user actually has.
+LEGACY_USER = {
+    "email": "legacy@example.com",
+    "initial_balance": 497000.0,
+    "portfolio": {
+        "AAPL": {"quantity": 5, "average_buy_price": 200.0, "last_updated": "2024-01-03T10:00:00"},
+        "MSFT": {"quantity": 5, "average_buy_price": 400.0, "last_updated": "2024-01-02T10:00:00"}
+    },
+    "transactions": [
+        {"type": "BUY", "symbol": "MSFT", "quantity": 5, "price": 400.0, "total_cost": 2000.0,
+         "timestamp": "2024-01-02T10:00:00"},
+        {"type": "BUY", "symbol": "AAPL", "quantity": 10, "price": 200.0, "total_cost": 2000.0,
+         "timestamp": "2024-01-03T10:00:00"},
+        {"type": "SELL", "symbol": "AAPL", "quantity": 5, "price": 210.0, "total_sale_amount": 1050.0,
+         "timestamp": "2024-01-04T10:00:00"}
+    ]
+}
+
+
+def add_legacy_user(db):
+    db.collection("users").document(USER_ID).set(LEGACY_USER)
+
+
+def user_data(db):
+    return db.collection("users").document(USER_ID).get().to_dict()
+
+
+def ledger(db):
+    return [doc.to_dict() for doc in ledger_service.ledger_ref(db, USER_ID).order_by("seq").stream()]
+
+
+def test_history_includes_legacy_trades(client, db):
+    add_legacy_user(db)
+    response = client.get("/api/trades/history")
+    assert response.status_code == 200
+    history = response.json()["transactions"]
+    assert [(entry["seq"], entry["type"], entry["symbol"]) for entry in history] == [
+        (3, "SELL", "AAPL"), (2, "BUY", "AAPL"), (1, "BUY", "MSFT")
+    ]
+    assert user_data(db)["ledger_seq"] == 3
+    assert user_data(db)[ledger_service.MIGRATED_FIELD] is True
+
+
+def test_migration_happens_once(client, db):
+    add_legacy_user(db)
+    client.get("/api/trades/history")
+    client.get("/api/trades/history")
+    client.get("/api/trades/holdings")
+    assert len(ledger(db)) == 3
+
+
+def test_holdings_keep_legacy_positions_and_balance(client, db):
+    add_legacy_user(db)
+    response = client.get("/api/trades/holdings")
+    assert response.status_code == 200
+    holdings = response.json()
+    assert holdings["balance"] == LEGACY_USER["initial_balance"]
+    assert holdings["seq"] == 3
+    assert {symbol: position["quantity"] for symbol, position in holdings["portfolio"].items()} == {
+        "AAPL": 5, "MSFT": 5
+    }
+
+
+def test_first_trade_appends_after_legacy_trades(client, db):
+    add_legacy_user(db)
+    response = client.post("/api/trades/sell", json={"symbol": "MSFT", "quantity": 2})
+    assert response.status_code == 200
+    price = response.json()["transaction"]["price"]
+
+    entries = ledger(db)
+    assert [entry["seq"] for entry in entries] == [1, 2, 3, 4]
+    assert [entry.get("legacy", False) for entry in entries] == [True, True, True, False]
+    assert entries[-1]["symbol"] == "MSFT" and entries[-1]["type"] == "SELL"
+
+    # The snapshot is taken before the trade, so replaying the new trade on top of it
+    # gives the same state as the user document
+    holdings = client.get("/api/trades/holdings").json()
+    user = user_data(db)
+    assert holdings["balance"] == user["initial_balance"] == LEGACY_USER["initial_balance"] + 2 * price
+    assert holdings["portfolio"]["MSFT"]["quantity"] == user["portfolio"]["MSFT"]["quantity"] == 3
+    assert holdings["portfolio"]["AAPL"]["quantity"] == 5
+
+
+def test_export_includes_legacy_trades(client, db):
+    add_legacy_user(db)
+    response = client.get("/api/trades/history/export?format=csv")
+    assert response.status_code == 200
+    rows = response.text.strip().splitlines()
+    assert len(rows) == 4  # header + 3 trades
+
+
+def test_new_users_are_not_migrated(client, db):
+    db.collection("users").document(USER_ID).set({
+        "email": "new@example.com", "initial_balance": 500000.0, "starting_balance": 500000.0,
+        "portfolio": {}, "ledger_seq": 0
+    })
+    assert client.get("/api/trades/history").json() == {"transactions": [], "next_cursor": None}
+    assert ledger_service.MIGRATED_FIELD not in user_data(db)
+    response = client.post("/api/trades/buy", json={"symbol": "AAPL", "quantity": 1})
+    assert response.status_code == 200
+    assert [entry["seq"] for entry in ledger(db)] == [1]
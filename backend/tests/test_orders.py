@@ -0,0 +1,50 @@
+import asyncio
+from conftest import USER_ID, fake_provider
+from services.order_service import order_engine, FILLED
+from services.quote_hub import fetch_quote
+
+
+def add_user(db, balance: float = 500000.0):
+    db.collection("users").document(USER_ID).set({
+        "email": "orders@example.com", "initial_balance": balance, "starting_balance": balance,
+        "portfolio": {}, "ledger_seq": 0
+    })
+
+
+def test_limit_order_fills_on_regular_market_price(db, monkeypatch):
+    # ETFs and indices report regularMarketPrice but no currentPrice
+    get_info = fake_provider.get_info
+
+    def fund_info(symbol):
+        info = get_info(symbol)
+        info.pop("currentPrice", None)
+        return info
+
+    monkeypatch.setattr(fake_provider, "get_info", fund_info)
+    add_user(db)
+
+    async def run():
+        quote = await asyncio.to_thread(fetch_quote, "SPY")
+        assert quote["price"] is not None
+        # A limit well above the price, so the quote triggers it
+        order = await order_engine.place(USER_ID, "SPY", "BUY", "limit", 1, limit_price=quote["price"] * 2)
+        order_engine.on_quote("SPY", quote)
+        if order_engine.flusher is not None:
+            await order_engine.flusher
+        return order["id"], quote["price"]
+
+    order_id, price = asyncio.run(run())
+    stored = db.collection("orders").document(order_id).get().to_dict()
+    assert stored["status"] == FILLED
+    assert stored["fill_price"] == price
+    portfolio = db.collection("users").document(USER_ID).get().to_dict()["portfolio"]
+    assert portfolio["SPY"]["quantity"] == 1
+
+
+def test_invalid_symbols_are_rejected(client, db):
+    add_user(db)
+    for symbol in ("FOO BAR", "X" * 200, "aapl;drop", ""):
+        response = client.post("/api/orders", json={"symbol": symbol, "side": "BUY", "type": "limit",
+                                                     "quantity": 1, "limit_price": 10})
+        assert response.status_code == 400, symbol
+    assert not list(db.collection("orders").stream())